@@ -0,0 +1,267 @@
+"""
+Persistent alert and block history for the dashboard.
+
+Alerts and BLOCK / UNBLOCK commands are appended to a SQLite database in WAL
+mode, so readers (the Flask query endpoints) never wait on the writer. The
+MQTT thread only puts messages on a bounded queue; a writer thread drains it
+and commits each drained batch in one transaction. The same transaction
+upserts a per-minute, per-attack-type rollup, so chart queries never scan the
+raw alerts.
+
+Listings are paged with a keyset cursor ("<ts>:<id>" of the last row) over
+indexes on (ts), (source_ip, ts) and (attack_type, ts), so a page costs the
+same on the millionth alert as on the first.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+BATCH_SIZE = 5000        # rows per transaction at most
+FLUSH_INTERVAL = 0.5     # seconds the writer waits for more rows
+MAX_PENDING = 100000     # queued rows; beyond this new rows are dropped
+MAX_PAGE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    source_ip TEXT,
+    attack_type TEXT,
+    severity TEXT,
+    confidence REAL,
+    protocol TEXT
+);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+CREATE INDEX IF NOT EXISTS alerts_source_ts ON alerts (source_ip, ts);
+CREATE INDEX IF NOT EXISTS alerts_type_ts ON alerts (attack_type, ts);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    command TEXT,
+    target TEXT,
+    reason TEXT,
+    ttl REAL,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS commands_ts ON commands (ts);
+CREATE INDEX IF NOT EXISTS commands_target_ts ON commands (target, ts);
+CREATE TABLE IF NOT EXISTS alert_rollups (
+    minute INTEGER NOT NULL,
+    attack_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    max_confidence REAL,
+    PRIMARY KEY (minute, attack_type)
+) WITHOUT ROWID;
+"""
+
+
+def to_epoch(value, default=None):
+    """Epoch seconds from a number or an ISO-8601 string (None -> default)"""
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value)).timestamp()
+
+
+def parse_cursor(cursor):
+    """'<ts>:<id>' -> (ts, id), None for the first page"""
+    if not cursor:
+        return None
+    ts, row_id = str(cursor).rsplit(':', 1)
+    return float(ts), int(row_id)
+
+
+class AlertStore:
+    """Append-only SQLite store written in batches by a background thread"""
+
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_pending=MAX_PENDING):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+        self.written = 0
+        self.dropped = 0
+        db = self._connect()
+        db.executescript(SCHEMA)
+        db.commit()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        """One connection per thread (sqlite3 connections are not shareable)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            # WAL + NORMAL: a crash can lose the last batch, never corrupt the file
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    # --- Writes (any thread) ---
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def add_alert(self, alert):
+        self._put(('alert', alert))
+
+    def add_command(self, command):
+        """Record a BLOCK / UNBLOCK command"""
+        self._put(('command', command))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far is committed"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"❌ Alert store: failed to write {len(batch)} rows: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        now = time.time()
+        alerts, commands, rollups = [], [], {}
+        for kind, payload in batch:
+            try:
+                ts = to_epoch(payload.get('timestamp'), now)
+            except ValueError:
+                ts = now
+            if kind == 'alert':
+                confidence = float(payload.get('confidence') or 0.0)
+                alerts.append((ts, payload.get('source_ip'), payload.get('attack_type'),
+                               payload.get('severity'), confidence, payload.get('source')))
+                key = (int(ts // 60) * 60, payload.get('attack_type') or 'Unknown')
+                count, best = rollups.get(key, (0, 0.0))
+                rollups[key] = (count + 1, max(best, confidence))
+            else:
+                commands.append((ts, payload.get('command'), payload.get('target'),
+                                 payload.get('reason'), payload.get('ttl'), json.dumps(payload)))
+        db = self._connect()
+        with db:
+            db.executemany('INSERT INTO alerts (ts, source_ip, attack_type, severity, confidence, protocol) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', alerts)
+            db.executemany('INSERT INTO commands (ts, command, target, reason, ttl, payload) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', commands)
+            db.executemany('INSERT INTO alert_rollups (minute, attack_type, count, max_confidence) '
+                           'VALUES (?, ?, ?, ?) ON CONFLICT (minute, attack_type) DO UPDATE SET '
+                           'count = count + excluded.count, '
+                           'max_confidence = MAX(max_confidence, excluded.max_confidence)',
+                           [(minute, attack, count, best) for (minute, attack), (count, best) in rollups.items()])
+        self.written += len(batch)
+
+    # --- Queries (Flask threads) ---
+
+    def _page(self, sql, filters, params, cursor, limit):
+        limit = max(1, min(int(limit), MAX_PAGE))
+        after = parse_cursor(cursor)
+        if after is not None:
+            filters.append('(ts, id) < (?, ?)')
+            params.extend(after)
+        where = f"WHERE {' AND '.join(filters)}" if filters else ''
+        rows = self._connect().execute(f"{sql} {where} ORDER BY ts DESC, id DESC LIMIT ?",
+                                       params + [limit]).fetchall()
+        next_cursor = f"{rows[-1]['ts']!r}:{rows[-1]['id']}" if len(rows) == limit else None
+        return rows, next_cursor
+
+    @staticmethod
+    def _time_filters(start, end, filters, params):
+        if start is not None:
+            filters.append('ts >= ?')
+            params.append(start)
+        if end is not None:
+            filters.append('ts < ?')
+            params.append(end)
+
+    def query_alerts(self, start=None, end=None, source_ip=None, attack_type=None,
+                     cursor=None, limit=100):
+        """Newest-first page of alerts -> (alerts, next cursor or None)"""
+        filters, params = [], []
+        self._time_filters(start, end, filters, params)
+        if source_ip:
+            filters.append('source_ip = ?')
+            params.append(source_ip)
+        if attack_type:
+            filters.append('attack_type = ?')
+            params.append(attack_type)
+        rows, next_cursor = self._page('SELECT * FROM alerts', filters, params, cursor, limit)
+        alerts = [{
+            'id': row['id'],
+            'timestamp': datetime.fromtimestamp(row['ts']).isoformat(),
+            'attack_type': row['attack_type'],
+            'confidence': row['confidence'],
+            'source': row['protocol'],
+            'severity': row['severity'],
+            'source_ip': row['source_ip'],
+        } for row in rows]
+        return alerts, next_cursor
+
+    def query_commands(self, start=None, end=None, target=None, command=None,
+                       cursor=None, limit=100):
+        """Newest-first page of BLOCK / UNBLOCK commands -> (commands, next cursor or None)"""
+        filters, params = [], []
+        self._time_filters(start, end, filters, params)
+        if target:
+            filters.append('target = ?')
+            params.append(target)
+        if command:
+            filters.append('command = ?')
+            params.append(command)
+        rows, next_cursor = self._page('SELECT id, ts, payload FROM commands', filters, params, cursor, limit)
+        return [dict(json.loads(row['payload']), id=row['id']) for row in rows], next_cursor
+
+    def rollups(self, start=None, end=None, attack_type=None):
+        """Per-minute alert counts -> [{'minute', 'attack_type', 'count', 'max_confidence'}]"""
+        filters, params = [], []
+        if start is not None:
+            filters.append('minute >= ?')
+            params.append(int(start // 60) * 60)
+        if end is not None:
+            filters.append('minute < ?')
+            params.append(end)
+        if attack_type:
+            filters.append('attack_type = ?')
+            params.append(attack_type)
+        where = f"WHERE {' AND '.join(filters)}" if filters else ''
+        rows = self._connect().execute(f"SELECT * FROM alert_rollups {where} ORDER BY minute",
+                                       params).fetchall()
+        return [dict(row) for row in rows]
+
+    def active_blocks(self, now=None):
+        """BLOCK commands still within their TTL and not lifted since (restores the table on restart)"""
+        now = time.time() if now is None else now
+        rows = self._connect().execute(
+            "SELECT payload FROM commands WHERE id IN (SELECT MAX(id) FROM commands GROUP BY target) "
+            "AND command = 'BLOCK' AND ts + COALESCE(ttl, 0) > ? ORDER BY ts DESC", (now,)).fetchall()
+        return [json.loads(row['payload']) for row in rows]
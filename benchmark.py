@@ -0,0 +1,311 @@
+"""
+Non-interactive benchmark harness for the detection pipeline.
+
+Replays configurable traffic mixes built from the interactive_attacker
+generators (generate_dos / probe / r2l / u2r / normal) and reports throughput,
+latency percentiles, CPU and RSS. Results are appended as one JSON line per run
+so regressions can be tracked between commits.
+
+Modes:
+  inproc  drive the engine's score_batch in-process, no MQTT: decode ->
+          vectorizer -> cascade / verdict cache -> model -> verdicts
+          (--wire json|binary picks the network/traffic encoding)
+  mqtt    publish to a local broker at a target rate and measure
+          ingest-to-alert latency from the engine's network/alerts
+
+Examples:
+  python benchmark.py inproc --mix dos=0.7,normal=0.3 --packets 200000
+  python benchmark.py mqtt --rate 5000 --duration 30 --engine-pid 1234
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import interactive_attacker as attacker
+import wire_format
+
+GENERATORS = {
+    'dos': attacker.generate_dos,
+    'probe': attacker.generate_probe,
+    'r2l': attacker.generate_r2l,
+    'u2r': attacker.generate_u2r,
+    'normal': attacker.generate_normal,
+}
+
+DEFAULT_MIX = "dos=0.5,normal=0.3,probe=0.1,r2l=0.05,u2r=0.05"
+DEFAULT_OUTPUT = "benchmark_results.jsonl"
+POOL_SIZE = 10000
+
+
+def parse_mix(text):
+    """'dos=0.5,normal=0.5' -> {'dos': 0.5, 'normal': 0.5}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip().lower()
+        if name not in GENERATORS:
+            raise argparse.ArgumentTypeError(f"unknown traffic type '{name}'")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def build_pool(mix, sources, size=POOL_SIZE, seed=42):
+    """Pre-generate packets so the generators do not limit the replay rate"""
+    random.seed(seed)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    pool = []
+    for i in range(size):
+        pkt = GENERATORS[random.choices(names, weights)[0]]()
+        pkt['source_ip'] = f"10.{(i % sources) // 65536 % 256}.{(i % sources) // 256 % 256}.{i % sources % 256}"
+        pool.append(pkt)
+    return pool
+
+
+def percentiles(samples):
+    """p50/p95/p99/max in milliseconds"""
+    if not len(samples):
+        return None
+    values = np.asarray(samples) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3),
+            'p99_ms': round(p99, 3), 'max_ms': round(float(values.max()), 3)}
+
+
+def self_usage():
+    """CPU seconds and peak RSS (MB) of this process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return usage.ru_utime + usage.ru_stime, rss_mb
+
+
+def process_usage(pid):
+    """CPU seconds and current RSS (MB) of another process (Linux /proc only)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        return cpu, rss / 1024
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None, None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+# --- In-process Benchmark (no MQTT) ---
+
+def run_inproc(args, pool):
+    """Time engine.score_batch (decode, vectorizer, cascade, verdict cache, verdicts) on raw payloads"""
+    import detection_engine as engine
+    from blocklist import Blocklist
+
+    if args.runtime == 'compiled':
+        import tree_runtime
+        compiled = tree_runtime.load_compiled()
+        engine.vectorizer, engine.scorer = compiled.vectorizer, compiled.scorer
+        engine.selected_features = compiled.selected_features
+    if args.cascade:
+        engine.prefilter = engine.load_prefilter(engine.VARIANT_PATHS['prefilter'])
+        engine.prefilter.check(engine.selected_features)
+    # The default TTL of 0 scores every packet instead of dropping blocked sources
+    engine.blocklist = Blocklist(args.block_ttl, engine.BLOCK_MAX_TTL, engine.BLOCK_ESCALATION)
+
+    # (payloads, packets) per score_batch call; a binary message carries a whole
+    # batch, and the last one is short (the only one if the pool is smaller)
+    chunks = [pool[i:i + args.batch_size] for i in range(0, len(pool), args.batch_size)]
+    if args.wire == 'binary':
+        batches = [([wire_format.pack_records(chunk)], len(chunk)) for chunk in chunks]
+    else:
+        batches = [([json.dumps(pkt).encode() for pkt in chunk], len(chunk)) for chunk in chunks]
+    features = np.empty((args.batch_size, engine.vectorizer.n_features), dtype=engine.FEATURE_DTYPE)
+    # Stage times come from the engine's own trace spans (no reporter thread)
+    engine.tracer.interval = 0
+    engine.tracer.set_enabled(True)
+    batch_t = []
+    cpu0, _ = self_usage()
+    start = time.perf_counter()
+    done = 0
+    while done < args.packets:
+        payloads, n = batches[len(batch_t) % len(batches)]
+        t0 = time.perf_counter()
+        engine.score_batch(payloads, features)
+        batch_t.append(time.perf_counter() - t0)
+        done += n
+    elapsed = time.perf_counter() - start
+    cpu1, rss = self_usage()
+    stages = engine.tracer.take()
+    engine.tracer.set_enabled(False)
+    return {
+        'packets': done,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_pps': round(done / elapsed, 1),
+        'batch_latency': percentiles(batch_t),
+        'stage_ms_per_batch': {stage: round(1000 * seconds / len(batch_t), 4)
+                               for stage, (_, seconds) in stages.items()},
+        'engine': {key: engine.detection_stats[key] for key in ('total', 'attacks', 'blocked_dropped', 'fast_path',
+                                                'full_model', 'cache_hits', 'cache_misses')},
+        'cpu_s': round(cpu1 - cpu0, 3),
+        'peak_rss_mb': round(rss, 1),
+    }
+
+
+# --- End-to-end Benchmark over MQTT ---
+
+def run_mqtt(args, pool):
+    """Publish at the target rate and match alerts back to packets by packet_id"""
+    import paho.mqtt.client as mqtt
+
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    # packet_id is spliced into the pre-serialized packet; the engine echoes it in alerts
+    templates = [json.dumps(pkt)[:-1].encode() for pkt in pool]
+    sent_at = {}
+    latencies = []
+    engine_stats = []
+    lock = threading.Lock()
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        client.subscribe([(args.alert_topic, 0), (args.stats_topic, 0)])
+
+    def on_message(client, userdata, msg):
+        now = time.perf_counter()
+        try:
+            payload = json.loads(msg.payload.decode())
+        except Exception:
+            return
+        if msg.topic == args.stats_topic:
+            engine_stats.append((now, payload))
+            return
+        # The asyncio engine coalesces alerts into JSON lists
+        for alert in payload if isinstance(payload, list) else [payload]:
+            packet_id = alert.get('packet_id') if isinstance(alert, dict) else None
+            with lock:
+                sent = sent_at.pop(packet_id, None)
+            if sent is not None:
+                latencies.append(now - sent)
+
+    listener = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, f"Benchmark_Listener_{run_id}")
+    listener.on_connect = on_connect
+    listener.on_message = on_message
+    publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, f"Benchmark_Publisher_{run_id}")
+    listener.connect(args.broker, args.port, 60)
+    publisher.connect(args.broker, args.port, 60)
+    listener.loop_start()
+    publisher.loop_start()
+    time.sleep(1.0)  # let the subscriptions settle and the first stats arrive
+
+    engine_cpu0, _ = process_usage(args.engine_pid) if args.engine_pid else (None, None)
+    stats0 = engine_stats[-1][1] if engine_stats else None
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    start = time.perf_counter()
+    end = start + args.duration
+    sent = 0
+    while True:
+        now = time.perf_counter()
+        if now >= end:
+            break
+        # Pace against the schedule (not per-packet sleeps) so the rate holds
+        ahead = start + sent * interval - now
+        if ahead > 0:
+            time.sleep(ahead)
+        packet_id = f"{run_id}-{sent}"
+        payload = templates[sent % len(templates)] + f', "packet_id": "{packet_id}"}}'.encode()
+        with lock:
+            sent_at[packet_id] = time.perf_counter()
+        publisher.publish(args.topic, payload)
+        sent += 1
+    send_elapsed = time.perf_counter() - start
+
+    time.sleep(args.drain)  # wait for in-flight alerts
+    engine_cpu1, engine_rss = process_usage(args.engine_pid) if args.engine_pid else (None, None)
+    stats1 = engine_stats[-1][1] if engine_stats else None
+    listener.loop_stop(); publisher.loop_stop()
+    listener.disconnect(); publisher.disconnect()
+
+    result = {
+        'packets_sent': sent,
+        'send_rate_pps': round(sent / send_elapsed, 1),
+        'alerts_matched': len(latencies),
+        'ingest_to_alert': percentiles(latencies),
+    }
+    if stats0 and stats1:
+        processed = ((stats1.get('total', 0) + stats1.get('blocked_dropped', 0))
+                     - (stats0.get('total', 0) + stats0.get('blocked_dropped', 0)))
+        result['engine_processed'] = processed
+        result['engine_throughput_pps'] = round(processed / (send_elapsed + args.drain), 1)
+    if engine_cpu0 is not None and engine_cpu1 is not None:
+        result['engine_cpu_s'] = round(engine_cpu1 - engine_cpu0, 3)
+        result['engine_rss_mb'] = round(engine_rss, 1)
+    cpu, rss = self_usage()
+    result['harness_cpu_s'] = round(cpu, 3)
+    result['harness_peak_rss_mb'] = round(rss, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection pipeline benchmark")
+    parser.add_argument('mode', choices=['inproc', 'mqtt'])
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Traffic mix as type=weight pairs (default {DEFAULT_MIX})")
+    parser.add_argument('--sources', type=int, default=256, help="Number of simulated source IPs")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="JSON lines file results are appended to")
+    parser.add_argument('--label', default='', help="Free-form tag stored with the result")
+    # inproc
+    parser.add_argument('--packets', type=int, default=100000, help="[inproc] packets to score")
+    parser.add_argument('--batch-size', type=int, default=256, help="[inproc] packets per model call")
+    parser.add_argument('--wire', choices=['json', 'binary'], default='json',
+                        help="[inproc] network/traffic encoding to decode")
+    parser.add_argument('--runtime', choices=['xgboost', 'compiled'], default='xgboost',
+                        help="[inproc] model runtime (compiled = tree_runtime.py ensemble)")
+    parser.add_argument('--cascade', action='store_true', help="[inproc] screen packets with the prefilter first")
+    parser.add_argument('--block-ttl', type=float, default=0,
+                        help="[inproc] engine block TTL in seconds (0 = blocked sources keep being scored)")
+    # mqtt
+    parser.add_argument('--broker', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--topic', default="network/traffic")
+    parser.add_argument('--alert-topic', default="network/alerts")
+    parser.add_argument('--stats-topic', default="network/stats")
+    parser.add_argument('--rate', type=float, default=1000, help="[mqtt] target packets/sec (0 = unpaced)")
+    parser.add_argument('--duration', type=float, default=10, help="[mqtt] seconds to publish")
+    parser.add_argument('--drain', type=float, default=3, help="[mqtt] seconds to wait for late alerts")
+    parser.add_argument('--engine-pid', type=int, help="[mqtt] engine PID for CPU / RSS sampling")
+    args = parser.parse_args()
+
+    pool = build_pool(args.mix, args.sources)
+    print(f"⏱️  Benchmark ({args.mode}) with mix {args.mix}...")
+    results = run_inproc(args, pool) if args.mode == 'inproc' else run_mqtt(args, pool)
+
+    record = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'mode': args.mode,
+        'label': args.label,
+        'config': {k: v for k, v in vars(args).items() if k not in ('mode', 'label', 'output')},
+        'results': results,
+    }
+    print(json.dumps(results, indent=2))
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"✅ Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
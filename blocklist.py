@@ -0,0 +1,63 @@
+"""
+In-memory IPS blocklist for the detection engine.
+
+A source IP is blocked for a TTL window; repeat offenders get an escalating
+TTL (base * escalation ** (strikes - 1), capped at max_ttl). While an IP is
+blocked its packets are short-circuited before preprocessing and inference,
+and a BLOCK command is only published once per window. Expired entries are
+returned by expire() so the engine can publish the matching UNBLOCK.
+"""
+import threading
+
+
+class Blocklist:
+    """Thread-safe blocklist with TTL and repeat-offender escalation"""
+
+    def __init__(self, base_ttl=60.0, max_ttl=3600.0, escalation=2.0, strike_memory=3600.0):
+        self.base_ttl = base_ttl
+        self.max_ttl = max_ttl
+        self.escalation = escalation
+        # Strikes are forgotten once an IP stays clean this long after a block
+        self.strike_memory = strike_memory
+        self._entries = {}  # ip -> expiry time
+        self._strikes = {}  # ip -> (strike count, expiry of the last block)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_blocked(self, ip, now):
+        expires = self._entries.get(ip)
+        return expires is not None and expires > now
+
+    def block(self, ip, now):
+        """Block `ip` -> (ttl, strike) for a new block, None if already blocked"""
+        with self._lock:
+            expires = self._entries.get(ip)
+            if expires is not None and expires > now:
+                return None
+            strike, last_expiry = self._strikes.get(ip, (0, now))
+            if now - last_expiry > self.strike_memory:
+                strike = 0
+            strike += 1
+            ttl = min(self.base_ttl * self.escalation ** (strike - 1), self.max_ttl)
+            self._entries[ip] = now + ttl
+            self._strikes[ip] = (strike, now + ttl)
+            return ttl, strike
+
+    def unblock(self, ip):
+        """Lift a block early (operator UNBLOCK), True if `ip` was blocked"""
+        with self._lock:
+            return self._entries.pop(ip, None) is not None
+
+    def expire(self, now):
+        """Drop expired blocks and stale strikes -> list of IPs to UNBLOCK"""
+        with self._lock:
+            expired = [ip for ip, expires in self._entries.items() if expires <= now]
+            for ip in expired:
+                del self._entries[ip]
+            stale = [ip for ip, (_, last_expiry) in self._strikes.items()
+                     if now - last_expiry > self.strike_memory]
+            for ip in stale:
+                del self._strikes[ip]
+        return expired
@@ -1,8 +1,14 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, request, jsonify
 from flask_socketio import SocketIO
 import paho.mqtt.client as mqtt
 import json
 import threading
+import argparse
+import itertools
+import uuid
+from collections import deque, OrderedDict
+from alert_store import AlertStore, to_epoch
+from profiling import LOG_FORMATS, TRACE_INTERVAL, SampledLog, Tracer, install_toggle
 
 # --- Flask and SocketIO Setup ---
 app = Flask(__name__)
@@ -25,57 +31,222 @@ TOPICS = [
 ]
 
 # --- Global Data Storage ---
+# Applied frame by frame in take_frame(), read by Flask: every access goes
+# through state_lock. The deques are ring buffers, so memory stays bounded.
+MAX_ALERTS = 50
+MAX_BLOCKED = 20
 stats = {'total': 0, 'normal': 0, 'attacks': 0, 'dos': 0, 'probe': 0, 'r2l': 0, 'u2r': 0}
-recent_alerts = []
-blocked_devices = [] # Stores list of blocked IPs
+recent_alerts = deque(maxlen=MAX_ALERTS)
+blocked_devices = deque(maxlen=MAX_BLOCKED) # Stores list of blocked IPs
+state_lock = threading.Lock()
+
+# --- Alert History ---
+# Every alert and BLOCK / UNBLOCK is also appended to a SQLite file; the paho
+# thread only enqueues, the store's writer thread commits in batches.
+ALERT_DB = 'alerts.db'
+store = None  # AlertStore, opened in __main__
+
+# --- Frame Batching ---
+# Updates are not emitted as they arrive: they are merged into a frame that the
+# emitter sends as ONE 'frame' event FRAME_RATE times per second. Alerts of the
+# same kind (source IP + attack type) within a frame collapse into one entry
+# with a repeat count, so browser load is capped however fast alerts arrive.
+FRAME_RATE = 10.0            # frames per second
+MAX_FRAME_ALERTS = MAX_ALERTS  # distinct alerts per frame; the rest are only counted
+
+def new_frame():
+    return {'stats': None, 'alerts': OrderedDict(), 'blocks': OrderedDict(),
+            'unblocks': OrderedDict(), 'dropped': 0}
+
+frame = new_frame()
+
+# --- Logging & Tracing ---
+# BLOCK / UNBLOCK receipts and message errors go through a sampled log (see
+# profiling.py). With --trace or SIGUSR1, the MQTT-to-browser path is timed:
+#   decode  json.loads of an MQTT message
+#   store   queueing it for the alert history
+#   merge   merging it into the pending frame (lock wait included)
+#   frame   applying a frame to the state and serializing the event
+#   emit    socketio.emit of the frame
+log = SampledLog()
+tracer = Tracer('dashboard', log)
+
+def alert_key(alert):
+    return (alert.get('source_ip'), alert.get('attack_type'))
+
+def add_alert(alert):
+    """Merge an alert into the pending frame (caller holds state_lock)"""
+    key = alert_key(alert)
+    pending = frame['alerts'].get(key)
+    if pending is not None:
+        # Keep the latest details, carry the repeat count forward
+        alert['count'] = pending['count'] + alert.get('count', 1)
+        frame['alerts'][key] = alert
+        frame['alerts'].move_to_end(key)
+    elif len(frame['alerts']) < MAX_FRAME_ALERTS:
+        alert['count'] = alert.get('count', 1)
+        frame['alerts'][key] = alert
+    else:
+        frame['dropped'] += alert.get('count', 1)
+
+def add_block(payload):
+    target = payload.get('target')
+    frame['unblocks'].pop(target, None)
+    frame['blocks'][target] = payload
+    frame['blocks'].move_to_end(target)
+
+def add_unblock(payload):
+    target = payload.get('target')
+    # A block lifted within the same frame never reaches the browser
+    frame['blocks'].pop(target, None)
+    frame['unblocks'][target] = payload
+
+def remove_blocked(target):
+    for device in [d for d in blocked_devices if d.get('target') == target]:
+        blocked_devices.remove(device)
+
+def take_frame():
+    """Swap out the pending frame, apply it to the state -> event payload, or None if nothing changed"""
+    global frame, stats, seq
+    with state_lock:
+        pending, frame = frame, new_frame()
+        if pending['stats'] is None and not (pending['alerts'] or pending['blocks']
+                                             or pending['unblocks'] or pending['dropped']):
+            return None
+        # State changes only here, together with seq, so the snapshot at seq N
+        # is exactly what a client holds after applying events 1..N
+        if pending['stats'] is not None:
+            stats = pending['stats']
+        recent_alerts.extendleft(pending['alerts'].values())
+        for target in pending['unblocks']:
+            remove_blocked(target)
+        for target, payload in pending['blocks'].items():
+            # One row per target: a repeat block replaces the old row
+            remove_blocked(target)
+            blocked_devices.appendleft(payload)
+        seq += 1
+        event = {
+            'version': LOG_VERSION,
+            'seq': seq,
+            'stats': pending['stats'],
+            'alerts': list(pending['alerts'].values())[::-1],  # newest first
+            'blocks': list(pending['blocks'].values()),
+            'unblocks': list(pending['unblocks']),
+            'dropped': pending['dropped'],
+        }
+        event_log.append((seq, json.dumps(event)))
+    return event
+
+def frame_emitter():
+    """Background task: send the merged updates as one event per frame"""
+    while True:
+        socketio.sleep(1.0 / FRAME_RATE)
+        try:
+            with tracer.span('frame'):
+                payload = take_frame()
+            if payload is not None:
+                with tracer.span('emit'):
+                    socketio.emit('frame', payload)
+        except Exception as e:
+            log.event('error', "Error emitting frame: {error}", error=e)
+        log.flush()
+
+# --- Event Log & Snapshot ---
+# Every frame is an event with a sequence number. The last EVENT_LOG_SIZE
+# events are kept serialized, so a client that reconnects asks
+# /api/events?since=<seq> for exactly what it missed. A client too far behind,
+# or one that saw a previous server run (LOG_VERSION), is told to reset and
+# loads /api/snapshot instead. The snapshot is serialized at most once per
+# seq, however many viewers request it.
+EVENT_LOG_SIZE = 600  # one minute of frames at 10 per second
+LOG_VERSION = uuid.uuid4().hex[:12]  # sequence numbers of another run mean nothing
+seq = 0
+event_log = deque(maxlen=EVENT_LOG_SIZE)  # (seq, serialized event), oldest first
+snapshot_cache = {'seq': None, 'body': None}
+
+def snapshot_json():
+    """(seq, current state as JSON), rebuilt only when seq has moved"""
+    with state_lock:
+        if snapshot_cache['seq'] != seq:
+            snapshot_cache['body'] = json.dumps({
+                'version': LOG_VERSION,
+                'seq': seq,
+                'stats': stats,
+                'alerts': list(recent_alerts),
+                'blocked': list(blocked_devices),
+            })
+            snapshot_cache['seq'] = seq
+        return snapshot_cache['seq'], snapshot_cache['body']
+
+def events_since(since, version):
+    """(seq, serialized events after `since`), or None when the client must reload the snapshot"""
+    with state_lock:
+        if version != LOG_VERSION or since > seq:
+            return None
+        first = event_log[0][0] if event_log else seq + 1
+        if since < first - 1:
+            return None  # the events it missed have left the log
+        return seq, [body for _, body in itertools.islice(event_log, since - first + 1, None)]
 
 # --- Paho-MQTT Functions ---
 
-def on_connect(client, userdata, flags, rc):
+def on_connect(client, userdata, flags, reason_code, properties):
     """Callback for when the client connects to the broker."""
-    if rc == 0:
+    if not reason_code.is_failure:
         print("✅ Dashboard: Connected to MQTT broker")
         client.subscribe(TOPICS)
     else:
-        print(f"❌ Dashboard: Failed to connect, return code {rc}")
+        print(f"❌ Dashboard: Failed to connect, reason code {reason_code}")
 
 def on_message(client, userdata, msg):
     """Callback for when a message is received."""
-    global stats, recent_alerts, blocked_devices
-    
     try:
-        payload = json.loads(msg.payload.decode())
+        with tracer.span('decode'):
+            payload = json.loads(msg.payload.decode())
 
-        # 1. Update Statistics
+        # 1. Update Statistics (only the latest snapshot per frame is sent)
         if msg.topic == 'network/stats':
-            stats = payload
-            socketio.emit('update_stats', stats)
+            with tracer.span('merge'), state_lock:
+                frame['stats'] = payload
             
         # 2. Handle New Threat Alerts
+        # The asyncio engine coalesces several alerts into one JSON list
         elif msg.topic == 'network/alerts':
-            recent_alerts.insert(0, payload)
-            if len(recent_alerts) > 50:
-                recent_alerts.pop()
-            socketio.emit('new_alert', payload)
+            alerts = payload if isinstance(payload, list) else [payload]
+            if store is not None:
+                with tracer.span('store'):
+                    for alert in alerts:
+                        store.add_alert(alert)
+            with tracer.span('merge'), state_lock:
+                for alert in alerts:
+                    add_alert(alert)
 
         # 3. Handle IPS Block Commands (The Fix!)
         elif msg.topic == 'network/control':
+            if store is not None and payload.get('command') in ('BLOCK', 'UNBLOCK'):
+                with tracer.span('store'):
+                    store.add_command(payload)
             # Only process if it's a BLOCK command
             if payload.get('command') == 'BLOCK':
-                blocked_devices.insert(0, payload)
-                if len(blocked_devices) > 20:
-                    blocked_devices.pop()
+                target = payload.get('target')
+                with tracer.span('merge'), state_lock:
+                    add_block(payload)
                 
-                print(f"🚫 DASHBOARD: Received Block Command for {payload.get('target')}")
-                # Emit event to the HTML frontend to update the table
-                socketio.emit('new_block', payload)
+                log.event('block', "🚫 DASHBOARD: Received Block Command for {target}", target=target)
+            
+            # Block expired or lifted by an operator: drop it from the table
+            elif payload.get('command') == 'UNBLOCK':
+                target = payload.get('target')
+                with tracer.span('merge'), state_lock:
+                    add_unblock(payload)
+                log.event('unblock', "✅ DASHBOARD: Received Unblock Command for {target}", target=target)
             
     except Exception as e:
-        print(f"Error processing message from topic {msg.topic}: {e}")
+        log.event('error', "Error processing message from topic {topic}: {error}", topic=msg.topic, error=e)
 
 def start_mqtt_client():
     """Starts the Paho-MQTT client in a background thread."""
-    client = mqtt.Client(client_id=MQTT_CLIENT_ID)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=MQTT_CLIENT_ID)
     client.on_connect = on_connect
     client.on_message = on_message
     
@@ -90,19 +261,108 @@ def start_mqtt_client():
 @app.route('/')
 def index():
     """Serve the main dashboard page."""
-    # Pass all data so the page isn't empty on reload
-    return render_template('dashboard.html', 
-                           stats=stats, 
-                           alerts=recent_alerts, 
-                           blocked=blocked_devices)
+    # The page fills itself from /api/snapshot once its socket connects
+    return render_template('dashboard.html', max_alerts=MAX_ALERTS)
+
+@app.route('/api/snapshot')
+def api_snapshot():
+    """Current stats, recent alerts and active blocks, as of the returned seq"""
+    snapshot_seq, body = snapshot_json()
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(f"{LOG_VERSION}-{snapshot_seq}")
+    return response.make_conditional(request)
+
+@app.route('/api/events')
+def api_events():
+    """Events after ?since=<seq> of the run ?version=, or {'reset': true}"""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': "since must be an integer sequence number"}), 400
+    result = events_since(since, request.args.get('version'))
+    if result is None:
+        return jsonify({'version': LOG_VERSION, 'reset': True})
+    current, events = result
+    body = f'{{"version": {json.dumps(LOG_VERSION)}, "seq": {current}, "events": [{", ".join(events)}]}}'
+    return app.response_class(body, mimetype='application/json')
+
+# --- History API ---
+# Pages are newest first; pass the returned 'next' back as ?cursor= for the next
+# page. start / end accept epoch seconds or ISO-8601 timestamps.
+
+def history_args():
+    return to_epoch(request.args.get('start')), to_epoch(request.args.get('end'))
+
+@app.route('/api/alerts')
+def api_alerts():
+    """Stored alerts, filterable by time range, source_ip and attack_type"""
+    try:
+        start, end = history_args()
+        alerts, next_cursor = store.query_alerts(start, end,
+                                                 source_ip=request.args.get('source_ip'),
+                                                 attack_type=request.args.get('attack_type'),
+                                                 cursor=request.args.get('cursor'),
+                                                 limit=request.args.get('limit', 100))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'alerts': alerts, 'next': next_cursor})
+
+@app.route('/api/blocks')
+def api_blocks():
+    """Stored BLOCK / UNBLOCK commands, filterable by time range, target and command"""
+    try:
+        start, end = history_args()
+        commands, next_cursor = store.query_commands(start, end,
+                                                     target=request.args.get('target'),
+                                                     command=request.args.get('command'),
+                                                     cursor=request.args.get('cursor'),
+                                                     limit=request.args.get('limit', 100))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'blocks': commands, 'next': next_cursor})
+
+@app.route('/api/rollups')
+def api_rollups():
+    """Per-minute alert counts by attack type"""
+    try:
+        start, end = history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'rollups': store.rollups(start, end, attack_type=request.args.get('attack_type'))})
 
 # --- Main Execution ---
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="IPS dashboard")
+    parser.add_argument('--frame-rate', type=float, default=FRAME_RATE,
+                        help="Batched UI updates per second")
+    parser.add_argument('--db', default=ALERT_DB, help="SQLite file for the alert / block history")
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text',
+                        help="Block / unblock / error lines as text or JSON records")
+    parser.add_argument('--trace', action='store_true',
+                        help="Start with per-stage tracing on (toggle at runtime with SIGUSR1)")
+    parser.add_argument('--trace-interval', type=float, default=TRACE_INTERVAL,
+                        help="Seconds between per-stage timing breakdowns while tracing")
+    args = parser.parse_args()
+    FRAME_RATE = args.frame_rate
+    log = SampledLog(args.log_format)
+    tracer = Tracer('dashboard', log, max(0.1, args.trace_interval))
+    install_toggle(tracer.toggle)
+    if args.trace:
+        tracer.set_enabled(True)
+
+    # Open the history and restore the tables from it, so a restart starts populated
+    store = AlertStore(args.db)
+    recent_alerts.extend(store.query_alerts(limit=MAX_ALERTS)[0])
+    blocked_devices.extend(store.active_blocks()[:MAX_BLOCKED])
+    print(f"🗄️  Alert history: {args.db} ({len(recent_alerts)} recent alerts, {len(blocked_devices)} active blocks restored)")
+
     # Start the MQTT listener in a separate thread
     mqtt_thread = threading.Thread(target=start_mqtt_client)
     mqtt_thread.daemon = True 
     mqtt_thread.start()
+
+    # Send merged updates at a fixed rate instead of one event per message
+    socketio.start_background_task(frame_emitter)
     
     # Start the Web Server
     # host='0.0.0.0' allows you to see the dashboard on your Phone/Laptop B
@@ -0,0 +1,137 @@
+"""
+Typed, memory-mapped cache for the preprocessed NSL-KDD matrices.
+
+preprocessing.py writes one .npy file per matrix (float32 features, uint8
+class codes) plus a manifest.json recording the column order, the class
+names, the MinMax scaler parameters, a SHA-256 of every source file and how
+many of the X_train rows are original traffic (SMOTE appends its synthetic
+rows after them).
+train_model.py opens the .npy files with mmap_mode='r', so nothing is parsed
+and only the pages actually touched are read. When the manifest's hashes still
+match the source files, preprocessing can skip its work entirely.
+
+Class codes index the sorted class names, which is exactly what
+LabelEncoder.fit(classes) produces, so they can be used as XGBoost labels
+directly.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+CACHE_DIR = 'processed'
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 2
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_hashes(sources):
+    """{name: path} -> {name: {'path': ..., 'sha256': ...}}"""
+    return {name: {'path': path, 'sha256': file_hash(path)} for name, path in sources.items()}
+
+
+def read_manifest(cache_dir=CACHE_DIR):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(sources, params, cache_dir=CACHE_DIR):
+    """True when the cache was built from these exact source files and parameters"""
+    manifest = read_manifest(cache_dir)
+    if manifest is None or manifest.get('format_version') != FORMAT_VERSION:
+        return False
+    if manifest.get('params') != params:
+        return False
+    if not all(os.path.exists(os.path.join(cache_dir, f"{name}.npy")) for name in manifest['arrays']):
+        return False
+    return manifest.get('sources') == source_hashes(sources)
+
+
+def encode_labels(labels, classes):
+    """Class names -> uint8 codes into the sorted `classes`"""
+    labels = np.asarray(labels, dtype=str)
+    classes = np.asarray(classes, dtype=str)
+    codes = np.searchsorted(classes, labels)
+    known = codes < len(classes)
+    known[known] = classes[codes[known]] == labels[known]
+    if not known.all():
+        raise ValueError(f"labels outside the class list: {sorted(set(labels[~known]))}")
+    return codes.astype(np.uint8)
+
+
+def scaler_params(scaler):
+    """JSON-serializable MinMaxScaler parameters"""
+    return {
+        'feature_range': list(scaler.feature_range),
+        'clip': bool(getattr(scaler, 'clip', False)),
+        'data_min': np.asarray(scaler.data_min_).tolist(),
+        'data_max': np.asarray(scaler.data_max_).tolist(),
+        'scale': np.asarray(scaler.scale_).tolist(),
+        'min': np.asarray(scaler.min_).tolist(),
+    }
+
+
+def write_manifest(cache_dir, manifest):
+    """Write the manifest last (atomically): it is what marks the cache as complete"""
+    tmp = os.path.join(cache_dir, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(cache_dir, MANIFEST))
+
+
+def invalidate(cache_dir=CACHE_DIR):
+    """Drop the manifest before rewriting: a half-written cache must never look fresh"""
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(os.path.join(cache_dir, MANIFEST)):
+        os.remove(os.path.join(cache_dir, MANIFEST))
+
+
+def create_array(name, shape, dtype, cache_dir=CACHE_DIR):
+    """Writable .npy memmap in the cache, for outputs filled chunk by chunk"""
+    return open_memmap(os.path.join(cache_dir, f"{name}.npy"), mode='w+', dtype=dtype, shape=shape)
+
+
+def save(arrays, columns, classes, scaler, sources, params, cache_dir=CACHE_DIR, original_rows=None):
+    """Write the matrices as .npy files and the manifest describing them"""
+    invalidate(cache_dir)
+    shapes = {}
+    for name, array in arrays.items():
+        path = os.path.join(cache_dir, f"{name}.npy")
+        if isinstance(array, np.memmap) and os.path.abspath(array.filename) == os.path.abspath(path):
+            array.flush()  # already written in place by create_array
+        else:
+            np.save(path, array, allow_pickle=False)
+        shapes[name] = {'shape': list(array.shape), 'dtype': str(array.dtype)}
+    write_manifest(cache_dir, {
+        'format_version': FORMAT_VERSION,
+        'columns': list(columns),
+        'classes': list(classes),
+        'scaler': scaler_params(scaler),
+        'sources': source_hashes(sources),
+        'params': params,
+        'arrays': shapes,
+        'train_original_rows': len(arrays['y_train']) if original_rows is None else int(original_rows),
+    })
+
+
+def load(cache_dir=CACHE_DIR, mmap_mode='r'):
+    """Open the cached matrices -> (arrays dict, manifest). Raises FileNotFoundError if missing."""
+    manifest = read_manifest(cache_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"no preprocessed cache in '{cache_dir}' (run preprocessing.py)")
+    arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+              for name in manifest['arrays']}
+    return arrays, manifest
@@ -1,33 +1,127 @@
 import paho.mqtt.client as mqtt
 import json
-import pandas as pd
-import joblib
+import numpy as np
 from datetime import datetime
 import csv
 import threading
 import time
+import queue
+import argparse
+import multiprocessing as mp
+import os
+import re
+import zlib
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from model_runtime import ARTIFACTS, load_bundle, artifact_mtimes, artifact_version
+from tree_runtime import COMPILED_MODEL, load_compiled
+from prefilter import load_prefilter
+from model_variants import variant_paths
+from blocklist import Blocklist
+from source_scores import SourceScores
+from traffic_aggregator import TrafficAggregator
+import wire_format
+from verdict_cache import VerdictCache
+from mqtt_asyncio import AsyncioHelper
+from engine_metrics import LatencyHistogram, RateTracker
+from profiling import LOG_BURST, LOG_FORMATS, TRACE_INTERVAL, SampledLog, Tracer, install_toggle
+
+# --- Model Runtime ---
+# 'xgboost' scores with the pickled XGBClassifier; 'compiled' loads only the
+# flattened ensemble exported by train_model.py (tree_runtime.py), without
+# importing xgboost or scikit-learn. It is faster for small batches (up to a
+# few dozen rows); xgboost is faster for large ones.
+MODEL_RUNTIME = 'xgboost'
+# --- Tiered Inference ---
+# With --cascade a linear prefilter (prefilter.py, trained and calibrated by
+# train_model.py) screens every packet first. Packets it is confident are
+# Normal get a fast-path verdict; only the rest go to the full model.
+CASCADE = False
+# --- Model Variant ---
+# --config engine.json with {"model_variant": "<name>"} runs one of the smaller
+# variants trained by `train_model.py --variants` instead of the full model
+# (model_variants.py; models/variants/report.json has their measured recall,
+# latency and size).
+MODEL_VARIANT = None  # None = the full model
+ENGINE_CONFIG_KEYS = ('model_variant',)
+# Feature blocks are float32, the precision XGBoost compares against its
+# thresholds: half the memory traffic and no conversion inside the booster
+FEATURE_DTYPE = np.float32
+
+def read_engine_config(path):
+    """JSON engine config file -> dict (exits on unreadable files and unknown keys)"""
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"❌ Cannot read engine config {path}: {e}")
+    unknown = sorted(set(config) - set(ENGINE_CONFIG_KEYS))
+    if unknown:
+        raise SystemExit(f"❌ Unknown key(s) {unknown} in {path}, expected {list(ENGINE_CONFIG_KEYS)}")
+    return config
+
+if __name__ == "__main__":
+    # These decide what gets loaded below, so they are read before the full parser
+    _runtime_parser = argparse.ArgumentParser(add_help=False)
+    _runtime_parser.add_argument('--runtime', choices=['xgboost', 'compiled'], default=MODEL_RUNTIME)
+    _runtime_parser.add_argument('--cascade', action='store_true')
+    _runtime_parser.add_argument('--config')
+    _early_args = _runtime_parser.parse_known_args()[0]
+    MODEL_RUNTIME, CASCADE = _early_args.runtime, _early_args.cascade
+    if _early_args.config:
+        MODEL_VARIANT = read_engine_config(_early_args.config).get('model_variant')
+try:
+    VARIANT_PATHS = variant_paths(MODEL_VARIANT)
+except FileNotFoundError as e:
+    print(f"❌ {e}")
+    exit()
+ARTIFACT_PATHS = ({'compiled_model': VARIANT_PATHS['compiled_model']} if MODEL_RUNTIME == 'compiled'
+                  else dict(VARIANT_PATHS['artifacts']))
+if CASCADE:
+    # Watched and hashed into the model version like the model itself
+    ARTIFACT_PATHS['prefilter'] = VARIANT_PATHS['prefilter']
+
+def load_models():
+    """Load the artifacts of the selected runtime -> bundle (vectorizer, scorer, prefilter, version)"""
+    if MODEL_RUNTIME == 'compiled':
+        bundle = load_compiled(VARIANT_PATHS['compiled_model'], artifact_version(ARTIFACT_PATHS))
+    else:
+        bundle = load_bundle(VARIANT_PATHS['artifacts'])
+    bundle.prefilter = None
+    if CASCADE:
+        bundle.prefilter = load_prefilter(VARIANT_PATHS['prefilter'])
+        bundle.prefilter.check(bundle.selected_features)
+        bundle.version = artifact_version(ARTIFACT_PATHS)
+    return bundle
 
 # --- Load Trained AI Models ---
 try:
-    print("Loading AI model (XGBoost)...")
+    print(f"Loading AI model (XGBoost {MODEL_VARIANT or 'full'} model, {MODEL_RUNTIME} runtime)...")
     
-    # 1. Load the XGBoost Model
-    model = joblib.load('models/xgboost_model.pkl') 
+    # Model, Label Encoder (CRITICAL for XGBoost: numbers -> 'Normal', 'DoS'),
+    # scaler and feature lists, loaded together as one versioned bundle
+    bundle = load_models()
+    bundle.check()
     
-    # 2. Load the Label Encoder (CRITICAL for XGBoost)
-    # XGBoost outputs numbers (0, 1, 2), this converts them back to names ('Normal', 'DoS')
-    le = joblib.load('models/label_encoder.pkl')
+    # Compiled vectorizer (precomputed indices + folded MinMax) and
+    # single-pass scorer (booster.inplace_predict + class names from le.classes_)
+    vectorizer = bundle.vectorizer
+    scorer = bundle.scorer
+    selected_features = bundle.selected_features
+    prefilter = bundle.prefilter
     
-    # 3. Load Preprocessing Tools
-    scaler = joblib.load('scaler.pkl')
-    selected_features = joblib.load('models/selected_features.pkl')
-    feature_names = joblib.load('feature_names.pkl')
-    
-    print("✅ XGBoost Engine loaded successfully.")
+    print(f"✅ XGBoost Engine loaded successfully (model {bundle.version}).")
+    if prefilter is not None:
+        print(f"⚡ Cascade prefilter loaded (threshold {prefilter.threshold:.3f}, "
+              f"target miss rate {prefilter.report.get('target_miss_rate')})")
 except FileNotFoundError as e:
     print(f"❌ Error loading model files: {e}")
     print("Make sure you ran the XGBoost training script and saved 'label_encoder.pkl'!")
     exit()
+except ValueError as e:
+    print(f"❌ Incompatible model files: {e}")
+    exit()
 
 # --- MQTT Configuration ---
 BROKER = "127.0.0.1" 
@@ -35,114 +129,1046 @@ PORT = 1883
 
 # Topics
 SUBSCRIBE_TOPIC = "network/traffic"
+# Compact binary batches (see wire_format.py); JSON keeps working on both topics
+BINARY_TOPIC = SUBSCRIBE_TOPIC + wire_format.TOPIC_SUFFIX
 ALERT_TOPIC = "network/alerts"
 STATS_TOPIC = "network/stats"
 CONTROL_TOPIC = "network/control"
 
+# --- Micro-batching Configuration ---
+# on_message only enqueues the raw payload; a worker thread drains up to
+# BATCH_SIZE messages (or waits at most BATCH_WAIT_MS for the batch to fill)
+# and scores the whole batch with a single predict_proba call.
+BATCH_SIZE = 256
+BATCH_WAIT_MS = 5
+# Bounded so a burst applies backpressure to the broker instead of growing memory
+QUEUE_MAXSIZE = 10000
+
+message_queue = queue.Queue(maxsize=QUEUE_MAXSIZE)
+
+# --- Sharded Multi-process Configuration ---
+# With --workers K the main process only receives and dispatches: every batch
+# is split by source_ip so all traffic from one source reaches the same worker
+# process (per-source state stays consistent). Workers fork after the model is
+# loaded and send their counters back to be merged before publishing stats.
+WORKERS = 1
+# Max batches buffered per worker before the dispatcher blocks
+SHARD_QUEUE_BATCHES = 64
+# How often a worker reports its counters to the main process
+WORKER_STATS_INTERVAL = 0.5
+
+_SOURCE_IP_RE = re.compile(rb'"source_ip"\s*:\s*"([^"]*)"')
+shard_inboxes = []
+
+# --- IPS Blocklist Configuration ---
+# A BLOCK is published once per source per TTL window; repeat offenders get
+# BLOCK_TTL * BLOCK_ESCALATION ** (strikes - 1) seconds, up to BLOCK_MAX_TTL.
+# Packets from blocked sources are dropped before preprocessing and inference.
+BLOCK_TTL = 60.0
+BLOCK_MAX_TTL = 3600.0
+BLOCK_ESCALATION = 2.0
+BLOCK_SWEEP_INTERVAL = 1.0
+# Marks control messages published by the engine so it ignores its own echoes
+ENGINE_ORIGIN = "detection_engine"
+
+blocklist = Blocklist(BLOCK_TTL, BLOCK_MAX_TTL, BLOCK_ESCALATION)
+
+# --- Per-source Evidence ---
+# A BLOCK needs accumulated evidence, not one packet: each attack verdict adds
+# its confidence to the source's score for that class, scores halve every
+# SCORE_HALF_LIFE seconds, and the source is blocked once a class score reaches
+# BLOCK_SCORE. One confident false positive (score <= 1) never blocks a host.
+SCORE_HALF_LIFE = 30.0
+BLOCK_SCORE = 2.5
+# R2L / U2R sessions are only a handful of packets
+BLOCK_SCORE_OVERRIDES = {'R2L': 1.5, 'U2R': 1.5}
+MAX_TRACKED_SOURCES = 200000  # least recently seen sources are evicted beyond this
+
+def build_source_scores():
+    attack_classes = [name for name in scorer.class_names if name != 'Normal']
+    return SourceScores(attack_classes, SCORE_HALF_LIFE, BLOCK_SCORE,
+                        BLOCK_SCORE_OVERRIDES, MAX_TRACKED_SOURCES)
+
+source_scores = build_source_scores()
+
+# --- Server-side Traffic Features ---
+# With --aggregate-features the NSL-KDD time/host window features (count,
+# srv_count, serror_rate, dst_host_count, ...) are computed from the raw
+# connection events, keyed on destination host and service as in NSL-KDD,
+# instead of trusting the values sent by the client.
+AGGREGATE_FEATURES = False
+traffic_aggregator = TrafficAggregator()
+
+# --- Verdict Cache Configuration ---
+# Repeated feature rows (e.g. identical Neptune packets) reuse the cached
+# label / confidence instead of running XGBoost. Keys are the float32 rows the
+# model sees, so hits are exact unless rate quantization is enabled.
+VERDICT_CACHE_MB = 32          # 0 disables the cache
+VERDICT_CACHE_TTL = 300.0
+VERDICT_CACHE_DECIMALS = None  # e.g. 2 rounds the *_rate features before keying
+
+def build_verdict_cache():
+    if VERDICT_CACHE_MB <= 0:
+        return None
+    rate_cols = [j for j, name in enumerate(selected_features) if name.endswith('rate')]
+    return VerdictCache(vectorizer.n_features, int(VERDICT_CACHE_MB * 1024 * 1024),
+                        VERDICT_CACHE_TTL, rate_cols, VERDICT_CACHE_DECIMALS)
+
+verdict_cache = build_verdict_cache()
+
+# --- Hot Model Reload ---
+# A RELOAD command on network/control, or new artifact files from
+# train_model.py, makes a background thread load, check and warm a new bundle.
+# The scoring thread swaps it in between two batches, or after RELOAD_IDLE_CHECK
+# seconds without traffic: queued messages are kept and every batch is scored
+# by exactly one model version.
+RELOAD_POLL_INTERVAL = 2.0  # seconds between artifact checks (0 disables the watcher)
+RELOAD_IDLE_CHECK = 1.0     # seconds an idle scoring thread waits before applying a staged reload
+# Booster threads per process (set by sharded workers, reapplied on reload)
+BOOSTER_THREADS = None
+
+active_bundle = bundle
+pending_bundle = None
+reload_lock = threading.Lock()   # one background reload at a time
+_pending_lock = threading.Lock()
+
 # Metrics tracking
 detection_stats = {
     'total': 0, 'normal': 0, 'attacks': 0, 
-    'dos': 0, 'probe': 0, 'r2l': 0, 'u2r': 0
+    'dos': 0, 'probe': 0, 'r2l': 0, 'u2r': 0,
+    'blocked_dropped': 0, 'overflow_dropped': 0, 'active_blocks': 0,
+    'tracked_sources': 0, 'source_evictions': 0,
+    'cache_hits': 0, 'cache_misses': 0, 'cache_evictions': 0,
+    'fast_path': 0, 'full_model': 0, 'inference_s': 0.0,
+    'model_version': bundle.version, 'reloads': 0, 'reload_failures': 0, 'last_reload_ms': 0.0
 }
+# Merged across workers with max() instead of a sum
+MERGE_MAX_STATS = ('reloads', 'reload_failures', 'last_reload_ms')
+
+# --- Time-series Metrics ---
+# Every stats message also carries per-second rates per class and latency
+# percentiles for the last interval. Latencies go into log-linear histograms:
+#   queue_wait  MQTT receipt -> batch picked up for scoring (per packet)
+#   preprocess  vectorizing one batch
+#   inference   scoring one batch (verdict cache included)
+#   end_to_end  MQTT receipt -> alerts / BLOCKs of its batch published (per packet)
+# Sharded workers send their histogram deltas with their counters.
+LATENCY_STAGES = ('queue_wait', 'preprocess', 'inference', 'end_to_end')
+RATE_KEYS = ('total', 'normal', 'attacks', 'dos', 'probe', 'r2l', 'u2r', 'blocked_dropped')
+RATE_WINDOW = 60  # seconds averaged in rates['avg']
+
+latency = {stage: LatencyHistogram() for stage in LATENCY_STAGES}
+rate_tracker = RateTracker(RATE_KEYS, RATE_WINDOW)
+# name -> callable returning the current depth, published under stats['queues']
+queue_gauges = {}
+
+# --- Logging & Tracing ---
+# Per-packet events (alerts, BLOCK / UNBLOCK, bad messages) go through a sampled
+# log instead of print(), so a flood no longer spends its time writing lines.
+# With --trace, SIGUSR1 or a TRACE control command, these stages are timed and
+# a breakdown is logged every --trace-interval seconds (see profiling.py):
+#   decode      JSON / binary parsing and blocked-source drops
+#   preprocess  vectorizing
+#   predict     cascade, verdict cache and model
+#   verdicts    counters, evidence scores and alert / BLOCK messages per packet
+#   publish     handing alerts and commands to paho
+#   dispatch    [--workers] splitting batches by source_ip
+# Sharded workers send their span totals with their counters.
+log = SampledLog()
+tracer = Tracer('engine', log)
+
+def set_tracing(enabled=None):
+    """Turn tracing on / off (None toggles) here and in every worker process"""
+    if enabled is None:
+        enabled = not tracer.enabled
+    tracer.set_enabled(enabled)
+    for inbox in shard_inboxes:
+        inbox.put({'command': 'TRACE', 'enabled': enabled})
+
+def take_latency():
+    """Histogram deltas since the last call (sent by sharded workers)"""
+    return {stage: hist.take() for stage, hist in latency.items()}
+
+def stats_snapshot():
+    """Counters plus the rates and latency percentiles of the last interval"""
+    snapshot = dict(detection_stats)
+    snapshot['model_variant'] = MODEL_VARIANT or 'full'
+    snapshot['tracing'] = tracer.enabled
+    snapshot['rates'] = rate_tracker.update(snapshot, time.monotonic())
+    snapshot['latency'] = {stage: hist.summary() for stage, hist in latency.items()}
+    snapshot['queues'] = {name: gauge() for name, gauge in queue_gauges.items()}
+    # Share of packets the cascade kept away from the full model, and the mean
+    # scoring cost per packet (prefilter + cache + model) since startup
+    scored = snapshot['fast_path'] + snapshot['full_model']
+    snapshot['cascade'] = {
+        'enabled': CASCADE,
+        'fast_path_fraction': round(snapshot['fast_path'] / scored, 4) if scored else 0.0,
+        'cost_us_per_packet': round(snapshot['inference_s'] / scored * 1e6, 2) if scored else 0.0,
+    }
+    return snapshot
 
 def publish_stats(client):
     """Background thread to publish stats every 1 second"""
     while True:
         try:
-            client.publish(STATS_TOPIC, json.dumps(detection_stats))
+            client.publish(STATS_TOPIC, json.dumps(stats_snapshot()))
         except Exception as e:
             print(f"Error publishing stats: {e}")
+        log.flush()
         time.sleep(1)
 
-def preprocess_message(data):
+def preprocess_batch(records, out=None):
+    """Vectorize a list of JSON packets for the AI model (one row per packet)"""
+    return vectorizer.transform_batch(records, out)
+
+def preprocess_message(data, out=None):
     """Preprocess a single JSON packet for the AI model"""
-    # 1. Convert to DataFrame
-    df = pd.DataFrame([data])
+    return vectorizer.transform(data, out)
+
+def on_connect(client, userdata, flags, reason_code, properties):
+    print(f"Connected to MQTT broker with code: {reason_code}")
+    client.subscribe([(SUBSCRIBE_TOPIC, 0), (BINARY_TOPIC, 0), (CONTROL_TOPIC, 0)])
+
+def handle_verdict(data, prediction, probability, outbox):
+    """Update stats for one scored packet and queue its alert / BLOCK messages"""
+    source_ip = data.get('source_ip')
+    now = time.monotonic()
+    # A source blocked earlier in the same batch is dropped, as in per-message mode
+    if blocklist.is_blocked(source_ip, now):
+        detection_stats['blocked_dropped'] += 1
+        return
     
-    # 2. Drop non-feature columns
-    if 'label' in df.columns: df = df.drop('label', axis=1)
-    if 'source_ip' in df.columns: df = df.drop('source_ip', axis=1)
+    detection_stats['total'] += 1
     
-    # 3. One-hot encode
-    categorical = ['protocol_type', 'service', 'flag']
-    df_encoded = pd.get_dummies(df, columns=categorical)
+    if prediction == 'Normal':
+        detection_stats['normal'] += 1
+    else:
+        detection_stats['attacks'] += 1
+        pred_key = prediction.lower()
+        if pred_key in detection_stats:
+            detection_stats[pred_key] += 1
+        
+        # Generate Alert
+        alert = {
+            'timestamp': datetime.now().isoformat(),
+            'attack_type': prediction,
+            'confidence': float(probability),
+            'source': data.get('protocol_type', 'unknown'),
+            'severity': 'HIGH' if prediction in ['DoS', 'U2R'] else 'MEDIUM',
+            'source_ip': source_ip or 'Unknown'
+        }
+        # Load generators tag packets so alerts can be matched for latency
+        if 'packet_id' in data:
+            alert['packet_id'] = data['packet_id']
+        
+        outbox.append((ALERT_TOPIC, json.dumps(alert)))
+        
+        # IPS Block Logic: accumulated per-source evidence, once per source per TTL window
+        evidence = None
+        if source_ip is not None:
+            evidence = source_scores.add(source_ip, prediction, float(probability), now)
+            detection_stats['tracked_sources'] = len(source_scores)
+            detection_stats['source_evictions'] = source_scores.evictions
+        if evidence is not None:
+            blocked = blocklist.block(source_ip, now)
+            if blocked is not None:
+                ttl, strike = blocked
+                block_cmd = {
+                    'command': 'BLOCK',
+                    'target': source_ip,
+                    'reason': f"{evidence['class']} Attack Detected",
+                    'timestamp': datetime.now().isoformat(),
+                    'ttl': ttl,
+                    'strike': strike,
+                    'evidence': evidence,
+                    'origin': ENGINE_ORIGIN
+                }
+                outbox.append((CONTROL_TOPIC, json.dumps(block_cmd)))
+                detection_stats['active_blocks'] = len(blocklist)
+                log.event('block', "🛑 IPS BLOCK: {target} ({attack_type} score {score:.2f} from {packets} "
+                          "packets in {window_s:.1f}s, {ttl:.0f}s, strike {strike})",
+                          target=source_ip, attack_type=evidence['class'], score=evidence['score'],
+                          packets=evidence['packets'], window_s=evidence['window_s'], ttl=ttl, strike=strike)
+
+        log.event('alert', "ALERT: {attack_type} detected", attack_type=prediction,
+                  source_ip=alert['source_ip'], confidence=alert['confidence'])
+
+def score_features(features):
+    """Score a block of feature rows -> (labels, confidences), through the cascade if enabled"""
+    start = time.perf_counter()
+    if prefilter is None:
+        predictions, confidences = score_full(features)
+        detection_stats['full_model'] += len(features)
+    else:
+        fast, normal_confidences = prefilter.screen(features)
+        n_fast = int(fast.sum())
+        if n_fast == len(features):
+            predictions = np.full(n_fast, 'Normal', dtype=object)
+            confidences = normal_confidences
+        else:
+            predictions = np.empty(len(features), dtype=object)
+            confidences = np.empty(len(features))
+            predictions[fast] = 'Normal'
+            confidences[fast] = normal_confidences
+            suspicious = ~fast
+            predictions[suspicious], confidences[suspicious] = score_full(features[suspicious])
+        detection_stats['fast_path'] += n_fast
+        detection_stats['full_model'] += len(features) - n_fast
+    detection_stats['inference_s'] += time.perf_counter() - start
+    return predictions, confidences
+
+def score_full(features):
+    """Run the model ONCE on a block of feature rows -> (labels, confidences)"""
+    # --- XGBOOST PREDICTION LOGIC ---
+    # Probabilities from the booster, label = argmax (same as model.predict),
+    # confidence = max probability. Class names come from a precomputed array.
+    if verdict_cache is None:
+        predictions, confidences, _ = scorer.score(features)
+        return predictions, confidences
     
-    # 4. Align columns
-    df_aligned = df_encoded.reindex(columns=feature_names, fill_value=0)
+    # Only rows without a cached verdict go through the model
+    now = time.monotonic()
+    keys = verdict_cache.keys(features)
+    predictions = np.empty(len(keys), dtype=object)
+    confidences = np.empty(len(keys))
+    misses = verdict_cache.lookup(keys, predictions, confidences, now)
+    if misses:
+        # Identical rows inside the batch (a DoS burst) are scored once
+        first = {}  # key -> first row index
+        for i in misses:
+            first.setdefault(keys[i], i)
+        labels, probs, _ = scorer.score(features[list(first.values())])
+        slot = {key: n for n, key in enumerate(first)}
+        slots = [slot[keys[i]] for i in misses]
+        predictions[misses] = labels[slots]
+        confidences[misses] = probs[slots]
+        verdict_cache.store(list(first), labels, probs, now)
     
-    # 5. Scale
-    df_scaled = scaler.transform(df_aligned)
-    df_scaled = pd.DataFrame(df_scaled, columns=feature_names)
+    detection_stats['cache_hits'] = verdict_cache.hits
+    detection_stats['cache_misses'] = verdict_cache.misses
+    detection_stats['cache_evictions'] = verdict_cache.evictions
+    return predictions, confidences
+
+def predict_records(records, out=None):
+    """Score a list of packets with ONE model call -> (labels, confidences)"""
+    start = time.perf_counter()
+    with tracer.span('preprocess'):
+        features = preprocess_batch(records, out)
+    vectorized = time.perf_counter()
+    latency['preprocess'].record(vectorized - start)
+    with tracer.span('predict'):
+        predictions, confidences = score_features(features)
+    latency['inference'].record(time.perf_counter() - vectorized)
+    return predictions, confidences
+
+def score_binary(arr, features, outbox):
+    """Score a decoded binary message (structured array) in feature-block sized chunks"""
+    if not len(arr):
+        return
+    now = time.monotonic()
+    # Source IPs are unpacked once per distinct source, not per record
+    ip_codes, inverse = np.unique(arr['source_ip'], return_inverse=True)
+    ips = [wire_format.int_to_ip(code) for code in ip_codes]
+    blocked = np.array([blocklist.is_blocked(ip, now) for ip in ips], dtype=bool)[inverse]
+    if blocked.any():
+        # Short-circuit blocked sources before vectorizing and inference
+        detection_stats['blocked_dropped'] += int(blocked.sum())
+        keep = np.nonzero(~blocked)[0]
+        arr, inverse = arr[keep], inverse[keep]
+        if not len(arr):
+            return
     
-    # 6. Select Features
-    df_selected = df_scaled[selected_features]
+    step = len(features) if features is not None else len(arr)
+    for start in range(0, len(arr), step):
+        chunk = arr[start:start + step]
+        began = time.perf_counter()
+        with tracer.span('preprocess'):
+            rows = vectorizer.transform_coded(chunk, wire_format.VOCABULARIES, features)
+        vectorized = time.perf_counter()
+        latency['preprocess'].record(vectorized - began)
+        with tracer.span('predict'):
+            predictions, confidences = score_features(rows)
+        latency['inference'].record(time.perf_counter() - vectorized)
+        protocols = chunk['protocol_type']
+        with tracer.span('verdicts'):
+            for i in range(len(chunk)):
+                code = protocols[i]
+                data = {
+                    'source_ip': ips[inverse[start + i]],
+                    'protocol_type': wire_format.PROTOCOLS[code] if code < len(wire_format.PROTOCOLS) else 'unknown'
+                }
+                handle_verdict(data, predictions[i], confidences[i], outbox)
+
+def aggregate_binary(arr, now):
+    """Copy of a decoded binary message with server-side window features (blocked sources are skipped)"""
+    arr = arr.copy()  # decode() returns a read-only view of the payload
+    ip_codes, inverse = np.unique(arr['source_ip'], return_inverse=True)
+    blocked = np.array([blocklist.is_blocked(wire_format.int_to_ip(code), now) for code in ip_codes],
+                       dtype=bool)[inverse]
+    return traffic_aggregator.update_array(arr, wire_format.VOCABULARIES, now, blocked)
+
+def decode_payloads(payloads):
+    """Parse raw MQTT payloads -> (JSON records, decoded binary arrays, packets dropped as blocked)"""
+    now = time.monotonic()
+    records = []
+    binary = []
+    dropped = 0
+    for payload in payloads:
+        try:
+            if wire_format.is_binary(payload):
+                arr = wire_format.decode(payload)
+                if AGGREGATE_FEATURES:
+                    arr = aggregate_binary(arr, now)
+                binary.append(arr)
+                continue
+            data = json.loads(payload.decode())
+            # Short-circuit blocked sources before preprocessing and inference
+            if blocklist.is_blocked(data.get('source_ip'), now):
+                dropped += 1
+                continue
+            if AGGREGATE_FEATURES:
+                traffic_aggregator.update(data, now)
+            records.append(data)
+        except Exception as e:
+            log.event('error', "Error processing message: {error}", error=e)
+    # Counted by score_decoded: in asyncio mode decoding runs on another thread than scoring
+    return records, binary, dropped
+
+def score_decoded(records, binary, features=None, dropped=0):
+    """Score decoded packets, returns the (topic, payload) list to publish.
+    Runs on the scoring thread, the only one that updates blocked_dropped."""
+    detection_stats['blocked_dropped'] += dropped
+    outbox = []
+    for arr in binary:
+        try:
+            score_binary(arr, features, outbox)
+        except Exception as e:
+            log.event('error', "Error processing binary message: {error}", error=e)
+    if not records:
+        return outbox
     
-    return df_selected
+    try:
+        predictions, confidences = predict_records(records, features)
+    except Exception:
+        # One malformed packet must not drop the whole batch:
+        # fall back to per-message scoring so errors stay per packet.
+        for data in records:
+            try:
+                predictions, confidences = predict_records([data], features)
+                handle_verdict(data, predictions[0], confidences[0], outbox)
+            except Exception as e:
+                log.event('error', "Error processing message: {error}", error=e)
+        return outbox
+    
+    with tracer.span('verdicts'):
+        for data, prediction, probability in zip(records, predictions, confidences):
+            handle_verdict(data, prediction, probability, outbox)
+    return outbox
 
-def on_connect(client, userdata, flags, rc):
-    print(f"Connected to MQTT broker with code: {rc}")
-    client.subscribe(SUBSCRIBE_TOPIC)
+def score_batch(payloads, features=None):
+    """Score a batch of raw MQTT payloads, returns the (topic, payload) list to publish.
+    `features` is an optional preallocated (BATCH_SIZE, n_features) block to vectorize into."""
+    with tracer.span('decode'):
+        records, binary, dropped = decode_payloads(payloads)
+    return score_decoded(records, binary, features, dropped)
 
-def on_message(client, userdata, msg):
+def publish_outbox(client, outbox):
+    """Hand the alerts / commands of one batch to paho"""
+    with tracer.span('publish'):
+        for topic, payload in outbox:
+            client.publish(topic, payload)
+
+def unblock_command(ip, reason):
+    return {
+        'command': 'UNBLOCK',
+        'target': ip,
+        'reason': reason,
+        'timestamp': datetime.now().isoformat(),
+        'origin': ENGINE_ORIGIN
+    }
+
+def blocklist_sweeper(client):
+    """Background thread: publish UNBLOCK for blocks whose TTL ran out"""
+    while True:
+        time.sleep(BLOCK_SWEEP_INTERVAL)
+        try:
+            for ip in blocklist.expire(time.monotonic()):
+                client.publish(CONTROL_TOPIC, json.dumps(unblock_command(ip, "Block expired")))
+                log.event('unblock', "✅ IPS UNBLOCK: {target} (block expired)", target=ip, reason='expired')
+            detection_stats['active_blocks'] = len(blocklist)
+        except Exception as e:
+            print(f"Error expiring blocks: {e}")
+
+def reload_model(reason, force=True):
+    """Load, check and warm the current artifacts off the scoring thread, then stage them"""
+    global pending_bundle
+    with reload_lock:
+        start = time.perf_counter()
+        try:
+            if not force and artifact_version(ARTIFACT_PATHS) == active_bundle.version:
+                return
+            bundle = load_models()
+            bundle.check()
+            if BOOSTER_THREADS:
+                bundle.scorer.set_threads(BOOSTER_THREADS)
+            bundle.warm()
+        except Exception as e:
+            detection_stats['reload_failures'] += 1
+            print(f"❌ Model reload failed ({reason}): {e}")
+            return
+        detection_stats['last_reload_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        with _pending_lock:
+            pending_bundle = bundle
+        print(f"🔄 Model {bundle.version} ready ({reason}, {detection_stats['last_reload_ms']} ms)")
+
+def start_reload(reason, force=True):
+    reload_thread = threading.Thread(target=reload_model, args=(reason, force))
+    reload_thread.daemon = True
+    reload_thread.start()
+
+def apply_pending_reload():
+    """Swap in a staged bundle -> True if swapped. Only called by the scoring thread, between batches or while idle."""
+    global pending_bundle, active_bundle, vectorizer, scorer, selected_features, prefilter, verdict_cache, source_scores
+    if pending_bundle is None:
+        return False
+    with _pending_lock:
+        bundle, pending_bundle = pending_bundle, None
+    previous = active_bundle
+    active_bundle = bundle
+    vectorizer, scorer, selected_features = bundle.vectorizer, bundle.scorer, bundle.selected_features
+    prefilter = bundle.prefilter
+    # Cached verdicts were produced by the previous model
+    if verdict_cache is not None:
+        if bundle.selected_features == previous.selected_features:
+            verdict_cache.clear()
+        else:
+            verdict_cache = build_verdict_cache()
+    # Evidence is kept across reloads unless the attack classes changed
+    if list(scorer.class_names) != list(previous.scorer.class_names):
+        source_scores = build_source_scores()
+    detection_stats['model_version'] = bundle.version
+    detection_stats['reloads'] += 1
+    print(f"✅ Now scoring with model {bundle.version} (was {previous.version})")
+    return True
+
+def artifact_watcher():
+    """Background thread: reload once changed artifact files have stopped changing"""
+    seen = artifact_mtimes(ARTIFACT_PATHS)
+    while True:
+        time.sleep(RELOAD_POLL_INTERVAL)
+        current = artifact_mtimes(ARTIFACT_PATHS)
+        if current == seen:
+            continue
+        # train_model.py writes the files one after the other: wait for a quiet poll
+        time.sleep(RELOAD_POLL_INTERVAL)
+        if artifact_mtimes(ARTIFACT_PATHS) != current:
+            continue
+        seen = current
+        reload_model("artifacts changed", force=False)
+
+def handle_control(command):
+    """Apply an operator command from network/control (UNBLOCK lifts a block early, RELOAD swaps the model)"""
+    # The engine's own BLOCK / UNBLOCK messages come back on the same topic
+    if command.get('origin') == ENGINE_ORIGIN:
+        return
+    if command.get('command') == 'RELOAD':
+        start_reload("RELOAD command")
+    elif command.get('command') == 'TRACE':
+        # Only reaches here in worker processes, see route_control
+        tracer.set_enabled(command.get('enabled', not tracer.enabled))
+    elif command.get('command') == 'UNBLOCK' and blocklist.unblock(command.get('target')):
+        source_scores.forget(command.get('target'), time.monotonic())
+        detection_stats['active_blocks'] = len(blocklist)
+        log.event('unblock', "✅ IPS UNBLOCK: {target} (operator)", target=command.get('target'),
+                  reason='operator')
+
+def route_control(payload):
+    """Apply a control message here, or forward it to the worker owning its target"""
     try:
-        # Parse incoming message
-        data = json.loads(msg.payload.decode())
-        
-        # Preprocess
-        features = preprocess_message(data)
-        
-        # --- XGBOOST PREDICTION LOGIC ---
-        # 1. Predict (Returns an integer index, e.g., 0, 1, 3)
-        pred_index = model.predict(features)[0]
-        
-        # 2. Decode (Converts index to string, e.g., 1 -> 'DoS')
-        prediction = le.inverse_transform([pred_index])[0]
-        
-        # 3. Get Confidence (Max probability)
-        probability = model.predict_proba(features).max()
-        
-        # --- Update Stats & Alerts ---
-        detection_stats['total'] += 1
-        
-        if prediction == 'Normal':
-            detection_stats['normal'] += 1
+        command = json.loads(payload.decode())
+        if command.get('command') == 'TRACE':
+            set_tracing(command.get('enabled'))
+        elif shard_inboxes and command.get('command') == 'RELOAD':
+            # Every worker holds its own copy of the model
+            for inbox in shard_inboxes:
+                inbox.put(command)
+        elif shard_inboxes:
+            target = str(command.get('target', '')).encode()
+            shard_inboxes[zlib.crc32(target) % len(shard_inboxes)].put(command)
         else:
-            detection_stats['attacks'] += 1
-            pred_key = prediction.lower()
-            if pred_key in detection_stats:
-                detection_stats[pred_key] += 1
-            
-            # Generate Alert
-            alert = {
-                'timestamp': datetime.now().isoformat(),
-                'attack_type': prediction,
-                'confidence': float(probability),
-                'source': data.get('protocol_type', 'unknown'),
-                'severity': 'HIGH' if prediction in ['DoS', 'U2R'] else 'MEDIUM',
-                'source_ip': data.get('source_ip', 'Unknown')
-            }
-            
-            client.publish(ALERT_TOPIC, json.dumps(alert))
-            
-            # IPS Block Logic (> 80% confidence)
-            if probability > 0.80:
-                block_cmd = {
-                    'command': 'BLOCK',
-                    'target': data.get('source_ip', 'unknown'),
-                    'reason': f"{prediction} Attack Detected",
-                    'timestamp': datetime.now().isoformat()
-                }
-                client.publish(CONTROL_TOPIC, json.dumps(block_cmd))
-                print(f"🛑 IPS BLOCK: {data.get('source_ip')} ({prediction})")
+            handle_control(command)
+    except Exception as e:
+        log.event('error', "Error processing control message: {error}", error=e)
+
+def collect_batch(source, idle_timeout=None):
+    """Block for the first message, then fill the batch until it is full
+    or BATCH_WAIT_MS has passed since the first message arrived.
+    Raises queue.Empty if nothing arrives within idle_timeout seconds."""
+    batch = [source.get(timeout=idle_timeout)]
+    deadline = time.monotonic() + BATCH_WAIT_MS / 1000.0
+    while len(batch) < BATCH_SIZE:
+        try:
+            batch.append(source.get_nowait())
+            continue
+        except queue.Empty:
+            pass
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(source.get(timeout=timeout))
+        except queue.Empty:
+            break
+    return batch
+
+def process_batch(client, batch, features):
+    """Score one batch of (received_at, payload) and publish its alerts / BLOCK commands"""
+    received = np.fromiter((item[0] for item in batch), dtype=np.float64, count=len(batch))
+    latency['queue_wait'].record_many(time.monotonic() - received)
+    try:
+        publish_outbox(client, score_batch([item[1] for item in batch], features))
+    except Exception as e:
+        log.event('error', "Error processing batch: {error}", error=e)
+    latency['end_to_end'].record_many(time.monotonic() - received)
+
+def batch_worker(client):
+    """Drain the message queue in micro-batches and publish the results"""
+    # Preallocated feature block, reused for every batch
+    features = np.empty((BATCH_SIZE, vectorizer.n_features), dtype=FEATURE_DTYPE)
+    while True:
+        try:
+            batch = collect_batch(message_queue, RELOAD_IDLE_CHECK)
+        except queue.Empty:
+            batch = None  # idle: still apply a staged reload
+        if apply_pending_reload() and features.shape[1] != vectorizer.n_features:
+            features = np.empty((BATCH_SIZE, vectorizer.n_features), dtype=FEATURE_DTYPE)
+        if batch:
+            process_batch(client, batch, features)
+
+# --- Sharded Multi-process Mode ---
+
+def shard_of(payload, workers):
+    """Stable worker index for a raw packet, keyed on its source_ip"""
+    # A regex over the raw bytes is much cheaper than a full json.loads
+    match = _SOURCE_IP_RE.search(payload)
+    return zlib.crc32(match.group(1) if match else b'') % workers
+
+def shard_binary(payload, workers):
+    """Split a binary message into one re-framed message per owning worker"""
+    arr = wire_format.decode(payload)
+    ip_codes, inverse = np.unique(arr['source_ip'], return_inverse=True)
+    # Same key as JSON packets (crc32 of the dotted IP, b'' without one) so affinity holds across formats
+    owners = np.array([zlib.crc32((wire_format.int_to_ip(code) or '').encode()) % workers
+                       for code in ip_codes], dtype=np.intp)[inverse]
+    return [(index, wire_format.encode_array(arr[owners == index]))
+            for index in np.unique(owners)]
+
+def dispatch_worker(inboxes):
+    """Main process: batch incoming messages and route them to worker shards"""
+    while True:
+        shards = [[] for _ in inboxes]
+        batch = collect_batch(message_queue)
+        # Receipt times travel with the payloads (CLOCK_MONOTONIC is system-wide)
+        with tracer.span('dispatch'):
+            for received, payload in batch:
+                if wire_format.is_binary(payload):
+                    try:
+                        for index, part in shard_binary(payload, len(inboxes)):
+                            shards[index].append((received, part))
+                    except Exception as e:
+                        log.event('error', "Error processing binary message: {error}", error=e)
+                    continue
+                shards[shard_of(payload, len(inboxes))].append((received, payload))
+        for inbox, shard in zip(inboxes, shards):
+            if shard:
+                inbox.put(shard)
+
+def shard_worker(index, inbox, stats_queue, batch_size, threads, parent_pid):
+    """Worker process: score the batches of one shard with its own MQTT publisher"""
+    global BOOSTER_THREADS
+    # Counters inherited through fork belong to the main process
+    for key in detection_stats:
+        detection_stats[key] = 0
+    detection_stats['model_version'] = active_bundle.version
+    # Span totals go to the main process with the counters, which reports them
+    tracer.take()
+    tracer.component = f"engine worker {index}"
+    tracer.interval = 0
+    # K workers share the cores, so each booster only gets its share of threads
+    BOOSTER_THREADS = threads
+    scorer.set_threads(threads)
+    
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, f"DetectionEngine-{index}")
+    try:
+        client.connect(BROKER, PORT, 60)
+    except Exception as e:
+        print(f"Worker {index}: could not connect to MQTT broker: {e}")
+        return
+    client.loop_start()
+    
+    sweeper_thread = threading.Thread(target=blocklist_sweeper, args=(client,))
+    sweeper_thread.daemon = True
+    sweeper_thread.start()
+    if RELOAD_POLL_INTERVAL > 0:
+        watcher_thread = threading.Thread(target=artifact_watcher)
+        watcher_thread.daemon = True
+        watcher_thread.start()
+    
+    features = np.empty((batch_size, vectorizer.n_features), dtype=FEATURE_DTYPE)
+    last_report = 0.0
+    while True:
+        try:
+            item = inbox.get(timeout=WORKER_STATS_INTERVAL)
+        except queue.Empty:
+            item = None  # idle: still apply a staged reload
+        if apply_pending_reload() and features.shape[1] != vectorizer.n_features:
+            features = np.empty((batch_size, vectorizer.n_features), dtype=FEATURE_DTYPE)
+        # Inbox items are batches of (received_at, payload) or routed control commands
+        if isinstance(item, dict):
+            handle_control(item)
+        elif item is not None:
+            process_batch(client, item, features)
+        now = time.monotonic()
+        if now - last_report >= WORKER_STATS_INTERVAL:
+            # Daemon workers are not cleaned up when the main process is killed
+            if os.getppid() != parent_pid:
+                return
+            stats_queue.put((index, dict(detection_stats), take_latency(), tracer.take()))
+            last_report = now
+
+def merge_stats(snapshots):
+    """Sum per-worker counters into one detection_stats dict"""
+    merged = {}
+    versions = set()
+    for snapshot in snapshots:
+        for key, value in snapshot.items():
+            if key == 'model_version':
+                versions.add(value)
+            elif key in MERGE_MAX_STATS:
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    # Several versions only show up while the workers are mid-reload
+    merged['model_version'] = ','.join(sorted(versions))
+    return merged
+
+def collect_worker_stats(stats_queue):
+    """Main process: keep the latest counters of every worker merged in detection_stats"""
+    snapshots = {}
+    while True:
+        index, snapshot, deltas, spans = stats_queue.get()
+        snapshots[index] = snapshot
+        for stage, delta in deltas.items():
+            latency[stage].merge(delta)
+        tracer.merge(spans)
+        detection_stats.update(merge_stats(snapshots.values()))
+
+def start_shard_workers(workers):
+    """Fork the worker processes (after the model is loaded) -> (inboxes, stats_queue)"""
+    # fork shares the loaded model copy-on-write; platforms without fork
+    # (Windows) re-import this module, which loads the model in each worker
+    methods = mp.get_all_start_methods()
+    ctx = mp.get_context('fork' if 'fork' in methods else methods[0])
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    stats_queue = ctx.Queue()
+    inboxes = []
+    for index in range(workers):
+        inbox = ctx.Queue(maxsize=SHARD_QUEUE_BATCHES)
+        proc = ctx.Process(target=shard_worker,
+                           args=(index, inbox, stats_queue, BATCH_SIZE, threads, os.getpid()))
+        proc.daemon = True
+        proc.start()
+        inboxes.append(inbox)
+    return inboxes, stats_queue
+
+def on_message(client, userdata, msg):
+    if msg.topic == CONTROL_TOPIC:
+        route_control(msg.payload)
+        return
+    # Keep the paho network thread free: parsing and scoring happen in batch_worker.
+    # put() blocks when the queue is full, which pushes back on the broker.
+    message_queue.put((time.monotonic(), msg.payload))
+
+# --- Asyncio Pipeline Mode ---
+# With --asyncio the broker socket is driven by an asyncio event loop
+# (mqtt_asyncio.py) instead of paho's network thread, and every packet goes
+# through four stages joined by bounded queues:
+#   receive  on_message appends (received_at, payload) to the receive buffer
+#   decode   batches of up to BATCH_SIZE are parsed and blocked sources dropped
+#   score    vectorize + inference on ONE executor thread, so socket reads
+#            never wait for the model
+#   publish  alerts of all finished batches are coalesced into JSON lists
+# The score and publish queues apply backpressure by awaiting put(). When the
+# receive buffer is full, ASYNC_OVERFLOW decides: 'pause' stops reading the
+# broker socket until half of it has drained (TCP backpressure to the broker),
+# 'drop-oldest' / 'drop-newest' discard packets and count them as overflow_dropped.
+ASYNC_RECEIVE_QUEUE = 10000  # packets
+ASYNC_SCORE_QUEUE = 8        # decoded batches waiting for the executor
+ASYNC_PUBLISH_QUEUE = 64     # scored batches waiting to be published
+ASYNC_OVERFLOW = 'pause'
+OVERFLOW_POLICIES = ('pause', 'drop-oldest', 'drop-newest')
+PUBLISH_INTERVAL_MS = 10     # coalescing window once a scored batch is ready
+MAX_ALERTS_PER_MESSAGE = 500
+
+async_features = None  # feature block owned by the scoring thread
+scoring_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scoring')
 
-            print(f"ALERT: {prediction} detected")
+def async_receiver(receive, wakeup, helper):
+    """paho on_message for asyncio mode (runs on the event loop)"""
+    def on_message_async(client, userdata, msg):
+        if msg.topic == CONTROL_TOPIC:
+            # Control commands touch scoring state: run them on the scoring thread
+            scoring_executor.submit(route_control, msg.payload)
+            return
+        if len(receive) >= ASYNC_RECEIVE_QUEUE:
+            if ASYNC_OVERFLOW == 'drop-newest':
+                detection_stats['overflow_dropped'] += 1
+                return
+            if ASYNC_OVERFLOW == 'drop-oldest':
+                receive.popleft()
+                detection_stats['overflow_dropped'] += 1
+            else:
+                helper.pause_reading()
+        receive.append((time.monotonic(), msg.payload))
+        wakeup.set()
+    return on_message_async
+
+async def decode_stage(receive, wakeup, score_queue, helper):
+    """Batch and parse received packets, then hand them to the scoring stage"""
+    while True:
+        if not receive:
+            wakeup.clear()
+            await wakeup.wait()
+            # Give a partial batch BATCH_WAIT_MS to fill up
+            if len(receive) < BATCH_SIZE and BATCH_WAIT_MS > 0:
+                await asyncio.sleep(BATCH_WAIT_MS / 1000.0)
+        batch = [receive.popleft() for _ in range(min(BATCH_SIZE, len(receive)))]
+        if helper.paused and len(receive) <= ASYNC_RECEIVE_QUEUE // 2:
+            helper.resume_reading()
+        received = np.fromiter((item[0] for item in batch), dtype=np.float64, count=len(batch))
+        latency['queue_wait'].record_many(time.monotonic() - received)
+        with tracer.span('decode'):
+            decoded = decode_payloads([item[1] for item in batch])
+        await score_queue.put((received, decoded))
+
+def score_on_executor(records, binary, dropped):
+    """Scoring-thread side of the score stage (reloads and stats counters are applied here)"""
+    global async_features
+    if apply_pending_reload() or async_features.shape[1] != vectorizer.n_features:
+        async_features = np.empty((BATCH_SIZE, vectorizer.n_features), dtype=FEATURE_DTYPE)
+    return score_decoded(records, binary, async_features, dropped)
+
+async def score_stage(score_queue, publish_queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        received, decoded = await score_queue.get()
+        try:
+            outbox = await loop.run_in_executor(scoring_executor, score_on_executor, *decoded)
+        except Exception as e:
+            log.event('error', "Error processing batch: {error}", error=e)
+            outbox = []
+        await publish_queue.put((received, outbox))
+
+async def publish_stage(client, publish_queue):
+    """Publish scored batches, coalescing their alerts into JSON lists"""
+    while True:
+        batches = [await publish_queue.get()]
+        if PUBLISH_INTERVAL_MS > 0:
+            await asyncio.sleep(PUBLISH_INTERVAL_MS / 1000.0)
+        while not publish_queue.empty():
+            batches.append(publish_queue.get_nowait())
+        alerts = []
+        with tracer.span('publish'):
+            for _, outbox in batches:
+                for topic, payload in outbox:
+                    if topic == ALERT_TOPIC:
+                        alerts.append(payload)
+                    else:
+                        # BLOCK / UNBLOCK stay one command per message for firewall subscribers
+                        client.publish(topic, payload)
+            for start in range(0, len(alerts), MAX_ALERTS_PER_MESSAGE):
+                client.publish(ALERT_TOPIC, '[' + ','.join(alerts[start:start + MAX_ALERTS_PER_MESSAGE]) + ']')
+        now = time.monotonic()
+        for received, _ in batches:
+            latency['end_to_end'].record_many(now - received)
 
+async def async_housekeeping(client):
+    """Stats every second and expired blocks every BLOCK_SWEEP_INTERVAL, published from the loop"""
+    loop = asyncio.get_running_loop()
+    last_stats = 0.0
+    while True:
+        await asyncio.sleep(BLOCK_SWEEP_INTERVAL)
+        if pending_bundle is not None:
+            # Queued behind any batch being scored, so an idle engine still swaps models
+            await loop.run_in_executor(scoring_executor, apply_pending_reload)
+        try:
+            for ip in blocklist.expire(time.monotonic()):
+                client.publish(CONTROL_TOPIC, json.dumps(unblock_command(ip, "Block expired")))
+                log.event('unblock', "✅ IPS UNBLOCK: {target} (block expired)", target=ip, reason='expired')
+            detection_stats['active_blocks'] = len(blocklist)
+            if time.monotonic() - last_stats >= 1.0:
+                client.publish(STATS_TOPIC, json.dumps(stats_snapshot()))
+                last_stats = time.monotonic()
+                log.flush()
+        except Exception as e:
+            print(f"Error publishing stats: {e}")
+
+async def run_async_engine():
+    """Run the staged asyncio pipeline until the process is stopped"""
+    global async_features
+    loop = asyncio.get_running_loop()
+    async_features = np.empty((BATCH_SIZE, vectorizer.n_features), dtype=FEATURE_DTYPE)
+    receive = deque()
+    wakeup = asyncio.Event()
+    score_queue = asyncio.Queue(maxsize=ASYNC_SCORE_QUEUE)
+    publish_queue = asyncio.Queue(maxsize=ASYNC_PUBLISH_QUEUE)
+    queue_gauges.update({'receive': lambda: len(receive), 'score': score_queue.qsize,
+                         'publish': publish_queue.qsize})
+    
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "DetectionEngine")
+    helper = AsyncioHelper(loop, client)
+    disconnected = asyncio.Event()
+    client.on_connect = on_connect
+    client.on_message = async_receiver(receive, wakeup, helper)
+    client.on_disconnect = lambda client, userdata, flags, reason_code, properties: disconnected.set()
+    try:
+        client.connect(BROKER, PORT, 60)
     except Exception as e:
-        print(f"Error processing message: {e}")
+        print(f"Could not connect to MQTT broker: {e}")
+        return
+    
+    async def reconnect():
+        """Reconnect like loop_forever does, with the blocking connect off the loop thread"""
+        while True:
+            await disconnected.wait()
+            disconnected.clear()
+            print("⚠️  Disconnected from MQTT broker, reconnecting...")
+            while True:
+                await asyncio.sleep(1.0)
+                try:
+                    await loop.run_in_executor(None, client.reconnect)
+                    break
+                except Exception as e:
+                    print(f"Reconnect failed: {e}")
+
+    tasks = [
+        loop.create_task(decode_stage(receive, wakeup, score_queue, helper), name='decode'),
+        loop.create_task(score_stage(score_queue, publish_queue), name='score'),
+        loop.create_task(publish_stage(client, publish_queue), name='publish'),
+        loop.create_task(async_housekeeping(client), name='housekeeping'),
+        loop.create_task(reconnect(), name='reconnect'),
+    ]
+    # Every task runs forever, so the first one to finish has failed: stop the rest and exit loudly
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    client.disconnect()
+    failed = next(iter(done))
+    error = None if failed.cancelled() else failed.exception()
+    print(f"❌ Asyncio pipeline stage '{failed.get_name()}' stopped: {error!r}")
+    raise RuntimeError(f"asyncio stage '{failed.get_name()}' stopped") from error
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    client = mqtt.Client("DetectionEngine")
+    parser = argparse.ArgumentParser(description="XGBoost Detection Engine")
+    parser.add_argument('--runtime', choices=['xgboost', 'compiled'], default=MODEL_RUNTIME,
+                        help="Score with the pickled XGBoost model or the compiled NumPy ensemble")
+    parser.add_argument('--cascade', action='store_true',
+                        help=f"Screen packets with the linear prefilter ({VARIANT_PATHS['prefilter']}) first; "
+                             "only suspicious ones reach the full model")
+    parser.add_argument('--config', help="JSON engine config, e.g. {\"model_variant\": \"depth4\"} "
+                                         "to run a variant trained by train_model.py --variants")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="Max messages scored per predict_proba call (1 = per-message mode)")
+    parser.add_argument('--batch-wait-ms', type=float, default=BATCH_WAIT_MS,
+                        help="Max time to wait for a batch to fill up")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_MAXSIZE,
+                        help="Max messages buffered between MQTT and the scoring worker")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="Number of scoring processes, sharded by source_ip")
+    parser.add_argument('--block-ttl', type=float, default=BLOCK_TTL,
+                        help="Seconds a source stays blocked on its first offense")
+    parser.add_argument('--block-max-ttl', type=float, default=BLOCK_MAX_TTL,
+                        help="Upper bound for the escalated block TTL")
+    parser.add_argument('--block-score', type=float, default=BLOCK_SCORE,
+                        help="Decayed evidence score that blocks a source (R2L/U2R use their overrides)")
+    parser.add_argument('--score-half-life', type=float, default=SCORE_HALF_LIFE,
+                        help="Seconds for a source's attack scores to halve")
+    parser.add_argument('--max-sources', type=int, default=MAX_TRACKED_SOURCES,
+                        help="Max sources with tracked evidence (least recently seen are evicted)")
+    parser.add_argument('--verdict-cache-mb', type=float, default=VERDICT_CACHE_MB,
+                        help="Memory cap of the verdict cache in MB (0 disables it)")
+    parser.add_argument('--verdict-cache-ttl', type=float, default=VERDICT_CACHE_TTL,
+                        help="Seconds a cached verdict stays valid")
+    parser.add_argument('--cache-quantize', type=int, default=VERDICT_CACHE_DECIMALS,
+                        help="Round rate features to this many decimals before keying the cache")
+    parser.add_argument('--aggregate-features', action='store_true',
+                        help="Compute the NSL-KDD window features server-side from raw connections")
+    parser.add_argument('--asyncio', action='store_true',
+                        help="Run the staged asyncio pipeline (receive / decode / score / publish)")
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default=ASYNC_OVERFLOW,
+                        help="[asyncio] what to do when the receive buffer (--queue-size) is full")
+    parser.add_argument('--publish-interval-ms', type=float, default=PUBLISH_INTERVAL_MS,
+                        help="[asyncio] window for coalescing alerts into one message")
+    parser.add_argument('--reload-poll', type=float, default=RELOAD_POLL_INTERVAL,
+                        help="Seconds between checks for new model artifacts (0 = RELOAD command only)")
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text',
+                        help="Per-packet event lines as text or JSON records")
+    parser.add_argument('--log-burst', type=int, default=LOG_BURST,
+                        help="Lines per event kind per second before sampling kicks in")
+    parser.add_argument('--trace', action='store_true',
+                        help="Start with per-stage tracing on (toggle at runtime with SIGUSR1 "
+                             "or a TRACE command on network/control)")
+    parser.add_argument('--trace-interval', type=float, default=TRACE_INTERVAL,
+                        help="Seconds between per-stage timing breakdowns while tracing")
+    args = parser.parse_args()
+    BATCH_SIZE = max(1, args.batch_size)
+    BATCH_WAIT_MS = max(0.0, args.batch_wait_ms)
+    WORKERS = max(1, args.workers)
+    message_queue = queue.Queue(maxsize=args.queue_size)
+    blocklist = Blocklist(args.block_ttl, args.block_max_ttl, BLOCK_ESCALATION)
+    BLOCK_SCORE = args.block_score
+    SCORE_HALF_LIFE = args.score_half_life
+    MAX_TRACKED_SOURCES = max(1, args.max_sources)
+    source_scores = build_source_scores()
+    AGGREGATE_FEATURES = args.aggregate_features
+    VERDICT_CACHE_MB = args.verdict_cache_mb
+    VERDICT_CACHE_TTL = args.verdict_cache_ttl
+    VERDICT_CACHE_DECIMALS = args.cache_quantize
+    verdict_cache = build_verdict_cache()
+    RELOAD_POLL_INTERVAL = args.reload_poll
+    ASYNC_RECEIVE_QUEUE = max(1, args.queue_size)
+    ASYNC_OVERFLOW = args.overflow
+    PUBLISH_INTERVAL_MS = max(0.0, args.publish_interval_ms)
+    log = SampledLog(args.log_format, max(0, args.log_burst))
+    tracer = Tracer('engine', log, max(0.1, args.trace_interval))
+    install_toggle(set_tracing)
+
+    if AGGREGATE_FEATURES and WORKERS > 1:
+        parser.error("--aggregate-features needs every connection in one window, "
+                     "it cannot be combined with --workers")
+    if args.asyncio:
+        if WORKERS > 1:
+            parser.error("--asyncio scores in a single process, it cannot be combined with --workers")
+        print("🚀 XGBoost Detection Engine Started (asyncio pipeline)...")
+        if args.trace:
+            set_tracing(True)
+        if RELOAD_POLL_INTERVAL > 0:
+            watcher_thread = threading.Thread(target=artifact_watcher)
+            watcher_thread.daemon = True
+            watcher_thread.start()
+        asyncio.run(run_async_engine())
+        exit()
+
+    # Fork the workers before any MQTT connection or thread exists
+    if WORKERS > 1:
+        shard_inboxes, stats_queue = start_shard_workers(WORKERS)
+    queue_gauges['receive'] = message_queue.qsize
+    for index, inbox in enumerate(shard_inboxes):
+        queue_gauges[f'shard_{index}'] = inbox.qsize
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "DetectionEngine")
     client.on_connect = on_connect
     client.on_message = on_message
 
@@ -152,10 +1178,29 @@ if __name__ == "__main__":
         print(f"Could not connect to MQTT broker: {e}")
         exit()
 
-    print("🚀 XGBoost Detection Engine Started...")
+    print(f"🚀 XGBoost Detection Engine Started ({WORKERS} worker{'s' if WORKERS > 1 else ''})...")
+    if args.trace:
+        set_tracing(True)
     
     stats_thread = threading.Thread(target=publish_stats, args=(client,))
     stats_thread.daemon = True
     stats_thread.start()
 
+    if WORKERS > 1:
+        merge_thread = threading.Thread(target=collect_worker_stats, args=(stats_queue,))
+        merge_thread.daemon = True
+        merge_thread.start()
+        worker_thread = threading.Thread(target=dispatch_worker, args=(shard_inboxes,))
+    else:
+        worker_thread = threading.Thread(target=batch_worker, args=(client,))
+        sweeper_thread = threading.Thread(target=blocklist_sweeper, args=(client,))
+        sweeper_thread.daemon = True
+        sweeper_thread.start()
+        if RELOAD_POLL_INTERVAL > 0:
+            watcher_thread = threading.Thread(target=artifact_watcher)
+            watcher_thread.daemon = True
+            watcher_thread.start()
+    worker_thread.daemon = True
+    worker_thread.start()
+
     client.loop_forever()
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Time-series metrics for the detection engine.
+
+LatencyHistogram is an HDR-style log-linear histogram: values are recorded in
+microseconds into SUB_BUCKETS linear buckets per power of two (about 3%
+relative error) from 1 us up to ~38 hours, in a fixed array of counts. Batches
+are recorded with one bincount, histograms from several workers merge by
+adding counts, and percentiles come from a cumulative sum, so the cost does
+not depend on how many samples were recorded.
+
+RateTracker turns the engine's cumulative counters into per-second rates,
+both for the last interval and averaged over a rolling window.
+"""
+import threading
+from collections import deque
+
+import numpy as np
+
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS          # linear buckets per power of two
+LINEAR_LIMIT = 2 * SUB_BUCKETS       # values below this are stored exactly
+MAX_SHIFT = 32
+N_BUCKETS = LINEAR_LIMIT + MAX_SHIFT * SUB_BUCKETS
+MAX_US = ((2 * SUB_BUCKETS) << MAX_SHIFT) - 1
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(us):
+    """Bucket of each (int64) microsecond value"""
+    us = np.clip(us, 0, MAX_US)
+    # Bit length (exact for ints below 2**53), shift keeps SUB_BITS + 1 top bits
+    shift = np.maximum(np.frexp(us.astype(np.float64))[1] - (SUB_BITS + 1), 0)
+    return np.where(shift == 0, us,
+                    LINEAR_LIMIT + (shift - 1) * SUB_BUCKETS + (us >> shift) - SUB_BUCKETS)
+
+
+def bucket_value(index):
+    """Midpoint (in microseconds) of each bucket"""
+    index = np.asarray(index, dtype=np.int64)
+    shift = np.where(index < LINEAR_LIMIT, 0, (index - LINEAR_LIMIT) // SUB_BUCKETS + 1)
+    top = np.where(index < LINEAR_LIMIT, index, (index - LINEAR_LIMIT) % SUB_BUCKETS + SUB_BUCKETS)
+    return (top << shift) + ((1 << shift) - 1) / 2.0
+
+
+class LatencyHistogram:
+    """Thread-safe log-linear latency histogram (record seconds, report milliseconds)"""
+
+    def __init__(self):
+        self._counts = np.zeros(N_BUCKETS, dtype=np.int64)
+        self._total_us = 0.0
+        self._max_us = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        us = min(max(int(seconds * 1e6), 0), MAX_US)
+        shift = max(us.bit_length() - (SUB_BITS + 1), 0)
+        index = us if shift == 0 else LINEAR_LIMIT + (shift - 1) * SUB_BUCKETS + (us >> shift) - SUB_BUCKETS
+        with self._lock:
+            self._counts[index] += 1
+            self._total_us += us
+            self._max_us = max(self._max_us, us)
+
+    def record_many(self, seconds):
+        """Record an array of durations in seconds"""
+        if not len(seconds):
+            return
+        us = (np.asarray(seconds, dtype=np.float64) * 1e6).astype(np.int64)
+        counts = np.bincount(bucket_index(us), minlength=N_BUCKETS)
+        with self._lock:
+            self._counts += counts
+            self._total_us += float(us.sum())
+            self._max_us = max(self._max_us, int(us.max()))
+
+    def take(self):
+        """Sparse copy of the counts since the last take() -> (indices, counts, total_us, max_us); resets"""
+        with self._lock:
+            counts = self._counts
+            self._counts = np.zeros(N_BUCKETS, dtype=np.int64)
+            total_us, max_us = self._total_us, self._max_us
+            self._total_us, self._max_us = 0.0, 0
+        nonzero = np.nonzero(counts)[0]
+        return nonzero, counts[nonzero], total_us, max_us
+
+    def merge(self, delta):
+        """Add a take() result from another histogram (e.g. a worker process)"""
+        indices, counts, total_us, max_us = delta
+        with self._lock:
+            self._counts[indices] += counts
+            self._total_us += total_us
+            self._max_us = max(self._max_us, max_us)
+
+    def summary(self):
+        """Compact snapshot {'count', 'mean', 'p50', 'p90', 'p99', 'p99.9', 'max'} in ms; resets"""
+        indices, counts, total_us, max_us = self.take()
+        n = int(counts.sum())
+        if n == 0:
+            return {'count': 0}
+        cumulative = np.cumsum(counts)
+        ranks = np.ceil(np.array(PERCENTILES) / 100.0 * n)
+        values = bucket_value(indices[np.searchsorted(cumulative, ranks)])
+        snapshot = {'count': n, 'mean': round(total_us / n / 1000.0, 3)}
+        for p, value in zip(PERCENTILES, values):
+            snapshot[f"p{p:g}"] = round(float(min(value, max_us)) / 1000.0, 3)
+        snapshot['max'] = round(max_us / 1000.0, 3)
+        return snapshot
+
+
+class RateTracker:
+    """Per-second rates of cumulative counters over the last interval and a rolling window"""
+
+    def __init__(self, keys, window=60):
+        self.keys = tuple(keys)
+        self._history = deque(maxlen=window + 1)  # (time, counter values)
+
+    def update(self, counters, now):
+        """Add a counter snapshot -> {'now': {key: rate}, 'avg': {key: rate}}"""
+        values = np.array([counters.get(key, 0) for key in self.keys], dtype=np.float64)
+        self._history.append((now, values))
+        if len(self._history) < 2:
+            return {'now': dict.fromkeys(self.keys, 0.0), 'avg': dict.fromkeys(self.keys, 0.0)}
+        (t_prev, prev), (t_first, first) = self._history[-2], self._history[0]
+        # Counters can move backwards when a worker restarts: clamp to 0
+        current = np.maximum(values - prev, 0) / max(now - t_prev, 1e-9)
+        average = np.maximum(values - first, 0) / max(now - t_first, 1e-9)
+        return {'now': dict(zip(self.keys, np.round(current, 1).tolist())),
+                'avg': dict(zip(self.keys, np.round(average, 1).tolist()))}
@@ -0,0 +1,247 @@
+"""
+Pandas-free feature vectorizer for the detection engine.
+
+Replaces the per-packet DataFrame -> get_dummies -> reindex -> scaler.transform
+pipeline with precomputed column indices and the MinMax scale_/min_ arrays
+folded in. Packets are written straight into a preallocated NumPy row (or a
+block of rows for a batch) with exactly the same float64 arithmetic as
+MinMaxScaler.transform, so the output is bit-identical to the pandas path.
+Output blocks may also be float32 (what XGBoost sees): values are still
+computed in float64 and rounded once when stored, so a float32 block equals
+the float64 block cast to float32.
+
+tests/test_feature_vectorizer.py checks equivalence against the pandas path;
+`python feature_vectorizer.py` repeats the check on the trained artifacts.
+"""
+import numpy as np
+
+CATEGORICAL = ['protocol_type', 'service', 'flag']
+
+
+class FeatureVectorizer:
+    """Turns JSON packets into scaled model rows using precomputed indices"""
+
+    def __init__(self, feature_names, scaler, selected_features):
+        index = {name: i for i, name in enumerate(feature_names)}
+        cols = np.array([index[name] for name in selected_features], dtype=np.intp)
+
+        self.feature_names = list(feature_names)
+        self.selected_features = list(selected_features)
+        self.n_features = len(self.selected_features)
+
+        # MinMax parameters of the selected columns only
+        self.scale = np.asarray(scaler.scale_, dtype=np.float64)[cols]
+        self.min = np.asarray(scaler.min_, dtype=np.float64)[cols]
+        self.clip = getattr(scaler, 'clip', False)
+        self.feature_range = scaler.feature_range
+
+        # Scaled value of an all-zero raw row (what reindex(fill_value=0) gives)
+        self.base = self._scale(np.zeros(self.n_features))
+
+        # Scaled value of a 1.0 in every output column (one-hot hits)
+        self.hot = self._scale(np.ones(self.n_features))
+        # code -> output column lookup tables for binary-encoded categoricals
+        self._code_tables = {}
+
+        # Numeric fields: (json key, output column, scale, min)
+        # One-hot fields: {categorical: {value: (output column, scaled 1.0)}}
+        self.numeric = []
+        self.onehot = {cat: {} for cat in CATEGORICAL}
+        for j, name in enumerate(self.selected_features):
+            cat = self._categorical_of(name)
+            if cat is None:
+                self.numeric.append((name, j, float(self.scale[j]), float(self.min[j])))
+            else:
+                self.onehot[cat][name[len(cat) + 1:]] = (j, float(self.hot[j]))
+
+    @staticmethod
+    def _categorical_of(name):
+        for cat in CATEGORICAL:
+            if name.startswith(cat + '_'):
+                return cat
+        return None
+
+    @staticmethod
+    def _put_column(rows, j, values, scale, min_):
+        """rows[:, j] = values * scale + min_, computed in float64 and rounded once for float32 rows"""
+        if rows.dtype == np.float64:
+            column = rows[:, j]
+            np.multiply(values, scale, out=column)
+            column += min_
+        else:
+            column = np.multiply(values, scale, dtype=np.float64)
+            column += min_
+            rows[:, j] = column
+
+    def _scale(self, values):
+        """Same operation order as MinMaxScaler.transform (multiply, add, clip)"""
+        values = values * self.scale
+        values += self.min
+        if self.clip:
+            np.clip(values, self.feature_range[0], self.feature_range[1], out=values)
+        return values
+
+    def _fill(self, record, row):
+        row[:] = self.base
+        for name, j, scale, min_ in self.numeric:
+            value = record.get(name)
+            if value is None:
+                if name not in record:
+                    continue
+                value = np.nan
+            row[j] = float(value) * scale + min_
+        for cat, columns in self.onehot.items():
+            hit = columns.get(record.get(cat))
+            if hit is not None:
+                row[hit[0]] = hit[1]
+        if self.clip:
+            np.clip(row, self.feature_range[0], self.feature_range[1], out=row)
+
+    def transform(self, record, out=None):
+        """Vectorize one packet into a (1, n_features) row"""
+        if out is None:
+            out = np.empty((1, self.n_features))
+        self._fill(record, out[0])
+        return out
+
+    def transform_batch(self, records, out=None):
+        """Vectorize a list of packets into the first len(records) rows of `out`"""
+        n = len(records)
+        if out is None:
+            out = np.empty((n, self.n_features))
+        rows = out[:n]
+        for i, record in enumerate(records):
+            self._fill(record, rows[i])
+        return rows
+
+    def _code_table(self, cat, vocabulary):
+        """uint8 code -> output column (-1 when the value is not a model feature)"""
+        key = (cat, tuple(vocabulary))
+        table = self._code_tables.get(key)
+        if table is None:
+            table = np.full(256, -1, dtype=np.intp)
+            for code, value in enumerate(vocabulary):
+                hit = self.onehot[cat].get(value)
+                if hit is not None:
+                    table[code] = hit[0]
+            self._code_tables[key] = table
+        return table
+
+    def transform_coded(self, arr, vocabularies, out=None):
+        """Vectorize a structured array (numeric columns + categorical codes) column by column"""
+        n = len(arr)
+        if out is None:
+            out = np.empty((n, self.n_features))
+        rows = out[:n]
+        rows[:] = self.base
+        fields = arr.dtype.names
+        for name, j, scale, min_ in self.numeric:
+            if name in fields:
+                self._put_column(rows, j, arr[name], scale, min_)
+        for cat, vocabulary in vocabularies.items():
+            cols = self._code_table(cat, vocabulary)[arr[cat]]
+            hit = np.nonzero(cols >= 0)[0]
+            rows[hit, cols[hit]] = self.hot[cols[hit]]
+        if self.clip:
+            np.clip(rows, self.feature_range[0], self.feature_range[1], out=rows)
+        return rows
+
+    def transform_columns(self, columns, n, out=None):
+        """Vectorize {field: values} column arrays (e.g. a parsed CSV chunk) into n rows,
+        the same rows transform_batch gives for the equivalent packets"""
+        if out is None:
+            out = np.empty((n, self.n_features))
+        rows = out[:n]
+        rows[:] = self.base
+        for name, j, scale, min_ in self.numeric:
+            values = columns.get(name)
+            if values is not None:
+                self._put_column(rows, j, np.asarray(values, dtype=np.float64), scale, min_)
+        for cat, hits in self.onehot.items():
+            values = columns.get(cat)
+            if values is None:
+                continue
+            # One lookup per distinct value instead of per row
+            uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+            table = np.array([hits[value][0] if value in hits else -1 for value in uniques], dtype=np.intp)
+            cols = table[inverse]
+            hit = np.nonzero(cols >= 0)[0]
+            rows[hit, cols[hit]] = self.hot[cols[hit]]
+        if self.clip:
+            np.clip(rows, self.feature_range[0], self.feature_range[1], out=rows)
+        return rows
+
+
+def reference_transform(records, feature_names, scaler, selected_features):
+    """The original pandas preprocessing path, kept as the equivalence reference"""
+    import pandas as pd
+
+    # 1. Convert to DataFrame
+    df = pd.DataFrame(records)
+
+    # 2. Drop non-feature columns
+    if 'label' in df.columns: df = df.drop('label', axis=1)
+    if 'source_ip' in df.columns: df = df.drop('source_ip', axis=1)
+
+    # 3. One-hot encode
+    df_encoded = pd.get_dummies(df, columns=CATEGORICAL)
+
+    # 4. Align columns
+    df_aligned = df_encoded.reindex(columns=feature_names, fill_value=0)
+
+    # 5. Scale
+    df_scaled = scaler.transform(df_aligned)
+    df_scaled = pd.DataFrame(df_scaled, columns=feature_names)
+
+    # 6. Select Features
+    return df_scaled[selected_features].to_numpy()
+
+
+def _sample_records(vectorizer, n, seed=42):
+    """Random packets covering every known category plus unknown values"""
+    rng = np.random.default_rng(seed)
+    vocab = {cat: sorted(values) + ['__unknown__'] for cat, values in vectorizer.onehot.items()}
+    records = []
+    for i in range(n):
+        record = {'source_ip': f"10.0.{i % 256}.{rng.integers(1, 255)}"}
+        for cat in CATEGORICAL:
+            record[cat] = vocab[cat][i % len(vocab[cat])]
+        for name, _, _, _ in vectorizer.numeric:
+            if name.endswith('rate'):
+                record[name] = round(float(rng.random()), 2)
+            else:
+                record[name] = int(rng.integers(0, 10 ** int(rng.integers(1, 7))))
+        if i % 7 == 0:
+            # Fields missing from a packet are filled with 0 before scaling
+            del record[vectorizer.numeric[i % len(vectorizer.numeric)][0]]
+        records.append(record)
+    return records
+
+
+if __name__ == "__main__":
+    import sys
+    import joblib
+
+    scaler = joblib.load('scaler.pkl')
+    selected_features = joblib.load('models/selected_features.pkl')
+    feature_names = joblib.load('feature_names.pkl')
+    vectorizer = FeatureVectorizer(feature_names, scaler, selected_features)
+
+    records = _sample_records(vectorizer, 2000)
+    # Packets are scored one at a time by the pandas path (a multi-row DataFrame
+    # would turn fields missing from some packets into NaN instead of 0).
+    expected = np.vstack([reference_transform([r], feature_names, scaler, selected_features)
+                          for r in records])
+    single = np.vstack([vectorizer.transform(r) for r in records])
+    batch = vectorizer.transform_batch(records)
+
+    ok = expected.tobytes() == single.tobytes() == batch.tobytes()
+    print(f"{'✅' if ok else '❌'} Vectorizer vs pandas path on {len(records)} packets: "
+          f"{'bit-identical' if ok else 'MISMATCH'}")
+    # float32 blocks (the engine's default) must equal the float64 rows rounded once
+    block32 = vectorizer.transform_batch(records, np.empty(batch.shape, dtype=np.float32))
+    ok32 = block32.tobytes() == batch.astype(np.float32).tobytes()
+    print(f"{'✅' if ok32 else '❌'} float32 blocks vs float64 rows cast to float32: "
+          f"{'bit-identical' if ok32 else 'MISMATCH'}")
+    ok = ok and ok32
+    sys.exit(0 if ok else 1)
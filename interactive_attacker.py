@@ -1,9 +1,17 @@
 import paho.mqtt.client as mqtt
+import argparse
 import json
+import multiprocessing as mp
+import os
 import time
 import random
 import sys
 import threading
+from collections import deque
+
+import numpy as np
+
+import wire_format
 
 # --- CONFIGURATION ---
 # Use the Laptop IP you found earlier
@@ -32,6 +40,9 @@ def on_message(client, userdata, msg):
         if payload.get('command') == 'BLOCK' and payload.get('target') == MY_IP:
             BLOCKED = True
             print(f"\n🚫 BLOCKED BY FIREWALL: {payload.get('reason')}")
+        elif payload.get('command') == 'UNBLOCK' and payload.get('target') == MY_IP:
+            BLOCKED = False
+            print(f"\n✅ UNBLOCKED BY FIREWALL: {payload.get('reason')}")
     except: pass
 
 client.on_connect = on_connect
@@ -178,7 +189,7 @@ def run_attack(attack_type, duration):
             
     print(f"\n✅ Complete. Sent {count} packets.")
 
-def main():
+def interactive():
     global BLOCKED
     print("Connecting to Broker...")
     try:
@@ -217,5 +228,249 @@ def main():
 
     client.loop_stop()
 
+# --- HEADLESS FLOOD MODE ---
+# `--flood` drives the engine with many simulated sources instead of one
+# device. Each source gets a fixed traffic type from --mix; every publisher
+# process owns every Nth source and paces itself with a token bucket. Packets
+# are pre-serialized templates whose source_ip is patched in place, and with
+# --batch > 1 many records go out per message on the binary topic
+# (wire_format.py). A source named in a BLOCK stays silent (its packets are
+# counted as suppressed) until an UNBLOCK, so the IPS feedback loop can be
+# exercised at scale.
+FLOOD_GENERATORS = {
+    'dos': generate_dos, 'probe': generate_probe, 'r2l': generate_r2l,
+    'u2r': generate_u2r, 'normal': generate_normal,
+}
+FLOOD_MIX = "dos=0.5,normal=0.3,probe=0.1,r2l=0.05,u2r=0.05"
+BINARY_TOPIC = TOPIC + wire_format.TOPIC_SUFFIX
+MAX_SOURCES = 1000000   # 10.100-199.100-199.100-199: every IP is 15 characters
+TEMPLATE_VARIANTS = 64  # pre-generated packets per traffic type
+JSON_ROUND = 100        # packets per token-bucket round in JSON mode
+BURST_SECONDS = 0.05    # token bucket depth
+MAX_PENDING_ROUNDS = 8  # rounds paho may hold unsent before the sender waits for the broker
+COUNTERS = ('sent', 'suppressed', 'messages', 'blocked')
+
+def flood_ip(i):
+    """Source index -> fixed-width IP, so it can be patched into a template in place"""
+    return f"10.{100 + i // 10000}.{100 + i // 100 % 100}.{100 + i % 100}"
+
+def parse_mix(text):
+    """'dos=0.5,normal=0.5' -> {'dos': 0.5, 'normal': 0.5}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip().lower()
+        if name not in FLOOD_GENERATORS:
+            raise argparse.ArgumentTypeError(f"unknown traffic type '{name}'")
+        mix[name] = float(weight or 1)
+    return mix
+
+class TokenBucket:
+    """Paces a sender to `rate` tokens/s with bursts of up to `capacity` (rate <= 0: unpaced)"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.perf_counter()
+
+    def take(self, n):
+        """Block until n tokens are available, then spend them"""
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.perf_counter()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return
+            time.sleep((n - self.tokens) / self.rate)
+
+def json_templates(names, variants):
+    """Per traffic type: (serialized packet, offset of its source_ip) pairs"""
+    templates = []
+    for name in names:
+        kind = []
+        for _ in range(variants):
+            pkt = FLOOD_GENERATORS[name]()
+            pkt['source_ip'] = flood_ip(0)
+            data = bytearray(json.dumps(pkt).encode())
+            kind.append((data, data.index(b'"source_ip": "') + len(b'"source_ip": "')))
+        templates.append(kind)
+    return templates
+
+def binary_templates(names, variants):
+    """Structured array of `variants` records per traffic type, type k at k * variants"""
+    pool = [FLOOD_GENERATORS[name]() for name in names for _ in range(variants)]
+    table = np.zeros(len(pool), dtype=wire_format.RECORD_DTYPE)
+    wire_format.pack_records(pool, out=table)
+    return table
+
+def flood_worker(index, args, counters, stop):
+    """One publisher process: sources index, index + clients, ... at rate / clients"""
+    random.seed(args.seed + index)
+    mix = parse_mix(args.mix)
+    names = list(mix)
+    sources = range(index, args.sources, args.clients)
+    n = len(sources)
+    kinds = np.array(random.choices(range(len(names)), [mix[name] for name in names], k=n), dtype=np.intp)
+    ips = [flood_ip(i) for i in sources]
+    slot_of = {ip: slot for slot, ip in enumerate(ips)}
+    active = np.ones(n, dtype=bool)  # written by the paho thread, read by the send loop
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        client.subscribe(CONTROL_TOPIC)
+
+    def on_message(client, userdata, msg):
+        try:
+            payload = json.loads(msg.payload)
+        except ValueError:
+            return
+        slot = slot_of.get(payload.get('target')) if isinstance(payload, dict) else None
+        if slot is None:
+            return
+        if payload.get('command') == 'BLOCK':
+            active[slot] = False
+        elif payload.get('command') == 'UNBLOCK':
+            active[slot] = True
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, f"Flood_Attacker_{os.getpid()}")
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port, 60)
+    client.loop_start()
+
+    rate = args.rate / args.clients
+    batch = args.batch
+    round_size = batch if batch > 1 else JSON_ROUND
+    bucket = TokenBucket(rate, max(round_size, rate * BURST_SECONDS))
+    base = index * len(COUNTERS)
+    sent = suppressed = messages = 0
+    pos = variant = 0
+    pending = deque()  # last message of each recent round, to bound paho's send queue
+    if batch > 1:
+        table = binary_templates(names, TEMPLATE_VARIANTS)
+        ip_ints = np.array([wire_format.ip_to_int(ip) for ip in ips], dtype=np.uint32)
+        header = wire_format.HEADER.size
+        size = wire_format.RECORD_DTYPE.itemsize
+        message = bytearray(header + batch * size)
+        records = np.frombuffer(message, dtype=wire_format.RECORD_DTYPE, offset=header)
+        view = memoryview(message)
+        steps = np.arange(batch)
+    else:
+        templates = json_templates(names, TEMPLATE_VARIANTS)
+        ip_bytes = [ip.encode() for ip in ips]
+
+    end = time.time() + args.duration
+    while not stop.is_set() and time.time() < end:
+        bucket.take(round_size)
+        # Sources take turns whether or not they are blocked, so blocks show
+        # up as suppressed packets rather than more traffic from the rest
+        slots = (pos + steps) % n if batch > 1 else [(pos + i) % n for i in range(round_size)]
+        pos = (pos + round_size) % n
+        if batch > 1:
+            live = slots[active[slots]]
+            m = len(live)
+            if m:
+                records[:m] = table[kinds[live] * TEMPLATE_VARIANTS + (variant + steps[:m]) % TEMPLATE_VARIANTS]
+                records['source_ip'][:m] = ip_ints[live]
+                wire_format.HEADER.pack_into(message, 0, wire_format.MAGIC, wire_format.VERSION, m)
+                info = client.publish(BINARY_TOPIC, bytes(view[:header + m * size]))
+                messages += 1
+            variant += m
+        else:
+            m = 0
+            for slot in slots:
+                if not active[slot]:
+                    continue
+                data, at = templates[kinds[slot]][variant % TEMPLATE_VARIANTS]
+                ip = ip_bytes[slot]
+                data[at:at + len(ip)] = ip
+                info = client.publish(TOPIC, bytes(data))
+                variant += 1
+                m += 1
+            messages += m
+        sent += m
+        suppressed += round_size - m
+        if m:
+            # Publishing faster than the broker reads only grows paho's queue
+            pending.append(info)
+            if len(pending) > MAX_PENDING_ROUNDS:
+                try:
+                    pending.popleft().wait_for_publish(1.0)
+                except (RuntimeError, ValueError):
+                    pass
+        counters[base:base + len(COUNTERS)] = [sent, suppressed, messages, n - int(active.sum())]
+
+    client.loop_stop()
+    client.disconnect()
+
+def run_flood(args):
+    """Start the publisher processes and print aggregate progress once a second"""
+    if not 0 < args.sources <= MAX_SOURCES:
+        raise SystemExit(f"❌ --sources must be between 1 and {MAX_SOURCES}")
+    args.clients = max(1, min(args.clients, args.sources))
+    if args.batch > wire_format.MAX_RECORDS:
+        raise SystemExit(f"❌ --batch must be at most {wire_format.MAX_RECORDS}")
+    parse_mix(args.mix)
+    wire = f"binary, {args.batch} records/message" if args.batch > 1 else "JSON, 1 packet/message"
+    print(f"🚀 Flooding {args.broker}:{args.port} at {args.rate:,.0f} pkts/s from {args.sources:,} "
+          f"sources for {args.duration}s ({args.clients} client(s), {wire})")
+
+    methods = mp.get_all_start_methods()
+    ctx = mp.get_context('fork' if 'fork' in methods else methods[0])
+    counters = ctx.Array('q', args.clients * len(COUNTERS), lock=False)
+    stop = ctx.Event()
+    workers = [ctx.Process(target=flood_worker, args=(i, args, counters, stop), daemon=True)
+               for i in range(args.clients)]
+    for worker in workers:
+        worker.start()
+
+    def totals():
+        values = list(counters)
+        return [sum(values[k::len(COUNTERS)]) for k in range(len(COUNTERS))]
+
+    start = last_time = time.perf_counter()
+    last_sent = 0
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1.0)
+            now = time.perf_counter()
+            sent, suppressed, messages, blocked = totals()
+            print(f"   {sent - last_sent:>9,.0f} pkts in {now - last_time:.1f}s | sent {sent:,} "
+                  f"| suppressed {suppressed:,} | blocked sources {blocked:,}")
+            last_sent, last_time = sent, now
+    except KeyboardInterrupt:
+        stop.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    sent, suppressed, messages, blocked = totals()
+    print(f"✅ Complete. Sent {sent:,} packets in {messages:,} messages "
+          f"({sent / max(elapsed, 1e-9):,.0f} pkts/s, {(sent + suppressed) / max(elapsed, 1e-9):,.0f} offered), "
+          f"suppressed {suppressed:,} from {blocked:,} blocked sources.")
+
+def main():
+    global BROKER, PORT
+    parser = argparse.ArgumentParser(description="Live attacker device: interactive menu, or a headless flood with --flood")
+    parser.add_argument('--broker', default=BROKER)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--flood', action='store_true', help="Headless high-rate traffic generator")
+    parser.add_argument('--rate', type=float, default=100000, help="Target packets/s over all clients (0 = unpaced)")
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--sources', type=int, default=10000, help="Simulated source IPs")
+    parser.add_argument('--mix', default=FLOOD_MIX, help="Traffic mix, e.g. dos=0.7,normal=0.3")
+    parser.add_argument('--clients', type=int, default=os.cpu_count() or 1, help="Publisher processes")
+    parser.add_argument('--batch', type=int, default=500,
+                        help="Records per binary message (1 = one JSON packet per message)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    BROKER, PORT = args.broker, args.port
+    if args.flood:
+        run_flood(args)
+    else:
+        interactive()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
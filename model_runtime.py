@@ -0,0 +1,153 @@
+"""
+Lean XGBoost scoring for the detection engine.
+
+Runs the model ONCE per batch: probabilities come straight from the underlying
+booster (inplace_predict, no DMatrix and no sklearn wrapper), the label is the
+argmax and the class name comes from an array built from le.classes_ instead of
+a LabelEncoder.inverse_transform call.
+
+ModelBundle groups everything one model version needs (booster, encoder,
+scaler, feature lists, vectorizer) so the engine can load, check and warm a
+retrained model in the background and swap it in as a single unit.
+
+tests/test_model_runtime.py checks labels and confidences against the
+original model.predict / inverse_transform / predict_proba path;
+`python model_runtime.py` repeats the check on the trained artifacts.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from feature_vectorizer import FeatureVectorizer
+
+# Artifacts written by train_model.py / preprocessing.py, in load order
+ARTIFACTS = {
+    'model': 'models/xgboost_model.pkl',
+    'label_encoder': 'models/label_encoder.pkl',
+    'scaler': 'scaler.pkl',
+    'selected_features': 'models/selected_features.pkl',
+    'feature_names': 'feature_names.pkl',
+}
+# Rows scored once on a new bundle before it serves traffic
+WARM_ROWS = 256
+
+
+class XGBoostScorer:
+    """Wraps a fitted XGBClassifier + LabelEncoder for single-pass scoring"""
+
+    def __init__(self, model, label_encoder):
+        self.booster = model.get_booster()
+        self.class_names = np.asarray(label_encoder.classes_, dtype=object)
+        self.missing = model.missing
+        # Same iteration range the sklearn wrapper uses (best_iteration when
+        # the model was trained with early stopping, otherwise all trees)
+        try:
+            self.iteration_range = (0, model.best_iteration + 1)
+        except AttributeError:
+            self.iteration_range = (0, 0)
+
+    def predict_proba(self, features):
+        """Class probabilities, identical to XGBClassifier.predict_proba"""
+        probs = self.booster.inplace_predict(
+            features,
+            iteration_range=self.iteration_range,
+            missing=self.missing,
+            validate_features=False,
+        )
+        if probs.ndim == 1:
+            # Binary objective returns P(class 1) only
+            probs = np.column_stack([1.0 - probs, probs])
+        return probs
+
+    def set_threads(self, threads):
+        self.booster.set_param({'nthread': threads})
+
+    def score(self, features):
+        """One model call -> (class names, confidences, probabilities)"""
+        probs = self.predict_proba(features)
+        pred_index = probs.argmax(axis=1)
+        confidences = probs[np.arange(len(pred_index)), pred_index]
+        return self.class_names[pred_index], confidences, probs
+
+
+class ModelBundle:
+    """One model version: raw artifacts + the vectorizer / scorer built from them"""
+
+    def __init__(self, model, label_encoder, scaler, selected_features, feature_names, version):
+        self.model = model
+        self.label_encoder = label_encoder
+        self.scaler = scaler
+        self.selected_features = list(selected_features)
+        self.feature_names = list(feature_names)
+        self.version = version
+        self.vectorizer = FeatureVectorizer(feature_names, scaler, selected_features)
+        self.scorer = XGBoostScorer(model, label_encoder)
+
+    def check(self):
+        """Raise ValueError if the artifacts do not describe one consistent schema"""
+        n_model = self.scorer.booster.num_features()
+        if n_model != len(self.selected_features):
+            raise ValueError(f"model expects {n_model} features, "
+                             f"selected_features lists {len(self.selected_features)}")
+        n_scaler = getattr(self.scaler, 'n_features_in_', len(self.feature_names))
+        if n_scaler != len(self.feature_names):
+            raise ValueError(f"scaler was fitted on {n_scaler} columns, "
+                             f"feature_names lists {len(self.feature_names)}")
+        if 'Normal' not in self.scorer.class_names:
+            raise ValueError(f"label encoder has no 'Normal' class: {list(self.scorer.class_names)}")
+
+    def warm(self, rows=WARM_ROWS):
+        """Run the vectorizer and booster once so the first real batch is not a cold start"""
+        self.scorer.score(self.vectorizer.transform_batch([{}] * rows))
+
+
+def artifact_version(paths=ARTIFACTS):
+    """Short content hash of the artifact files (the model version in stats)"""
+    digest = hashlib.sha1()
+    for path in paths.values():
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def artifact_mtimes(paths=ARTIFACTS):
+    """(mtime, size) per artifact, None for a missing file -- cheap change detection"""
+    stamps = []
+    for path in paths.values():
+        try:
+            st = os.stat(path)
+            stamps.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+def load_bundle(paths=ARTIFACTS):
+    """Load every artifact -> ModelBundle (raises FileNotFoundError if one is missing)"""
+    # Imported here so the compiled runtime can use this module without joblib
+    import joblib
+    version = artifact_version(paths)
+    loaded = {name: joblib.load(path) for name, path in paths.items()}
+    return ModelBundle(loaded['model'], loaded['label_encoder'], loaded['scaler'],
+                       loaded['selected_features'], loaded['feature_names'], version)
+
+
+if __name__ == "__main__":
+    import sys
+    from feature_vectorizer import _sample_records
+
+    bundle = load_bundle()
+    bundle.check()
+    model, le, vectorizer, scorer = bundle.model, bundle.label_encoder, bundle.vectorizer, bundle.scorer
+    features = vectorizer.transform_batch(_sample_records(vectorizer, 5000))
+
+    # Original engine path: predict + inverse_transform + predict_proba().max()
+    expected_labels = le.inverse_transform(model.predict(features))
+    expected_conf = model.predict_proba(features).max(axis=1)
+    labels, confidences, _ = scorer.score(features)
+
+    ok = (labels == expected_labels).all() and (confidences == expected_conf).all()
+    print(f"{'✅' if ok else '❌'} Single-pass scorer vs original path on {len(features)} rows: "
+          f"{'same labels and confidences' if ok else 'MISMATCH'}")
+    sys.exit(0 if ok else 1)
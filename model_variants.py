@@ -0,0 +1,170 @@
+"""
+Pruned and shallower model variants for constrained hosts.
+
+`train_model.py --variants` trains smaller models next to the full one. Each
+trades a measured amount of accuracy for throughput:
+
+  fewer / shallower trees      e.g. 50 trees of depth 4 instead of 100 of depth 6
+  gain-ranked feature subsets  the top-k features by total gain in the full
+                               model, plus the features the full model's R2L
+                               and U2R trees gain most from, so the rare-class
+                               indicators (root_shell, num_failed_logins, ...)
+                               are never pruned
+
+Every variant trains on the float32 cache, and the engine feeds it float32
+rows. A variant lives in models/variants/<name>/ with its model, feature list,
+compiled ensemble and prefilter. It is benchmarked on the test split: per-class
+recall against per-batch inference latency for both runtimes, plus model
+size. The results go to models/variants/report.json.
+
+The engine runs a variant with `--config engine.json`, where the file holds
+{"model_variant": "<name>"}. Run `python model_variants.py` to print the
+last report.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from model_runtime import ARTIFACTS
+from prefilter import PREFILTER_PATH
+from tree_runtime import COMPILED_MODEL
+
+VARIANTS_DIR = 'models/variants'
+REPORT_PATH = os.path.join(VARIANTS_DIR, 'report.json')
+
+# name -> overrides of the full model's training settings (top_features: None = all)
+VARIANTS = {
+    'trees50': {'n_estimators': 50},
+    'depth4': {'n_estimators': 50, 'max_depth': 4},
+    'top40': {'top_features': 40},
+    'top20-depth4': {'n_estimators': 50, 'max_depth': 4, 'top_features': 20},
+}
+RARE_CLASSES = ('R2L', 'U2R')
+RARE_FEATURES_PER_CLASS = 10  # top-gain features of each rare class kept in every subset
+BENCH_BATCH_SIZES = (1, 32, 256)
+BENCH_ROWS = 20000            # rows timed per batch size (at least 5 batches)
+
+
+def variant_paths(name=None):
+    """Artifact paths of a variant ('full' or None = the full model)"""
+    if name in (None, 'full'):
+        return {'artifacts': dict(ARTIFACTS), 'compiled_model': COMPILED_MODEL, 'prefilter': PREFILTER_PATH}
+    base = os.path.join(VARIANTS_DIR, name)
+    if not os.path.isdir(base):
+        raise FileNotFoundError(f"no model variant '{name}' in {VARIANTS_DIR} "
+                                f"(train it with train_model.py --variants {name})")
+    return {
+        'artifacts': dict(ARTIFACTS, model=os.path.join(base, 'xgboost_model.pkl'),
+                          selected_features=os.path.join(base, 'selected_features.pkl')),
+        'compiled_model': os.path.join(base, 'compiled_model.npz'),
+        'prefilter': os.path.join(base, 'prefilter.npz'),
+    }
+
+
+def feature_gain(booster, n_features, n_classes, class_codes=None):
+    """Total split gain per feature index, over the trees of `class_codes` (None = all)"""
+    trees = booster.trees_to_dataframe()
+    splits = trees[trees['Feature'] != 'Leaf']
+    if class_codes is not None:
+        # Multiclass boosting builds one tree per class per round, in class order
+        splits = splits[(splits['Tree'] % n_classes).isin(class_codes)]
+    names = booster.feature_names or [f"f{i}" for i in range(n_features)]
+    index = {name: i for i, name in enumerate(names)}
+    gain = np.zeros(n_features)
+    np.add.at(gain, splits['Feature'].map(index).to_numpy(dtype=np.intp), splits['Gain'].to_numpy())
+    return gain
+
+
+def select_features(booster, class_names, features, top_features):
+    """Top-k features by gain plus each rare class's top features, in their original order"""
+    if top_features is None or top_features >= len(features):
+        return list(features)
+    class_names = list(class_names)
+    total = feature_gain(booster, len(features), len(class_names))
+    keep = set(np.argsort(-total)[:top_features].tolist())
+    for name in RARE_CLASSES:
+        if name in class_names:
+            gain = feature_gain(booster, len(features), len(class_names), [class_names.index(name)])
+            ranked = np.argsort(-gain)[:RARE_FEATURES_PER_CLASS]
+            keep.update(int(i) for i in ranked if gain[i] > 0)
+    return [name for i, name in enumerate(features) if i in keep]
+
+
+def save_variant(name, model, label_encoder, scaler, features, feature_names, sample):
+    """Write a variant's model, feature list and compiled ensemble -> its paths"""
+    import joblib
+    from tree_runtime import export_compiled
+
+    base = os.path.join(VARIANTS_DIR, name)
+    os.makedirs(base, exist_ok=True)
+    paths = variant_paths(name)
+    joblib.dump(model, paths['artifacts']['model'])
+    joblib.dump(list(features), paths['artifacts']['selected_features'])
+    export_compiled(model, label_encoder, scaler, features, feature_names, sample, paths['compiled_model'])
+    return paths
+
+
+def _batch_latency_ms(scorer, X, batch_size):
+    """Median milliseconds per scorer.score call on batches of `batch_size` rows"""
+    block = X[np.arange(batch_size) % len(X)]
+    scorer.score(block)  # warm-up
+    times = []
+    for _ in range(max(5, BENCH_ROWS // batch_size)):
+        start = time.perf_counter()
+        scorer.score(block)
+        times.append(time.perf_counter() - start)
+    return round(float(np.median(times)) * 1000, 4)
+
+
+def benchmark_variant(name, model, label_encoder, compiled_path, X, y, spec=None):
+    """Per-class recall, per-batch latency (both runtimes) and model size of one variant"""
+    from model_runtime import XGBoostScorer
+    from tree_runtime import load_compiled
+
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    scorers = {'xgboost': XGBoostScorer(model, label_encoder),
+               'compiled': load_compiled(compiled_path).scorer}
+    labels = scorers['xgboost'].score(X)[0]
+    truth = np.asarray(label_encoder.classes_, dtype=object)[y]
+    booster = model.get_booster()
+    return {
+        'variant': name,
+        'spec': spec or {},
+        'features': int(X.shape[1]),
+        'trees': len(booster.get_dump()),
+        'accuracy': round(float((labels == truth).mean()), 4),
+        'recall': {str(c): round(float((labels[truth == c] == c).mean()), 4)
+                   for c in label_encoder.classes_ if (truth == c).any()},
+        'latency_ms': {runtime: {str(b): _batch_latency_ms(scorer, X, b) for b in BENCH_BATCH_SIZES}
+                       for runtime, scorer in scorers.items()},
+        'model_kb': {'xgboost': round(len(booster.save_raw('ubj')) / 1024, 1),
+                     'compiled': round(os.path.getsize(compiled_path) / 1024, 1)},
+    }
+
+
+def write_report(results, path=REPORT_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def print_report(results):
+    """One line per variant: recall per class, then ms per batch by runtime"""
+    classes = list(results[0]['recall'])
+    batches = [str(b) for b in BENCH_BATCH_SIZES]
+    print(f"{'variant':<14} {'feat':>4} {'trees':>5} " + ' '.join(f"{c:>7}" for c in classes)
+          + ' | ' + ' '.join(f"{'xgb@' + b:>8}" for b in batches)
+          + ' | ' + ' '.join(f"{'cmp@' + b:>8}" for b in batches) + ' |   KB')
+    for r in results:
+        print(f"{r['variant']:<14} {r['features']:>4} {r['trees']:>5} "
+              + ' '.join(f"{r['recall'].get(c, 0):>7.2%}" for c in classes)
+              + ' | ' + ' '.join(f"{r['latency_ms']['xgboost'][b]:>8.3f}" for b in batches)
+              + ' | ' + ' '.join(f"{r['latency_ms']['compiled'][b]:>8.3f}" for b in batches)
+              + f" | {r['model_kb']['xgboost']:>5.0f}")
+
+
+if __name__ == "__main__":
+    with open(REPORT_PATH) as f:
+        print_report(json.load(f))
@@ -0,0 +1,100 @@
+"""
+Drive a paho MQTT client from an asyncio event loop.
+
+paho exposes socket hooks (on_socket_open / on_socket_close /
+on_socket_register_write / on_socket_unregister_write) so it can be run
+without its own network thread: the event loop calls loop_read() when the
+socket is readable, loop_write() when paho has pending output, and
+loop_misc() once a second for keepalives. Every paho callback, including
+on_message, then runs on the event loop thread, and client.publish() must
+only be called from it. The exception is a blocking client.reconnect() run
+on an executor: its on_connect runs there, and the socket hooks hand their
+reader/writer changes back to the loop with call_soon_threadsafe.
+
+pause_reading() / resume_reading() stop and restart reads from the broker
+socket, which is how the engine's asyncio mode applies backpressure: while
+paused, unread messages stay in the kernel buffers and TCP flow control
+slows the broker down instead of the engine growing its queues.
+"""
+import asyncio
+import socket
+
+import paho.mqtt.client as mqtt
+
+MISC_INTERVAL = 1.0
+
+
+class AsyncioHelper:
+    """Runs `client`'s network I/O on `loop` through paho's socket callbacks"""
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+        self._sock = None
+        self._paused = False
+        self._misc = None
+
+    def _on_loop(self, callback, *args):
+        """Run callback on the loop thread (client.reconnect() may run on an executor)"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048 * 1024)
+        self._on_loop(self._open, sock)
+
+    def _open(self, sock):
+        self._sock = sock
+        if not self._paused:
+            self.loop.add_reader(sock, self.client.loop_read)
+        if self._misc is None:
+            self._misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._close, sock)
+
+    def _close(self, sock):
+        self.loop.remove_reader(sock)
+        if self._sock is sock:
+            self._sock = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def pause_reading(self):
+        if not self._paused:
+            self._paused = True
+            if self._sock is not None:
+                self.loop.remove_reader(self._sock)
+
+    def resume_reading(self):
+        if self._paused:
+            self._paused = False
+            if self._sock is not None:
+                self.loop.add_reader(self._sock, self.client.loop_read)
+
+    async def misc_loop(self):
+        """Keepalive pings and reconnect bookkeeping, as loop_forever would do"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(MISC_INTERVAL)
+            except asyncio.CancelledError:
+                break
+        self._misc = None
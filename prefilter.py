@@ -0,0 +1,126 @@
+"""
+Cheap first stage for tiered (cascade) inference.
+
+A logistic regression that separates Normal from any attack. It runs on the
+same scaled feature rows the full model sees. Screening a row costs one dot
+product, so the engine can screen every packet and send only the suspicious
+ones to XGBoost. Rows whose attack margin is below `threshold` get a
+fast-path Normal verdict.
+
+train_model.py fits the weights and calibrates the threshold on out-of-fold
+margins of the training split: at most `target_miss_rate` of the rows of
+each attack class may fall below it. R2L and U2R look most like Normal, so
+in practice those rare classes set the threshold. The artifact
+is a small .npz holding the weights, bias and threshold, the features it was
+trained on, and the calibration report.
+
+Run `python prefilter.py` to see how the saved prefilter splits the NSL-KDD
+test split.
+"""
+import json
+
+import numpy as np
+
+PREFILTER_PATH = 'models/prefilter.npz'
+TARGET_MISS_RATE = 0.01
+CV_FOLDS = 5
+
+
+class Prefilter:
+    """Linear Normal-vs-attack screen: rows below the margin threshold skip the full model"""
+
+    def __init__(self, weights, bias, threshold, features, report=None):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.threshold = float(threshold)
+        self.features = list(features)
+        self.report = report or {}
+
+    def margins(self, features):
+        """Attack log-odds of each row"""
+        return features @ self.weights + self.bias
+
+    def screen(self, features):
+        """-> (fast-path mask, P(Normal) of the fast-path rows)"""
+        margins = self.margins(features)
+        fast = margins < self.threshold
+        return fast, 1.0 / (1.0 + np.exp(margins[fast]))
+
+    def check(self, selected_features):
+        """Raise ValueError unless the prefilter was trained on the model's features"""
+        if self.features != list(selected_features):
+            raise ValueError(f"prefilter was trained on {len(self.features)} features that do not "
+                             f"match the model's {len(selected_features)} (retrain it)")
+
+    def save(self, path=PREFILTER_PATH):
+        np.savez(path, weights=self.weights, bias=np.float64(self.bias),
+                 threshold=np.float64(self.threshold), features=np.array(self.features),
+                 report=np.str_(json.dumps(self.report)))
+
+
+def load_prefilter(path=PREFILTER_PATH):
+    """Load the .npz artifact -> Prefilter (raises FileNotFoundError if missing)"""
+    with np.load(path, allow_pickle=False) as data:
+        return Prefilter(data['weights'], data['bias'], data['threshold'],
+                         [str(name) for name in data['features']], json.loads(str(data['report'])))
+
+
+def calibrate(margins, labels, class_names, target_miss_rate):
+    """Largest threshold that fast-paths at most target_miss_rate of every attack class"""
+    names = np.asarray(class_names, dtype=object)[labels]
+    threshold = np.inf
+    for name in set(names) - {'Normal'}:
+        ranked = np.sort(margins[names == name])
+        # Exactly floor(target * n) rows lie strictly below ranked[k]
+        k = int(target_miss_rate * len(ranked))
+        threshold = min(threshold, ranked[k])
+    return float(threshold)
+
+
+def fast_path_report(prefilter, features, labels, class_names):
+    """Share of each class (and of all rows) that would skip the full model"""
+    fast = prefilter.margins(features) < prefilter.threshold
+    report = {'rows': int(len(fast)), 'fast_path': round(float(fast.mean()), 4) if len(fast) else 0.0}
+    for code, name in enumerate(class_names):
+        rows = labels == code
+        if rows.any():
+            report[str(name)] = round(float(fast[rows].mean()), 4)
+    return report
+
+
+def train_prefilter(X, y, class_names, features, target_miss_rate=TARGET_MISS_RATE, seed=42):
+    """Fit on (X, y), calibrate the threshold on out-of-fold margins -> Prefilter"""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import StratifiedKFold, cross_val_predict
+
+    attack = (np.asarray(class_names, dtype=object)[y] != 'Normal').astype(np.int8)
+    if attack.min() == attack.max():
+        raise ValueError("the training rows need both Normal and attack traffic")
+    model = LogisticRegression(class_weight='balanced', max_iter=500)
+    # Margins of rows the fold's model never saw: an in-sample threshold would be optimistic
+    folds = StratifiedKFold(CV_FOLDS, shuffle=True, random_state=seed)
+    margins = cross_val_predict(model, X, attack, cv=folds, method='decision_function')
+    model.fit(X, attack)
+    threshold = calibrate(margins, y, class_names, target_miss_rate)
+    prefilter = Prefilter(model.coef_[0], model.intercept_[0], threshold, features,
+                          {'target_miss_rate': target_miss_rate})
+    fast = margins < threshold
+    prefilter.report['out_of_fold'] = {
+        'rows': int(len(fast)), 'fast_path': round(float(fast.mean()), 4),
+        **{str(name): round(float(fast[y == code].mean()), 4)
+           for code, name in enumerate(class_names) if (y == code).any()},
+    }
+    return prefilter
+
+
+if __name__ == "__main__":
+    import dataset_cache
+
+    prefilter = load_prefilter()
+    arrays, manifest = dataset_cache.load()
+    prefilter.check(manifest['columns'])
+    report = fast_path_report(prefilter, np.asarray(arrays['X_test'], dtype=np.float64),
+                              arrays['y_test'], manifest['classes'])
+    print(f"Prefilter (target miss rate {prefilter.report.get('target_miss_rate')}) on the test split:")
+    for name, value in report.items():
+        print(f"   {name:>9}: {value}")
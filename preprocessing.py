@@ -4,6 +4,12 @@ from sklearn.preprocessing import MinMaxScaler, LabelEncoder
 from sklearn.model_selection import train_test_split
 from imblearn.over_sampling import SMOTE
 import joblib
+import argparse
+import os
+import resource
+import time
+import dataset_cache
+from profiling import TRACE_INTERVAL, SampledLog, Tracer, install_toggle
 
 # Column names for NSL-KDD
 columns = ['duration','protocol_type','service','flag','src_bytes','dst_bytes',
@@ -17,10 +23,6 @@ columns = ['duration','protocol_type','service','flag','src_bytes','dst_bytes',
            'dst_host_srv_diff_host_rate','dst_host_serror_rate','dst_host_srv_serror_rate',
            'dst_host_rerror_rate','dst_host_srv_rerror_rate','label','difficulty']
 
-# Load data
-train_df = pd.read_csv('data/KDDTrain+.txt', names=columns, header=None)
-test_df = pd.read_csv('data/KDDTest+.txt', names=columns, header=None)
-
 # Map attack types to categories
 attack_mapping = {
     'normal': 'Normal',
@@ -36,50 +38,280 @@ attack_mapping = {
     'sqlattack': 'U2R', 'xterm': 'U2R'
 }
 
-train_df['attack_category'] = train_df['label'].map(attack_mapping)
-test_df['attack_category'] = test_df['label'].map(attack_mapping)
-
-# Remove difficulty column
-train_df = train_df.drop('difficulty', axis=1)
-test_df = test_df.drop('difficulty', axis=1)
-
 # Categorical features
 categorical = ['protocol_type', 'service', 'flag']
 
-# One-hot encoding
-train_encoded = pd.get_dummies(train_df, columns=categorical)
-test_encoded = pd.get_dummies(test_df, columns=categorical)
-
-# Align train and test columns
-train_encoded, test_encoded = train_encoded.align(test_encoded, join='left', axis=1, fill_value=0)
-
-# Separate features and labels
-X_train = train_encoded.drop(['label', 'attack_category'], axis=1)
-y_train = train_encoded['attack_category']
-X_test = test_encoded.drop(['label', 'attack_category'], axis=1)
-y_test = test_encoded['attack_category']
-
-# Normalize numerical features
-scaler = MinMaxScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
-
-# Convert back to DataFrame
-X_train_scaled = pd.DataFrame(X_train_scaled, columns=X_train.columns)
-X_test_scaled = pd.DataFrame(X_test_scaled, columns=X_test.columns)
-
-# Apply SMOTE (only on training data)
-smote = SMOTE(random_state=42)
-X_train_resampled, y_train_resampled = smote.fit_resample(X_train_scaled, y_train)
-
-# Save preprocessed data and scaler
-joblib.dump(scaler, 'scaler.pkl')
-joblib.dump(X_train.columns.tolist(), 'feature_names.pkl')
-X_train_resampled.to_csv('X_train_processed.csv', index=False)
-y_train_resampled.to_csv('y_train_processed.csv', index=False)
-X_test_scaled.to_csv('X_test_processed.csv', index=False)
-y_test.to_csv('y_test_processed.csv', index=False)
-
-print(f"Training samples after SMOTE: {X_train_resampled.shape}")
-print(f"Test samples: {X_test_scaled.shape}")
-print(f"Class distribution:\n{y_train_resampled.value_counts()}")
+DATA_FILES = {'train': 'data/KDDTrain+.txt', 'test': 'data/KDDTest+.txt'}
+SMOTE_SEED = 42
+
+# --- Streaming mode (--streaming) ---
+# Rows per pandas chunk: peak memory is a few chunks plus the class reservoirs
+CHUNK_SIZE = 100000
+# Training rows kept per class for SMOTE. While every class fits, all rows are
+# kept and the result is identical to the in-memory pipeline; above it each
+# class is reservoir-sampled down to MAX_PER_CLASS rows.
+MAX_PER_CLASS = 250000
+
+# --- Tracing (--trace, or SIGUSR1 while running) ---
+# Times each stage (load, encode, scale, smote, ...; scan, reservoir, test in
+# streaming mode) and logs a breakdown every --trace-interval seconds and at
+# the end. See profiling.py.
+tracer = Tracer('preprocessing', SampledLog())
+
+def load_split(path):
+    """Read one NSL-KDD file and map attack labels to their category"""
+    df = pd.read_csv(path, names=columns, header=None)
+    # Map attack types to categories
+    df['attack_category'] = df['label'].map(attack_mapping)
+    # Remove difficulty column
+    return df.drop('difficulty', axis=1)
+
+def preprocess(train_path, test_path, seed=SMOTE_SEED):
+    """One-hot encode, scale and SMOTE-balance the splits -> (arrays, columns, classes, scaler, original_rows).
+    SMOTE keeps the original training rows first: X_train[:original_rows] are real traffic."""
+    with tracer.span('load'):
+        train_df = load_split(train_path)
+        test_df = load_split(test_path)
+
+    with tracer.span('encode'):
+        # One-hot encoding
+        train_encoded = pd.get_dummies(train_df, columns=categorical)
+        test_encoded = pd.get_dummies(test_df, columns=categorical)
+
+        # Align train and test columns
+        train_encoded, test_encoded = train_encoded.align(test_encoded, join='left', axis=1, fill_value=0)
+
+        # Separate features and labels
+        X_train = train_encoded.drop(['label', 'attack_category'], axis=1)
+        y_train = train_encoded['attack_category']
+        X_test = test_encoded.drop(['label', 'attack_category'], axis=1)
+        y_test = test_encoded['attack_category']
+
+    with tracer.span('scale'):
+        # Normalize numerical features
+        scaler = MinMaxScaler()
+        X_train_scaled = scaler.fit_transform(X_train)
+        X_test_scaled = scaler.transform(X_test)
+
+        # Convert back to DataFrame
+        X_train_scaled = pd.DataFrame(X_train_scaled, columns=X_train.columns)
+        X_test_scaled = pd.DataFrame(X_test_scaled, columns=X_test.columns)
+
+    with tracer.span('smote'):
+        # Apply SMOTE (only on training data)
+        smote = SMOTE(random_state=seed)
+        X_train_resampled, y_train_resampled = smote.fit_resample(X_train_scaled, y_train)
+
+    with tracer.span('arrays'):
+        # Typed arrays: float32 features (what XGBoost trains on), uint8 class codes
+        classes = sorted(y_train_resampled.unique())
+        arrays = {
+            'X_train': X_train_resampled.to_numpy(dtype=np.float32),
+            'y_train': dataset_cache.encode_labels(y_train_resampled, classes),
+            'X_test': X_test_scaled.to_numpy(dtype=np.float32),
+            'y_test': dataset_cache.encode_labels(y_test, classes),
+        }
+    return arrays, X_train.columns.tolist(), classes, scaler, len(X_train_scaled)
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """load_split() one chunk at a time"""
+    for chunk in pd.read_csv(path, names=columns, header=None, chunksize=chunk_size):
+        chunk['attack_category'] = chunk['label'].map(attack_mapping)
+        yield chunk.drop('difficulty', axis=1)
+
+def scan_split(path, chunk_size=CHUNK_SIZE):
+    """Pass 1: row and class counts, categorical vocabularies with counts, numeric min/max"""
+    stats = {'rows': 0, 'classes': {}, 'vocab': {cat: {} for cat in categorical},
+             'min': None, 'max': None}
+    for chunk in read_chunks(path, chunk_size):
+        numeric = chunk.drop(['label', 'attack_category'] + categorical, axis=1)
+        if stats['min'] is None:
+            stats['min'], stats['max'] = numeric.min(), numeric.max()
+        else:
+            stats['min'] = np.fmin(stats['min'], numeric.min())
+            stats['max'] = np.fmax(stats['max'], numeric.max())
+        for cat in categorical:
+            counts = stats['vocab'][cat]
+            for value, n in chunk[cat].value_counts().items():
+                counts[value] = counts.get(value, 0) + n
+        for label, n in chunk['attack_category'].value_counts(dropna=False).items():
+            stats['classes'][label] = stats['classes'].get(label, 0) + n
+        stats['rows'] += len(chunk)
+    return stats
+
+def build_scaler(stats):
+    """MinMaxScaler equal to fit() on the full encoded training set, from pass-1 statistics"""
+    numeric = stats['min'].index.tolist()
+    # get_dummies puts the one-hot columns after the others, values in sorted order
+    onehot = [(cat, value) for cat in categorical for value in sorted(stats['vocab'][cat])]
+    feature_names = numeric + [f"{cat}_{value}" for cat, value in onehot]
+    # A one-hot column is 1 somewhere; its minimum is 1 only if every row has the value
+    onehot_min = [float(stats['vocab'][cat][value] == stats['rows']) for cat, value in onehot]
+    data_min = np.concatenate([stats['min'].to_numpy(dtype=np.float64), onehot_min])
+    data_max = np.concatenate([stats['max'].to_numpy(dtype=np.float64), np.ones(len(onehot))])
+    scaler = MinMaxScaler()
+    scaler.partial_fit(pd.DataFrame([data_min, data_max], columns=feature_names))
+    scaler.n_samples_seen_ = stats['rows']
+    return scaler, feature_names
+
+def encode_chunk(chunk, feature_names, scaler):
+    """One-hot encode a chunk with the training columns and scale it (float64)"""
+    encoded = pd.get_dummies(chunk.drop(['label', 'attack_category'], axis=1), columns=categorical)
+    # Same as align(join='left', fill_value=0): unseen categories are dropped
+    encoded = encoded.reindex(columns=feature_names, fill_value=0)
+    return scaler.transform(encoded.astype(np.float64))
+
+class ClassReservoir:
+    """Uniform sample (Algorithm R) of at most `capacity` rows of one class,
+    remembering every kept row's position in the input"""
+
+    def __init__(self, capacity, n_features, rng):
+        self.capacity = capacity
+        self.rows = np.empty((capacity, n_features))
+        self.positions = np.empty(capacity, dtype=np.int64)
+        self.seen = 0
+        self.rng = rng
+
+    def add(self, rows, positions):
+        # Fill the free slots in input order
+        free = min(self.capacity - min(self.seen, self.capacity), len(rows))
+        start = self.seen
+        if free:
+            self.rows[start:start + free] = rows[:free]
+            self.positions[start:start + free] = positions[:free]
+        # Then row number s (0-based) replaces a random slot with probability capacity / (s + 1)
+        if len(rows) > free:
+            seen = np.arange(start + free, start + len(rows)) + 1
+            slots = (self.rng.random(len(seen)) * seen).astype(np.int64)
+            keep = slots < self.capacity
+            self.rows[slots[keep]] = rows[free:][keep]
+            self.positions[slots[keep]] = positions[free:][keep]
+        self.seen += len(rows)
+
+    def sample(self):
+        n = min(self.seen, self.capacity)
+        return self.rows[:n], self.positions[:n]
+
+def preprocess_streaming(train_path, test_path, cache_dir, seed=SMOTE_SEED,
+                         chunk_size=CHUNK_SIZE, max_per_class=MAX_PER_CLASS):
+    """Two-pass, chunked version of preprocess() -> (arrays, columns, classes, scaler, original_rows).
+    X_test / y_test are written straight into memmaps in `cache_dir`."""
+    # Pass 1: vocabularies, min/max and counts
+    with tracer.span('scan'):
+        train_stats = scan_split(train_path, chunk_size)
+        test_rows = sum(len(chunk) for chunk in pd.read_csv(test_path, names=columns, header=None,
+                                                            usecols=['label'], chunksize=chunk_size))
+        scaler, feature_names = build_scaler(train_stats)
+    unknown = [label for label in train_stats['classes'] if not isinstance(label, str)]
+    if unknown:
+        raise ValueError("training labels without an attack category (check attack_mapping)")
+    classes = sorted(train_stats['classes'])
+
+    # Pass 2a: training rows into per-class reservoirs (exact copies while under the cap)
+    rng = np.random.default_rng(seed)
+    reservoirs = {label: ClassReservoir(min(n, max_per_class), len(feature_names), rng)
+                  for label, n in train_stats['classes'].items()}
+    offset = 0
+    for chunk in read_chunks(train_path, chunk_size):
+        with tracer.span('encode'):
+            rows = encode_chunk(chunk, feature_names, scaler)
+        with tracer.span('reservoir'):
+            labels = chunk['attack_category'].to_numpy()
+            positions = np.arange(offset, offset + len(chunk))
+            for label, reservoir in reservoirs.items():
+                mask = labels == label
+                reservoir.add(rows[mask], positions[mask])
+        offset += len(chunk)
+
+    # Back in input order, so SMOTE sees exactly what the in-memory pipeline gives it
+    samples = {label: reservoir.sample() for label, reservoir in reservoirs.items()}
+    positions = np.concatenate([pos for _, pos in samples.values()])
+    order = np.argsort(positions, kind='stable')
+    X_kept = np.concatenate([rows for rows, _ in samples.values()])[order]
+    y_kept = np.concatenate([[label] * len(pos) for label, (_, pos) in samples.items()])[order]
+    original_rows = len(X_kept)
+    del samples, reservoirs
+
+    # Apply SMOTE (only on training data)
+    with tracer.span('smote'):
+        smote = SMOTE(random_state=seed)
+        X_train_resampled, y_train_resampled = smote.fit_resample(
+            pd.DataFrame(X_kept, columns=feature_names), pd.Series(y_kept, name='attack_category'))
+    del X_kept, y_kept
+
+    # Pass 2b: test rows straight into the on-disk arrays
+    dataset_cache.invalidate(cache_dir)
+    X_test = dataset_cache.create_array('X_test', (test_rows, len(feature_names)), np.float32, cache_dir)
+    y_test = dataset_cache.create_array('y_test', (test_rows,), np.uint8, cache_dir)
+    offset = 0
+    for chunk in read_chunks(test_path, chunk_size):
+        with tracer.span('test'):
+            X_test[offset:offset + len(chunk)] = encode_chunk(chunk, feature_names, scaler)
+            y_test[offset:offset + len(chunk)] = dataset_cache.encode_labels(chunk['attack_category'], classes)
+        offset += len(chunk)
+
+    arrays = {
+        'X_train': X_train_resampled.to_numpy(dtype=np.float32),
+        'y_train': dataset_cache.encode_labels(y_train_resampled, classes),
+        'X_test': X_test,
+        'y_test': y_test,
+    }
+    return arrays, feature_names, classes, scaler, original_rows
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NSL-KDD preprocessing")
+    parser.add_argument('--train', default=DATA_FILES['train'], help="Raw NSL-KDD training file")
+    parser.add_argument('--test', default=DATA_FILES['test'], help="Raw NSL-KDD test file")
+    parser.add_argument('--cache-dir', default=dataset_cache.CACHE_DIR,
+                        help="Directory for the .npy matrices and manifest.json")
+    parser.add_argument('--force', action='store_true', help="Rebuild even if the inputs are unchanged")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Two-pass chunked preprocessing for datasets larger than RAM")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="[streaming] rows per chunk")
+    parser.add_argument('--max-per-class', type=int, default=MAX_PER_CLASS,
+                        help="[streaming] training rows kept per class for SMOTE")
+    parser.add_argument('--trace', action='store_true',
+                        help="Log a per-stage timing breakdown (toggle at runtime with SIGUSR1)")
+    parser.add_argument('--trace-interval', type=float, default=TRACE_INTERVAL,
+                        help="Seconds between breakdowns while tracing")
+    args = parser.parse_args()
+    tracer.interval = max(0.1, args.trace_interval)
+    install_toggle(tracer.toggle)
+    if args.trace:
+        tracer.set_enabled(True)
+
+    sources = {'train': args.train, 'test': args.test}
+    # The output only depends on the cap in streaming mode (and equals the in-memory one under it)
+    params = {'smote_seed': SMOTE_SEED, 'max_per_class': args.max_per_class if args.streaming else None}
+    outputs_exist = all(os.path.exists(p) for p in ('scaler.pkl', 'feature_names.pkl'))
+    if not args.force and outputs_exist and dataset_cache.is_fresh(sources, params, args.cache_dir):
+        print(f"✅ Preprocessed data in '{args.cache_dir}' is up to date (sources unchanged), skipping.")
+        raise SystemExit(0)
+
+    start = time.perf_counter()
+    if args.streaming:
+        arrays, feature_names, classes, scaler, original_rows = preprocess_streaming(
+            args.train, args.test, args.cache_dir, chunk_size=args.chunk_size,
+            max_per_class=args.max_per_class)
+    else:
+        arrays, feature_names, classes, scaler, original_rows = preprocess(args.train, args.test)
+
+    # Save preprocessed data and scaler
+    with tracer.span('save'):
+        joblib.dump(scaler, 'scaler.pkl')
+        joblib.dump(feature_names, 'feature_names.pkl')
+        dataset_cache.save(arrays, feature_names, classes, scaler, sources, params, args.cache_dir,
+                           original_rows=original_rows)
+
+    counts = np.bincount(arrays['y_train'], minlength=len(classes))
+    print(f"Training samples after SMOTE: {arrays['X_train'].shape} ({original_rows} original)")
+    print(f"Test samples: {arrays['X_test'].shape}")
+    print("Class distribution:\n" + "\n".join(f"{name:<8}{n}" for name, n in zip(classes, counts)))
+    print(f"✅ Saved to '{args.cache_dir}' in {time.perf_counter() - start:.1f}s "
+          f"(peak RSS {peak_rss_mb():.0f} MB)")
+    if tracer.enabled:
+        tracer.report()
@@ -0,0 +1,208 @@
+"""
+Sampled logging and trace spans for the engine, dashboard and training scripts.
+
+SampledLog replaces per-packet prints (alerts, BLOCKs, per-message errors).
+In each LOG_WINDOW, every event kind writes its first LOG_BURST lines and
+after that only one line in LOG_SAMPLE_EVERY. The events that are skipped are
+counted, and the counts are written as one 'suppressed' record per kind when
+the window ends. Lines are the familiar text messages, or JSON records with
+the same fields (--log-format json). A skipped event costs a counter update
+and never formats anything.
+
+Tracer times named stages with `with tracer.span('decode'): ...`. When
+tracing is off, span() returns a shared no-op context manager. When it is on,
+a reporter thread writes a per-stage breakdown every TRACE_INTERVAL seconds
+and resets the totals: calls, total and mean ms, and the share of wall time
+each stage was busy. Spans wrap named functions (decode_payloads,
+score_features, publish_outbox, ...), so a cProfile or py-spy capture
+attributes time to the same stages.
+
+Tracing is toggled at runtime with SIGUSR1 (`kill -USR1 <pid>`). The engine
+also accepts {"command": "TRACE", "enabled": true|false} on network/control.
+"""
+import json
+import signal
+import sys
+import threading
+import time
+
+LOG_FORMATS = ('text', 'json')
+LOG_WINDOW = 1.0          # seconds per sampling window
+LOG_BURST = 10            # lines per event kind written in full each window
+LOG_SAMPLE_EVERY = 1000   # then one line in this many
+TRACE_INTERVAL = 5.0      # seconds between breakdowns while tracing
+
+
+class SampledLog:
+    """Per-kind rate-limited and sampled event log (text or JSON lines)"""
+
+    def __init__(self, fmt='text', burst=LOG_BURST, sample_every=LOG_SAMPLE_EVERY,
+                 window=LOG_WINDOW, stream=None):
+        self.fmt = fmt
+        self.burst = burst
+        self.sample_every = max(1, sample_every)
+        self.window = window
+        self.stream = stream
+        self._counts = {}  # kind -> [events this window, suppressed this window]
+        self._window_start = time.monotonic()
+        self._lock = threading.Lock()  # one thread ends a window
+
+    def event(self, kind, template, **fields):
+        """Log one event unless its kind is over the sampling budget of this window"""
+        now = time.monotonic()
+        if now - self._window_start >= self.window:
+            self.flush(now)
+        # No lock on this path: each kind is logged from one thread in practice,
+        # and a race could only miscount one line of a log sample
+        counts = self._counts.get(kind)
+        if counts is None:
+            counts = self._counts.setdefault(kind, [0, 0])
+        counts[0] += 1
+        n = counts[0]
+        if n <= self.burst or (n - self.burst) % self.sample_every == 0:
+            self.write(kind, template.format(**fields), fields)
+        else:
+            counts[1] += 1
+
+    def flush(self, now=None):
+        """End the window if it has run out and write what it suppressed (also called by periodic threads)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            seconds = now - self._window_start
+            if seconds < self.window:
+                return
+            counts, self._counts = self._counts, {}
+            self._window_start = now
+        for kind, (_, n) in counts.items():
+            if n:
+                self.write('suppressed', f"   … {n} more '{kind}' events in the last {seconds:.1f}s (sampled)",
+                           {'kind': kind, 'count': n, 'window_s': round(seconds, 3)})
+
+    def write(self, kind, text, fields=None):
+        """Write one line as is (no sampling), e.g. reports and summaries"""
+        if self.fmt == 'json':
+            text = json.dumps({'ts': round(time.time(), 6), 'event': kind, **(fields or {})}, default=str)
+        print(text, file=self.stream or sys.stdout, flush=True)
+
+
+class _NoSpan:
+    """What span() returns while tracing is off"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'stage', 'start')
+
+    def __init__(self, tracer, stage):
+        self.tracer = tracer
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Tracer:
+    """Per-stage wall-time totals, reported every `interval` seconds while enabled"""
+
+    def __init__(self, component, log, interval=TRACE_INTERVAL):
+        self.component = component
+        self.log = log
+        self.interval = interval   # 0 = no reporter thread (totals are taken by the caller)
+        self.enabled = False
+        self._totals = {}          # stage -> [calls, seconds]
+        self._since = time.monotonic()
+        self._lock = threading.Lock()
+        self._reporter = None
+
+    def span(self, stage):
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, stage)
+
+    def add(self, stage, seconds, calls=1):
+        with self._lock:
+            totals = self._totals.get(stage)
+            if totals is None:
+                self._totals[stage] = [calls, seconds]
+            else:
+                totals[0] += calls
+                totals[1] += seconds
+
+    def take(self):
+        """{stage: (calls, seconds)} since the last take(); resets"""
+        with self._lock:
+            totals, self._totals = self._totals, {}
+        return {stage: tuple(values) for stage, values in totals.items()}
+
+    def merge(self, totals):
+        """Add a take() result from another process (e.g. a sharded worker)"""
+        for stage, (calls, seconds) in totals.items():
+            self.add(stage, seconds, calls)
+
+    def set_enabled(self, enabled):
+        if enabled and not self.enabled:
+            self.take()
+            self._since = time.monotonic()
+            if self.interval > 0 and self._reporter is None:
+                self._reporter = threading.Thread(target=self._report_loop, daemon=True)
+                self._reporter.start()
+        elif not enabled and self.enabled and self.interval > 0:
+            self.report()
+        self.enabled = bool(enabled)
+        self.log.write('trace_toggle', f"🔬 Tracing {'on' if self.enabled else 'off'} ({self.component})",
+                       {'component': self.component, 'enabled': self.enabled})
+
+    def toggle(self):
+        self.set_enabled(not self.enabled)
+
+    def _report_loop(self):
+        while True:
+            time.sleep(self.interval)
+            if self.enabled:
+                self.report()
+
+    def report(self):
+        """Write the per-stage breakdown since the last report and reset it"""
+        now = time.monotonic()
+        elapsed, self._since = max(now - self._since, 1e-9), now
+        totals = self.take()
+        if not totals:
+            return
+        traced = max(sum(seconds for _, seconds in totals.values()), 1e-9)
+        # share: of all traced time; busy: of wall time (a span counts when it
+        # ends, so stages longer than the interval or on several threads exceed 100%)
+        stages = {stage: {'calls': calls, 'total_ms': round(seconds * 1000, 3),
+                          'mean_ms': round(seconds * 1000 / max(calls, 1), 4),
+                          'share': round(seconds / traced, 4), 'busy': round(seconds / elapsed, 4)}
+                  for stage, (calls, seconds) in sorted(totals.items(), key=lambda item: -item[1][1])}
+        width = max(14, *(len(stage) for stage in stages))
+        lines = [f"🔬 Trace {self.component}, last {elapsed:.1f}s:",
+                 f"   {'stage':<{width}} {'calls':>9} {'total ms':>11} {'ms/call':>11} {'share':>7} {'busy':>7}"]
+        for stage, s in stages.items():
+            lines.append(f"   {stage:<{width}} {s['calls']:>9} {s['total_ms']:>11.2f} "
+                         f"{s['mean_ms']:>11.4f} {s['share']:>7.1%} {s['busy']:>7.1%}")
+        self.log.write('trace', '\n'.join(lines),
+                       {'component': self.component, 'interval_s': round(elapsed, 3), 'stages': stages})
+
+
+def install_toggle(toggle):
+    """Call toggle() on SIGUSR1 (main thread only; not available on Windows)"""
+    if not hasattr(signal, 'SIGUSR1'):
+        return False
+    # Run it off the signal handler: it may take locks the interrupted code holds
+    signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=toggle, daemon=True).start())
+    return True
@@ -0,0 +1,283 @@
+"""
+Offline bulk scoring of recorded traffic.
+
+Streams an NSL-KDD-format CSV (with or without the label / difficulty
+columns) or a JSONL file of network/traffic packets, scores it in large
+chunks on every core with the same vectorizer and model the live engine
+uses, and writes one verdict per record to a columnar file:
+
+  row         record number in the input
+  label       predicted class code (class names are stored alongside)
+  confidence  probability of the predicted class
+  truth       labelled class code for NSL-KDD CSVs (-1 if unknown)
+
+Output is .npz, or .parquet when pyarrow is installed. Verdicts are
+identical to the live engine's: CSV chunks are vectorized column by column
+(FeatureVectorizer.transform_columns), which gives the same rows as the
+per-packet path, and the first chunk is cross-checked against it.
+
+Examples:
+  python replay.py data/KDDTest+.txt --output verdicts.npz
+  python replay.py capture.jsonl --runtime compiled --output verdicts.parquet
+  python replay.py data/KDDTest+.txt --output new.npz --compare old.npz
+"""
+import argparse
+import io
+import itertools
+import json
+import multiprocessing as mp
+import os
+import resource
+import time
+
+import numpy as np
+
+from model_runtime import ARTIFACTS, load_bundle
+from tree_runtime import COMPILED_MODEL, load_compiled
+
+CHUNK_ROWS = 100000
+CHECK_ROWS = 1000   # rows of the first chunk re-scored through the packet path
+
+bundle = None  # loaded in main() before the workers fork
+
+
+def read_blocks(path, rows=CHUNK_ROWS):
+    """Yield (first row number, raw bytes of up to `rows` lines)"""
+    start = 0
+    with open(path, 'rb') as f:
+        while True:
+            lines = list(itertools.islice(f, rows))
+            if not lines:
+                return
+            yield start, b''.join(lines)
+            start += len(lines)
+
+
+def parse_csv(block):
+    """NSL-KDD CSV block -> (columns DataFrame, truth labels or None)"""
+    import pandas as pd
+    from preprocessing import columns, attack_mapping
+    frame = pd.read_csv(io.BytesIO(block), header=None)
+    # Files without the difficulty (and label) columns are accepted too
+    frame.columns = columns[:frame.shape[1]]
+    truth = frame['label'].map(attack_mapping) if 'label' in frame else None
+    return frame, truth
+
+
+def truth_codes(truth, class_names):
+    """Class names -> codes into class_names, -1 for unmapped labels"""
+    codes = np.full(len(truth), -1, dtype=np.int8)
+    for code, name in enumerate(class_names):
+        codes[np.asarray(truth == name)] = code
+    return codes
+
+
+def score_block(task):
+    """Worker: parse, vectorize and score one block -> verdict columns"""
+    start, block, fmt = task
+    class_names = bundle.scorer.class_names
+    truth = None
+    if fmt == 'jsonl':
+        records = [json.loads(line) for line in block.splitlines() if line.strip()]
+        features = bundle.vectorizer.transform_batch(records)
+        if records and 'label' in records[0]:
+            from preprocessing import attack_mapping
+            import pandas as pd
+            truth = pd.Series([attack_mapping.get(r.get('label'), r.get('label')) for r in records])
+    else:
+        frame, truth = parse_csv(block)
+        features = bundle.vectorizer.transform_columns(frame, len(frame))
+    probs = bundle.scorer.predict_proba(features)
+    # Same argmax / max as scorer.score, kept as codes
+    label = probs.argmax(axis=1)
+    verdicts = {
+        'row': np.arange(start, start + len(label), dtype=np.int64),
+        'label': label.astype(np.int8),
+        'confidence': probs[np.arange(len(label)), label],
+        'truth': truth_codes(truth, class_names) if truth is not None else np.full(len(label), -1, np.int8),
+    }
+    if start == 0 and len(label):
+        verdicts['check'] = check_packet_path(block, fmt, features, label)
+    return verdicts
+
+
+def check_packet_path(block, fmt, features, label):
+    """Re-score the first rows exactly as the live engine does (dict packets)"""
+    if fmt == 'jsonl':
+        records = [json.loads(line) for line in block.splitlines()[:CHECK_ROWS] if line.strip()]
+    else:
+        frame, _ = parse_csv(block)
+        records = frame.head(CHECK_ROWS).to_dict('records')
+    rows = bundle.vectorizer.transform_batch(records)
+    labels, confidences, _ = bundle.scorer.score(rows)
+    n = len(records)
+    return bool(rows.tobytes() == features[:n].tobytes()
+                and (labels == bundle.scorer.class_names[label[:n]]).all())
+
+
+def init_worker(threads):
+    bundle.scorer.set_threads(threads)
+
+
+class VerdictWriter:
+    """Columnar verdict output: .parquet (streamed, needs pyarrow) or .npz"""
+
+    def __init__(self, path, class_names, metadata):
+        self.path = path
+        self.class_names = [str(name) for name in class_names]
+        self.metadata = metadata
+        self.parts = []
+        self.parquet = None
+        if path.endswith('.parquet'):
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise SystemExit("❌ Parquet output needs pyarrow (pip install pyarrow), or use .npz")
+            self.pa = pa
+            schema = pa.schema([('row', pa.int64()),
+                                ('label', pa.dictionary(pa.int8(), pa.string())),
+                                ('confidence', pa.float64()),
+                                ('truth', pa.dictionary(pa.int8(), pa.string()))],
+                               metadata={'replay': json.dumps(metadata)})
+            self.parquet = pq.ParquetWriter(path, schema)
+
+    def write(self, verdicts):
+        if self.parquet is None:
+            self.parts.append(verdicts)
+            return
+        pa = self.pa
+        names = pa.array(self.class_names)
+        truth = verdicts['truth']
+        self.parquet.write_table(pa.table({
+            'row': verdicts['row'],
+            'label': pa.DictionaryArray.from_arrays(verdicts['label'], names),
+            'confidence': verdicts['confidence'],
+            'truth': pa.DictionaryArray.from_arrays(pa.array(truth, mask=truth < 0), names),
+        }, schema=self.parquet.schema))
+
+    def close(self):
+        if self.parquet is not None:
+            self.parquet.close()
+            return
+        columns = {name: np.concatenate([part[name] for part in self.parts])
+                   if self.parts else np.empty(0) for name in ('row', 'label', 'confidence', 'truth')}
+        np.savez(self.path, **columns, class_names=np.array(self.class_names),
+                 metadata=np.array(json.dumps(self.metadata)))
+
+
+def load_verdicts(path):
+    """Read a replay output -> ({column: array}, class_names)"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        class_names = list(table.column('label').chunk(0).dictionary.to_pylist()) if table.num_rows else []
+        columns = {name: table.column(name).combine_chunks() for name in ('row', 'label', 'confidence')}
+        return {'row': columns['row'].to_numpy(),
+                'label': columns['label'].indices.to_numpy(),
+                'confidence': columns['confidence'].to_numpy()}, class_names
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in ('row', 'label', 'confidence')}, list(data['class_names'])
+
+
+def compare(new, new_classes, old_path):
+    """Print how the new verdicts differ from an earlier replay of the same input"""
+    old, old_classes = load_verdicts(old_path)
+    if len(old['row']) != len(new['row']):
+        print(f"⚠️  {old_path} has {len(old['row'])} rows, this run {len(new['row'])}: not comparable")
+        return
+    old_names = np.asarray(old_classes, dtype=object)[old['label']]
+    new_names = np.asarray(new_classes, dtype=object)[new['label']]
+    changed = old_names != new_names
+    print(f"🔍 vs {old_path}: {changed.mean():.4%} of verdicts changed "
+          f"({int(changed.sum())} rows), mean |Δconfidence| "
+          f"{np.abs(old['confidence'] - new['confidence']).mean():.4f}")
+    pairs, counts = np.unique(np.stack([old_names[changed], new_names[changed]]).astype(str),
+                              axis=1, return_counts=True)
+    for (was, now), n in sorted(zip(pairs.T.tolist(), counts), key=lambda item: -item[1])[:10]:
+        print(f"   {was:>7} -> {now:<7} {n}")
+
+
+def main():
+    global bundle
+    parser = argparse.ArgumentParser(description="Score recorded traffic offline")
+    parser.add_argument('input', help="NSL-KDD CSV or .jsonl of network/traffic packets")
+    parser.add_argument('--output', default='verdicts.npz', help="Verdict file (.npz or .parquet)")
+    parser.add_argument('--format', choices=['auto', 'csv', 'jsonl'], default='auto')
+    parser.add_argument('--runtime', choices=['xgboost', 'compiled'], default='xgboost')
+    parser.add_argument('--model', help=f"Model artifact to score with (default {ARTIFACTS['model']} "
+                                        f"or {COMPILED_MODEL}), e.g. an older model for comparisons")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--compare', help="Earlier replay output of the same input to diff against")
+    args = parser.parse_args()
+    fmt = args.format
+    if fmt == 'auto':
+        fmt = 'jsonl' if args.input.endswith(('.jsonl', '.json')) else 'csv'
+
+    if args.runtime == 'compiled':
+        bundle = load_compiled(args.model or COMPILED_MODEL)
+    else:
+        bundle = load_bundle(dict(ARTIFACTS, model=args.model) if args.model else ARTIFACTS)
+    bundle.check()
+    class_names = list(bundle.scorer.class_names)
+    workers = max(1, args.workers)
+    model_name = args.model or bundle.version or COMPILED_MODEL
+    print(f"⏱️  Replaying {args.input} ({fmt}) with {args.runtime} model {model_name} "
+          f"on {workers} worker(s)...")
+
+    start = time.perf_counter()
+    writer = VerdictWriter(args.output, class_names, {
+        'input': os.path.abspath(args.input), 'runtime': args.runtime,
+        'model': args.model, 'version': bundle.version,
+    })
+    tasks = ((first, block, fmt) for first, block in read_blocks(args.input, args.chunk_rows))
+    # Workers fork after the model is loaded and share it copy-on-write
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if workers > 1:
+        methods = mp.get_all_start_methods()
+        ctx = mp.get_context('fork' if 'fork' in methods else methods[0])
+        pool = ctx.Pool(workers, initializer=init_worker, initargs=(threads,))
+        results = pool.imap(score_block, tasks)
+    else:
+        pool = None
+        results = map(score_block, tasks)
+
+    counts = np.zeros(len(class_names), dtype=np.int64)
+    rows = correct = labelled = 0
+    parts = []
+    for verdicts in results:
+        check = verdicts.pop('check', None)
+        if check is not None:
+            print(f"{'✅' if check else '❌'} First {CHECK_ROWS} rows vs the live engine's packet path: "
+                  f"{'identical' if check else 'MISMATCH'}")
+            if not check:
+                raise SystemExit(1)
+        writer.write(verdicts)
+        if args.compare:
+            parts.append({name: verdicts[name] for name in ('row', 'label', 'confidence')})
+        counts += np.bincount(verdicts['label'], minlength=len(class_names))
+        known = verdicts['truth'] >= 0
+        labelled += int(known.sum())
+        correct += int((verdicts['truth'][known] == verdicts['label'][known]).sum())
+        rows += len(verdicts['row'])
+    writer.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"✅ {rows} records in {elapsed:.1f}s ({rows / max(elapsed, 1e-9) * 60 / 1e6:.2f}M/min, "
+          f"peak RSS {peak:.0f} MB) -> {args.output}")
+    for name, n in zip(class_names, counts):
+        print(f"   {name:>7}: {n}")
+    if labelled:
+        print(f"   Accuracy on {labelled} labelled records: {correct / labelled:.4f}")
+    if args.compare:
+        new = {name: np.concatenate([p[name] for p in parts]) for name in ('row', 'label', 'confidence')}
+        compare(new, class_names, args.compare)
+
+
+if __name__ == "__main__":
+    main()
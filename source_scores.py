@@ -0,0 +1,96 @@
+"""
+Per-source attack evidence for the IPS decision.
+
+Instead of blocking on one confident packet, every attack verdict adds its
+confidence to the sending source's score for that class, and scores decay
+exponentially (halving every `half_life` seconds). A source is blocked once a
+class score reaches its threshold -- e.g. 2.5 takes at least three confident
+packets in quick succession -- so a single false positive never blocks a host.
+
+Scores live in preallocated NumPy slot arrays (one float32 row per source);
+an OrderedDict maps source IPs to slots in least-recently-seen order, so when
+the table is full the stalest source's slot is reused. Decay is applied
+lazily when a source sends its next attack verdict, so each update is O(1)
+and Normal verdicts cost nothing. Only the scoring thread may call add().
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+# A source quiet for this many half-lives has decayed to < 0.4%: start a new window
+FORGET_HALF_LIVES = 8
+
+
+class SourceScores:
+    """Exponentially decayed per-class attack scores for up to `capacity` sources"""
+
+    def __init__(self, classes, half_life=30.0, threshold=2.5, thresholds=None, capacity=200000):
+        self.classes = list(classes)
+        self._column = {name: j for j, name in enumerate(self.classes)}
+        self.half_life = half_life
+        thresholds = thresholds or {}
+        self._thresholds = [float(thresholds.get(name, threshold)) for name in self.classes]
+        self.capacity = capacity
+        self._scores = np.zeros((capacity, len(self.classes)), dtype=np.float32)
+        self._updated = np.zeros(capacity)   # time of the last attack verdict
+        self._since = np.zeros(capacity)     # start of the current evidence window
+        self._packets = np.zeros(capacity, dtype=np.uint32)
+        self._slots = OrderedDict()          # ip -> slot, least recently seen first
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _slot(self, ip, now):
+        slot = self._slots.get(ip)
+        if slot is not None:
+            self._slots.move_to_end(ip)
+            if now - self._updated[slot] < FORGET_HALF_LIVES * self.half_life:
+                return slot
+        elif len(self._slots) < self.capacity:
+            slot = len(self._slots)
+            self._slots[ip] = slot
+        else:
+            _, slot = self._slots.popitem(last=False)
+            self._slots[ip] = slot
+            self.evictions += 1
+        self._reset(slot, now)
+        return slot
+
+    def _reset(self, slot, now):
+        self._scores[slot] = 0.0
+        self._updated[slot] = now
+        self._since[slot] = now
+        self._packets[slot] = 0
+
+    def add(self, ip, label, confidence, now):
+        """Add one verdict -> evidence dict when it pushes a class over its threshold, else None"""
+        column = self._column.get(label)
+        if column is None:
+            return None  # Normal traffic adds no evidence
+        slot = self._slot(ip, now)
+        row = self._scores[slot]
+        elapsed = now - self._updated[slot]
+        if elapsed > 0:
+            row *= 0.5 ** (elapsed / self.half_life)
+        row[column] += confidence
+        self._updated[slot] = now
+        self._packets[slot] += 1
+        if row[column] < self._thresholds[column]:
+            return None
+        evidence = {
+            'class': label,
+            'score': round(float(row[column]), 3),
+            'scores': {name: round(float(score), 3) for name, score in zip(self.classes, row)},
+            'packets': int(self._packets[slot]),
+            'window_s': round(float(now - self._since[slot]), 3),
+        }
+        # The block starts a new window: a repeat offense needs fresh evidence
+        self._reset(slot, now)
+        return evidence
+
+    def forget(self, ip, now):
+        """Clear a source's evidence (e.g. after an operator UNBLOCK)"""
+        slot = self._slots.get(ip)
+        if slot is not None:
+            self._reset(slot, now)
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# The modules live at the repository root (python detection_engine.py, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import LabelEncoder
+from xgboost import XGBClassifier
+
+CLASSES = ['DoS', 'Normal', 'Probe', 'R2L', 'U2R']
+
+
+def synthetic_rows(n, n_features=12, seed=0):
+    """Noisy rows whose class depends on a few features (float32, like the feature blocks)"""
+    rng = np.random.default_rng(seed)
+    X = rng.random((n, n_features), dtype=np.float32)
+    y = (X[:, 0] * 3 + X[:, 1] * 2 + rng.normal(0, 0.3, n)).clip(0, len(CLASSES) - 1e-6).astype(int)
+    return X, y
+
+
+@pytest.fixture(scope='session', params=['early_stopping', 'all_rounds'])
+def trained(request):
+    """(model, label encoder, held-out rows): with early stopping best_iteration < rounds"""
+    X, y = synthetic_rows(3000)
+    X_val, y_val = synthetic_rows(500, seed=1)
+    early = request.param == 'early_stopping'
+    model = XGBClassifier(n_estimators=60, max_depth=4, learning_rate=0.3, n_jobs=1,
+                          early_stopping_rounds=3 if early else None)
+    model.fit(X, y, eval_set=[(X_val, y_val)] if early else None, verbose=False)
+    X_test, _ = synthetic_rows(2000, seed=2)
+    return model, LabelEncoder().fit(CLASSES), X_test
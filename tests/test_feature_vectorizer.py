@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from feature_vectorizer import FeatureVectorizer, reference_transform
+
+FEATURE_NAMES = ['duration', 'src_bytes', 'dst_bytes', 'count', 'serror_rate', 'same_srv_rate',
+                 'protocol_type_icmp', 'protocol_type_tcp', 'protocol_type_udp',
+                 'service_ftp', 'service_http', 'service_private', 'flag_REJ', 'flag_S0', 'flag_SF']
+# A subset in another order, as the model's selected features may be
+SELECTED = ['src_bytes', 'flag_SF', 'count', 'protocol_type_tcp', 'service_private', 'duration',
+            'serror_rate', 'service_http', 'protocol_type_udp', 'flag_S0', 'dst_bytes']
+
+RECORDS = [
+    {'source_ip': '10.0.0.1', 'protocol_type': 'tcp', 'service': 'http', 'flag': 'SF', 'duration': 0,
+     'src_bytes': 232, 'dst_bytes': 8153, 'count': 5, 'serror_rate': 0.2, 'same_srv_rate': 1.0},
+    {'source_ip': '10.0.0.2', 'protocol_type': 'udp', 'service': 'private', 'flag': 'S0', 'duration': 12,
+     'src_bytes': 105, 'dst_bytes': 146, 'count': 511, 'serror_rate': 1.0, 'same_srv_rate': 0.05},
+    # Values the scaler never saw: an unknown service and flag, out-of-range counters
+    {'source_ip': '10.0.0.3', 'protocol_type': 'icmp', 'service': 'gopher', 'flag': 'RSTO', 'duration': 90000,
+     'src_bytes': 10 ** 7, 'dst_bytes': 0, 'count': 1, 'serror_rate': 0.0, 'same_srv_rate': 0.33},
+    # Missing fields are filled with 0 before scaling
+    {'protocol_type': 'tcp', 'service': 'ftp', 'flag': 'REJ', 'src_bytes': 20},
+]
+
+
+@pytest.fixture(scope='module')
+def setup():
+    rng = np.random.default_rng(7)
+    raw = pd.DataFrame(rng.integers(0, 1000, (50, len(FEATURE_NAMES))).astype(np.float64),
+                       columns=FEATURE_NAMES)
+    scaler = MinMaxScaler().fit(raw)
+    return scaler, FeatureVectorizer(FEATURE_NAMES, scaler, SELECTED)
+
+
+def expected_rows(scaler):
+    # One packet at a time, like the engine's old pandas path
+    return np.vstack([reference_transform([r], FEATURE_NAMES, scaler, SELECTED) for r in RECORDS])
+
+
+def test_transform_matches_the_pandas_path(setup):
+    scaler, vectorizer = setup
+    single = np.vstack([vectorizer.transform(r) for r in RECORDS])
+    assert single.tobytes() == expected_rows(scaler).tobytes()
+
+
+def test_transform_batch_matches_the_pandas_path(setup):
+    scaler, vectorizer = setup
+    assert vectorizer.transform_batch(RECORDS).tobytes() == expected_rows(scaler).tobytes()
+
+
+def test_unknown_categories_encode_to_no_one_hot_column(setup):
+    _, vectorizer = setup
+    row = vectorizer.transform(RECORDS[2]).ravel()
+    for name in ('service_http', 'service_private', 'flag_SF', 'flag_S0'):
+        assert row[SELECTED.index(name)] == vectorizer.base[SELECTED.index(name)]
+
+
+def test_float32_block_is_the_float64_rows_rounded_once(setup):
+    _, vectorizer = setup
+    rows = vectorizer.transform_batch(RECORDS)
+    block = vectorizer.transform_batch(RECORDS, np.empty(rows.shape, dtype=np.float32))
+    assert block.tobytes() == rows.astype(np.float32).tobytes()
@@ -0,0 +1,15 @@
+import numpy as np
+
+from model_runtime import XGBoostScorer
+
+
+def test_scorer_matches_predict_inverse_transform_and_predict_proba(trained):
+    # With early stopping the trees after best_iteration must be ignored, as predict does
+    model, le, X = trained
+    labels, confidences, probs = XGBoostScorer(model, le).score(X)
+
+    # The engine's original path: predict + inverse_transform + predict_proba().max()
+    assert (labels == le.inverse_transform(model.predict(X))).all()
+    np.testing.assert_array_equal(confidences, model.predict_proba(X).max(axis=1))
+    np.testing.assert_array_equal(probs, model.predict_proba(X))
+
@@ -0,0 +1,77 @@
+from traffic_aggregator import HOST_WINDOW, TrafficAggregator
+
+
+def connection(source, dst='10.0.0.1', service='http', flag='SF', src_port=1234):
+    return {'source_ip': source, 'dst_ip': dst, 'service': service, 'flag': flag, 'src_port': src_port}
+
+
+def test_windows_are_keyed_on_the_destination_not_the_source():
+    agg = TrafficAggregator()
+    # A SYN flood spread over 50 sources, one connection each
+    for i in range(50):
+        record = agg.update(connection(f"192.168.0.{i}", flag='S0'), now=i * 0.01)
+    assert record['count'] == 50
+    assert record['srv_count'] == 50
+    assert record['serror_rate'] == 1.0
+    assert record['same_srv_rate'] == 1.0
+    assert record['dst_host_count'] == 50
+    assert record['dst_host_serror_rate'] == 1.0
+
+
+def test_service_and_host_rates():
+    agg = TrafficAggregator()
+    for i, (dst, service) in enumerate([('a', 'http'), ('a', 'ftp'), ('b', 'http'), ('a', 'http')]):
+        record = agg.update(connection('1.1.1.1', dst=dst, service=service), now=i * 0.1)
+    # Last connection: a/http. Same host: 3 (2 http), same service: 3 (2 to host a)
+    assert (record['count'], record['srv_count']) == (3, 3)
+    assert record['same_srv_rate'] == 0.67
+    assert record['diff_srv_rate'] == 0.33
+    assert record['srv_diff_host_rate'] == 0.33
+    assert (record['dst_host_count'], record['dst_host_srv_count']) == (3, 3)
+    assert record['dst_host_same_src_port_rate'] == 1.0
+
+
+def test_time_window_expires_and_host_window_keeps_the_last_100():
+    agg = TrafficAggregator()
+    for i in range(HOST_WINDOW + 20):
+        agg.update(connection('1.1.1.1'), now=0.0)
+    record = agg.update(connection('1.1.1.1', flag='REJ'), now=5.0)
+    assert record['count'] == 1
+    assert record['rerror_rate'] == 1.0
+    assert record['dst_host_count'] == HOST_WINDOW
+    assert record['dst_host_rerror_rate'] == 0.01
+    # Counters of connections that left both windows are gone
+    agg.update(connection('1.1.1.1', dst='other'), now=10.0)
+    assert len(agg.recent.n_dst) == 1
+
+
+def test_time_window_is_capped():
+    agg = TrafficAggregator(max_rate=512)
+    for i in range(2000):
+        record = agg.update(connection('1.1.1.1'), now=0.0)
+    assert len(agg) == 1024
+    assert record['count'] == 1024
+    assert agg.overflows == 2000 - 1024
+
+
+def test_binary_records_get_the_same_features_as_json():
+    import numpy as np
+    import wire_format
+
+    packets = [{'source_ip': f"192.168.0.{i}", 'protocol_type': 'tcp', 'service': ['http', 'private'][i % 2],
+                'flag': ['S0', 'SF', 'REJ'][i % 3], 'count': 1, 'serror_rate': 0.0} for i in range(30)]
+    arr = wire_format.decode(wire_format.pack_records(packets)).copy()
+    skip = np.zeros(len(arr), dtype=bool)
+    skip[5] = True
+    TrafficAggregator().update_array(arr, wire_format.VOCABULARIES, now=1.0, skip=skip)
+
+    reference = TrafficAggregator()
+    for i, packet in enumerate(packets):
+        if i == 5:
+            assert arr['count'][i] == 1  # skipped rows keep the sender's values
+            continue
+        expected = reference.update(dict(packet), now=1.0)
+        assert arr['count'][i] == expected['count']
+        assert arr['dst_host_srv_count'][i] == expected['dst_host_srv_count']
+        assert abs(arr['serror_rate'][i] - expected['serror_rate']) < 1e-6
+        assert abs(arr['srv_diff_host_rate'][i] - expected['srv_diff_host_rate']) < 1e-6
@@ -0,0 +1,43 @@
+import argparse
+
+import numpy as np
+
+from train_model import fit_model, split_validation
+
+N_CLASSES = 5
+
+
+def training_args():
+    return argparse.Namespace(learning_rate=None, tree_method='hist', n_jobs=1, early_stopping_rounds=5)
+
+
+def labelled_rows(labels, seed=0):
+    """Rows whose first feature separates the classes"""
+    rng = np.random.default_rng(seed)
+    y = np.asarray(labels, dtype=np.uint8)
+    X = rng.random((len(y), 6), dtype=np.float32)
+    X[:, 0] = y + rng.random(len(y)) * 0.5
+    return X, y
+
+
+def test_warm_start_on_a_capture_missing_classes():
+    X, y = labelled_rows(np.repeat(np.arange(N_CLASSES), 40))
+    base = fit_model(X, y, None, None, training_args(), n_estimators=10)
+
+    # Only DoS-like and R2L-like rows, as in a small live capture
+    X_new, y_new = labelled_rows([1] * 20 + [3] * 9 + [4], seed=1)
+    X_fit, y_fit, X_val, y_val = split_validation(X_new, y_new, 0.2)
+    model = fit_model(X_fit, y_fit, X_val, y_val, training_args(), n_estimators=5,
+                      xgb_model=base.get_booster(), n_classes=N_CLASSES)
+
+    assert model.n_classes_ == N_CLASSES
+    assert model.get_booster().num_boosted_rounds() > base.get_booster().num_boosted_rounds()
+    assert model.predict_proba(X).shape == (len(X), N_CLASSES)
+    assert (model.predict(X) == y).mean() > 0.9
+
+
+def test_split_validation_without_enough_rows_to_stratify():
+    X, y = labelled_rows([0] * 10 + [1] * 9 + [3])
+    X_fit, y_fit, X_val, y_val = split_validation(X, y, 0.1)
+    assert len(y_fit) + len(y_val) == len(y)
+    assert sorted(np.concatenate([y_fit, y_val])) == sorted(y)
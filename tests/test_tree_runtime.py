@@ -0,0 +1,43 @@
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler
+
+from model_runtime import XGBoostScorer
+from tree_runtime import export_compiled, load_compiled
+
+# float32 leaf sums in another order than xgboost's: confidences may differ in the last bits
+CONFIDENCE_TOLERANCE = 1e-5
+
+
+def compile_model(model, le, X, path):
+    names = [f"f{i}" for i in range(X.shape[1])]
+    scaler = MinMaxScaler().fit(X)
+    drift = export_compiled(model, le, scaler, names, names, X[:500], path)
+    assert drift < 1e-4
+    compiled = load_compiled(str(path))
+    compiled.check()
+    return compiled
+
+
+def test_compiled_ensemble_matches_the_booster(trained, tmp_path):
+    model, le, X = trained
+    compiled = compile_model(model, le, X, tmp_path / 'compiled_model.npz')
+
+    expected_labels, expected_conf, expected_probs = XGBoostScorer(model, le).score(X)
+    labels, confidences, probs = compiled.scorer.score(X)
+    assert (labels == expected_labels).all()
+    assert np.abs(confidences - expected_conf).max() < CONFIDENCE_TOLERANCE
+    assert np.abs(probs - expected_probs).max() < CONFIDENCE_TOLERANCE
+
+
+def test_compiled_ensemble_handles_missing_values_and_out_of_range_rows(trained, tmp_path):
+    model, le, X = trained
+    compiled = compile_model(model, le, X, tmp_path / 'compiled_model.npz')
+
+    rows = X[:200].copy()
+    rows[::3, 0] = np.nan
+    rows[1::3] *= 10
+    rows[2::3] -= 5
+    expected_labels, expected_conf, _ = XGBoostScorer(model, le).score(rows)
+    labels, confidences, _ = compiled.scorer.score(rows)
+    assert (labels == expected_labels).all()
+    assert np.abs(confidences - expected_conf).max() < CONFIDENCE_TOLERANCE
@@ -0,0 +1,12 @@
+import wire_format
+
+
+def test_source_ip_round_trip():
+    records = [{'source_ip': '192.168.1.10', 'protocol_type': 'tcp', 'service': 'http', 'flag': 'SF'},
+               {'protocol_type': 'udp'},
+               {'source_ip': 'not-an-ip'}]
+    arr = wire_format.decode(wire_format.pack_records(records))
+    ips = [wire_format.int_to_ip(code) for code in arr['source_ip']]
+    # Missing and unparsable addresses come back as None, like a JSON packet without one
+    assert ips == ['192.168.1.10', None, None]
+    assert list(arr['protocol_type']) == [1, 2, wire_format.CODE_UNKNOWN]
@@ -1,58 +1,310 @@
-import pandas as pd
+import numpy as np
+import xgboost as xgb
 from xgboost import XGBClassifier
 from sklearn.preprocessing import LabelEncoder
+from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
+import argparse
+import os
+import resource
+import time
+from contextlib import contextmanager
+from tree_runtime import COMPILED_MODEL, export_compiled, load_compiled
+from prefilter import PREFILTER_PATH, TARGET_MISS_RATE, fast_path_report, train_prefilter
+import model_variants
+import dataset_cache
+from profiling import TRACE_INTERVAL, SampledLog, Tracer, install_toggle
 
-# 1. Load Data (Preprocessed)
-print("Loading data...")
-X_train = pd.read_csv('X_train_processed.csv')
-y_train = pd.read_csv('y_train_processed.csv').values.ravel()
-X_test = pd.read_csv('X_test_processed.csv')
-y_test = pd.read_csv('y_test_processed.csv').values.ravel()
-
-# --- CRITICAL CHANGE FOR R2L/U2R ---
-# Instead of selecting "Top 20", we use ALL features.
-# R2L and U2R rely on rare features like 'root_shell' or 'num_failed_logins'
-# which get deleted in a "Top 20" selection.
-selected_features = X_train.columns.tolist() 
-
-print(f"Training on ALL {len(selected_features)} features to capture R2L/U2R patterns...")
-
-X_train_selected = X_train[selected_features]
-X_test_selected = X_test[selected_features]
-
-# 2. Encode Labels (Required for XGBoost)
-le = LabelEncoder()
-y_train_enc = le.fit_transform(y_train)
-y_test_enc = le.transform(y_test)
-
-# 3. Train XGBoost
-print("Training XGBoost (this might take 10-20 seconds)...")
-model = XGBClassifier(
-    n_estimators=100, 
-    eval_metric='mlogloss',
-)
-model.fit(X_train_selected, y_train_enc)
-
-# 4. Evaluate
-print("Evaluating...")
-y_pred = model.predict(X_test_selected)
-acc = accuracy_score(y_test_enc, y_pred)
-print(f"Test Accuracy: {acc:.4f}")
-print("\nClassification Report:")
-print(classification_report(y_test_enc, y_pred, target_names=le.classes_))
-
-# 5. Save Everything
-print("Saving artifacts...")
-
-# We save it as 'xgboost_model.pkl' 
-joblib.dump(model, 'models/xgboost_model.pkl') 
-
-# Save the encoder (needed to turn 0,1,2 back into 'DoS', 'Normal')
-joblib.dump(le, 'models/label_encoder.pkl')
-
-# Save the feature list (which is now ALL features)
-joblib.dump(selected_features, 'models/selected_features.pkl')
-
-print("Done! Ready for Live Demo.")
\ No newline at end of file
+MODEL_PATH = 'models/xgboost_model.pkl'
+ENCODER_PATH = 'models/label_encoder.pkl'
+FEATURES_PATH = 'models/selected_features.pkl'
+
+# --- Training Configuration ---
+N_ESTIMATORS = 100           # boosting rounds (added rounds when warm-starting)
+TREE_METHOD = 'hist'         # histogram splits; fit() builds a QuantileDMatrix for it
+VALIDATION_FRACTION = 0.1    # held out from the training split for early stopping
+EARLY_STOPPING_ROUNDS = 10
+SPLIT_SEED = 42
+
+# --- Tracing (--trace, or SIGUSR1 while running) ---
+# Every stage() below is also a trace span: a breakdown of the finished stages
+# is logged every --trace-interval seconds and at the end. See profiling.py.
+tracer = Tracer('train_model', SampledLog())
+
+@contextmanager
+def stage(name):
+    """Print wall time and peak RSS of one training stage"""
+    start = time.perf_counter()
+    with tracer.span(name):
+        yield
+    # ru_maxrss is in KB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"   ⏱️  {name}: {time.perf_counter() - start:.2f}s, peak RSS {peak:.0f} MB")
+
+def load_new_data(paths, feature_names, classes):
+    """Encode labelled captures (NSL-KDD format) with the existing scaler and columns"""
+    import preprocessing
+    scaler = joblib.load('scaler.pkl')
+    X, y = [], []
+    for path in paths:
+        for chunk in preprocessing.read_chunks(path):
+            X.append(preprocessing.encode_chunk(chunk, feature_names, scaler).astype(np.float32))
+            y.append(dataset_cache.encode_labels(chunk['attack_category'], classes))
+    return np.concatenate(X), np.concatenate(y)
+
+def split_validation(X, y, fraction, seed=SPLIT_SEED):
+    """Stratified hold-out -> (X_fit, y_fit, X_val, y_val); no hold-out when fraction is 0"""
+    if fraction <= 0:
+        return X, y, None, None
+    # Stratifying needs 2+ rows per class and room for every class on both sides,
+    # which small warm-start captures may not have
+    counts = np.bincount(y)
+    counts = counts[counts > 0]
+    n_val = int(np.ceil(fraction * len(y)))
+    stratify = y
+    if counts.min() < 2 or len(counts) > min(n_val, len(y) - n_val):
+        print("⚠️  Too few rows per class to stratify, using an unstratified validation split")
+        stratify = None
+    fit_idx, val_idx = train_test_split(np.arange(len(y)), test_size=fraction,
+                                        stratify=stratify, random_state=seed)
+    # Sorted indices keep the memmap reads sequential
+    fit_idx.sort()
+    val_idx.sort()
+    return X[fit_idx], y[fit_idx], X[val_idx], y[val_idx]
+
+def fit_model(X_fit, y_fit, X_val, y_val, args, n_estimators, max_depth=None, xgb_model=None, n_classes=None):
+    """Train one XGBClassifier with the command-line settings (early stopping on X_val).
+    With xgb_model, add n_estimators rounds to that booster for n_classes classes."""
+    params = {'max_depth': max_depth, 'learning_rate': args.learning_rate}
+    model = XGBClassifier(
+        n_estimators=n_estimators,
+        eval_metric='mlogloss',
+        tree_method=args.tree_method,
+        n_jobs=args.n_jobs,
+        early_stopping_rounds=args.early_stopping_rounds if X_val is not None else None,
+        **{k: v for k, v in params.items() if v is not None},
+    )
+    if xgb_model is None:
+        model.fit(X_fit, y_fit,
+                  eval_set=[(X_val, y_val)] if X_val is not None else None,
+                  verbose=False)
+        return model
+    # XGBClassifier.fit infers the classes from y and rejects a capture that lacks
+    # some of them (small captures rarely hold R2L / U2R), so boost with xgb.train
+    train_params = {'objective': 'multi:softprob', 'num_class': n_classes, 'eval_metric': 'mlogloss',
+                    'tree_method': args.tree_method, 'nthread': args.n_jobs,
+                    'max_depth': max_depth, 'learning_rate': args.learning_rate}
+    evals = [(xgb.DMatrix(X_val, label=y_val), 'validation_0')] if X_val is not None else []
+    booster = xgb.train({k: v for k, v in train_params.items() if v is not None},
+                        xgb.DMatrix(X_fit, label=y_fit), num_boost_round=n_estimators, evals=evals,
+                        early_stopping_rounds=args.early_stopping_rounds if evals else None,
+                        xgb_model=xgb_model, verbose_eval=False)
+    # load_model() takes n_classes_ from the booster, not from the labels
+    model.load_model(bytearray(booster.save_raw()))
+    return model
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the XGBoost detection model")
+    parser.add_argument('--n-estimators', type=int, default=N_ESTIMATORS,
+                        help="Boosting rounds (rounds added on top of the model with --warm-start)")
+    parser.add_argument('--max-depth', type=int, default=None, help="Max tree depth (XGBoost default 6)")
+    parser.add_argument('--learning-rate', type=float, default=None, help="Shrinkage (XGBoost default 0.3)")
+    parser.add_argument('--tree-method', default=TREE_METHOD, choices=['hist', 'approx', 'exact'])
+    parser.add_argument('--n-jobs', type=int, default=None, help="Training threads (default: all cores)")
+    parser.add_argument('--validation-fraction', type=float, default=VALIDATION_FRACTION,
+                        help="Share of the training split held out for early stopping (0 disables it)")
+    parser.add_argument('--early-stopping-rounds', type=int, default=EARLY_STOPPING_ROUNDS)
+    parser.add_argument('--warm-start', action='store_true',
+                        help=f"Continue boosting from {MODEL_PATH} instead of starting from scratch")
+    parser.add_argument('--new-data', nargs='+', default=[],
+                        help="Labelled captures in NSL-KDD format to train on. With --warm-start "
+                             "only these are used, otherwise they are added to the cached split")
+    parser.add_argument('--cache-dir', default=dataset_cache.CACHE_DIR)
+    parser.add_argument('--prefilter-miss-rate', type=float, default=TARGET_MISS_RATE,
+                        help="Max share of any attack class the cascade prefilter may pass as "
+                             "Normal, R2L/U2R in practice (0 skips training it)")
+    parser.add_argument('--variants', nargs='*', metavar='NAME',
+                        help=f"Also train and benchmark smaller model variants "
+                             f"(default: all of {', '.join(model_variants.VARIANTS)})")
+    parser.add_argument('--trace', action='store_true',
+                        help="Log a per-stage timing breakdown (toggle at runtime with SIGUSR1)")
+    parser.add_argument('--trace-interval', type=float, default=TRACE_INTERVAL,
+                        help="Seconds between breakdowns while tracing")
+    args = parser.parse_args()
+    tracer.interval = max(0.1, args.trace_interval)
+    install_toggle(tracer.toggle)
+    if args.trace:
+        tracer.set_enabled(True)
+    total_start = time.perf_counter()
+
+    # 1. Load Data (Preprocessed)
+    # Memory-mapped float32 matrices written by preprocessing.py: nothing is parsed
+    print("Loading data...")
+    with stage("load"):
+        arrays, manifest = dataset_cache.load(args.cache_dir)
+        X_train, y_train = arrays['X_train'], arrays['y_train']
+        X_test, y_test = arrays['X_test'], arrays['y_test']
+        if 'train_original_rows' not in manifest:
+            raise SystemExit("❌ The preprocessed cache predates this version, run preprocessing.py again")
+        # Rows of real traffic in X_train (SMOTE appends its synthetic rows after them)
+        original_rows = np.arange(manifest['train_original_rows'])
+
+        # --- CRITICAL CHANGE FOR R2L/U2R ---
+        # Instead of selecting "Top 20", we use ALL features.
+        # R2L and U2R rely on rare features like 'root_shell' or 'num_failed_logins'
+        # which get deleted in a "Top 20" selection.
+        selected_features = manifest['columns']
+
+        # 2. Encode Labels (Required for XGBoost)
+        # The cache stores codes into the sorted class names, i.e. LabelEncoder's codes
+        le = LabelEncoder().fit(manifest['classes'])
+
+        existing = None
+        if args.warm_start:
+            existing = joblib.load(MODEL_PATH)
+            old_classes = list(joblib.load(ENCODER_PATH).classes_)
+            if old_classes != list(le.classes_) or existing.n_features_in_ != len(selected_features):
+                raise SystemExit("❌ Cannot warm-start: the cached data has different classes or "
+                                 "features than the current model (retrain from scratch)")
+
+        if args.new_data:
+            X_new, y_new = load_new_data(args.new_data, selected_features, manifest['classes'])
+            print(f"Loaded {len(y_new)} new labelled rows from {len(args.new_data)} file(s)")
+            if args.warm_start:
+                X_train, y_train = X_new, y_new
+                original_rows = np.arange(len(y_new))
+            else:
+                original_rows = np.concatenate([original_rows, len(y_train) + np.arange(len(y_new))])
+                X_train = np.concatenate([X_train, X_new])
+                y_train = np.concatenate([y_train, y_new])
+
+        X_fit, y_fit, X_val, y_val = split_validation(X_train, y_train, args.validation_fraction)
+
+    print(f"Training on ALL {len(selected_features)} features to capture R2L/U2R patterns...")
+
+    # 3. Train XGBoost
+    mode = "continuing from the current model" if existing is not None else "from scratch"
+    print(f"Training XGBoost ({args.tree_method}, {len(y_fit)} rows, {mode})...")
+    with stage("train"):
+        model = fit_model(X_fit, y_fit, X_val, y_val, args, args.n_estimators, args.max_depth,
+                          existing.get_booster() if existing is not None else None, len(le.classes_))
+    rounds = model.get_booster().num_boosted_rounds()
+    if X_val is not None:
+        print(f"Best iteration {model.best_iteration} of {rounds} "
+              f"(validation mlogloss {model.best_score:.4f})")
+
+    # 4. Evaluate
+    print("Evaluating...")
+    with stage("evaluate"):
+        y_pred = model.predict(X_test)
+        acc = accuracy_score(y_test, y_pred)
+    print(f"Test Accuracy: {acc:.4f}")
+    print("\nClassification Report:")
+    print(classification_report(y_test, y_pred, labels=np.arange(len(le.classes_)),
+                                target_names=le.classes_, zero_division=0))
+
+    # 5. Cascade Prefilter (detection_engine.py --cascade)
+    # A linear screen in front of the model; its threshold is calibrated so at
+    # most --prefilter-miss-rate of any attack class (R2L/U2R bind) skips the model.
+    # It is fit and calibrated on original rows only: SMOTE rows are interpolated
+    # between real ones, so they would leak across the calibration folds.
+    prefilter = None
+    if args.prefilter_miss_rate > 0:
+        print(f"Training cascade prefilter (target miss rate {args.prefilter_miss_rate:.2%} per attack class, "
+              f"{len(original_rows)} original rows)...")
+        with stage("prefilter"):
+            X_original, y_original = X_train[original_rows], y_train[original_rows]
+            try:
+                prefilter = train_prefilter(X_original, y_original, le.classes_, selected_features,
+                                            args.prefilter_miss_rate)
+            except ValueError as e:
+                print(f"⚠️  Skipping the prefilter: {e}")
+        if prefilter is not None:
+            report = fast_path_report(prefilter, X_test, y_test, le.classes_)
+            prefilter.report['test'] = report
+            fast = prefilter.margins(X_test) < prefilter.threshold
+            cascade_pred = np.where(fast, list(le.classes_).index('Normal'), y_pred)
+            print(f"Prefilter: {report['fast_path']:.1%} of test rows skip the full model")
+            print(f"   {'class':>7} {'skipped':>8} {'recall':>8} {'cascade':>8}")
+            for code, name in enumerate(le.classes_):
+                rows = y_test == code
+                if rows.any():
+                    print(f"   {name:>7} {report[name]:>8.2%} {(y_pred[rows] == code).mean():>8.2%} "
+                          f"{(cascade_pred[rows] == code).mean():>8.2%}")
+
+    # 6. Save Everything
+    print("Saving artifacts...")
+    with stage("save"):
+        # We save it as 'xgboost_model.pkl'
+        joblib.dump(model, MODEL_PATH)
+
+        # Save the encoder (needed to turn 0,1,2 back into 'DoS', 'Normal')
+        joblib.dump(le, ENCODER_PATH)
+
+        # Save the feature list (which is now ALL features)
+        joblib.dump(selected_features, FEATURES_PATH)
+
+        if prefilter is not None:
+            prefilter.save(PREFILTER_PATH)
+
+        # 7. Export the compiled ensemble (detection_engine.py --runtime compiled)
+        # It also carries the scaler arrays, so the engine needs no other artifact.
+        scaler = joblib.load('scaler.pkl')
+        feature_names = joblib.load('feature_names.pkl')
+        drift = export_compiled(model, le, scaler, selected_features, feature_names,
+                                X_test[:2000], COMPILED_MODEL)
+
+    # Parity check against the pickled model on the test split
+    compiled = load_compiled(COMPILED_MODEL)
+    compiled_pred = compiled.scorer.score(X_test)[0]
+    parity = (compiled_pred == le.inverse_transform(y_pred)).mean()
+    print(f"Compiled ensemble: {parity:.4%} label parity on the test split (margin drift {drift:.1e})")
+    if parity < 1.0:
+        print("⚠️  Compiled ensemble disagrees with the pickled model, do not use --runtime compiled")
+
+    # 8. Model Variants (detection_engine.py --config, see model_variants.py)
+    # Fewer / shallower trees and gain-ranked feature subsets that keep the
+    # R2L/U2R indicators, benchmarked against the full model on the test split.
+    if args.variants is not None:
+        names = args.variants or list(model_variants.VARIANTS)
+        unknown = [name for name in names if name not in model_variants.VARIANTS]
+        if unknown:
+            raise SystemExit(f"❌ Unknown variant(s) {unknown}, choose from {list(model_variants.VARIANTS)}")
+        print(f"Training {len(names)} model variant(s)...")
+        with stage("benchmark full model"):
+            results = [model_variants.benchmark_variant('full', model, le, COMPILED_MODEL, X_test, y_test)]
+        for name in names:
+            spec = model_variants.VARIANTS[name]
+            with stage(f"variant {name}"):
+                features = model_variants.select_features(model.get_booster(), le.classes_,
+                                                          selected_features, spec.get('top_features'))
+                cols = np.array([selected_features.index(f) for f in features])
+
+                def subset(X):
+                    return None if X is None else np.asarray(X[:, cols], dtype=np.float32)
+
+                variant = fit_model(subset(X_fit), y_fit, subset(X_val), y_val, args,
+                                    spec.get('n_estimators', args.n_estimators),
+                                    spec.get('max_depth', args.max_depth))
+                paths = model_variants.save_variant(name, variant, le, scaler, features, feature_names,
+                                                    subset(X_test[:2000]))
+                if prefilter is not None:
+                    try:
+                        train_prefilter(subset(X_original), y_original, le.classes_, features,
+                                        args.prefilter_miss_rate).save(paths['prefilter'])
+                    except ValueError as e:
+                        print(f"⚠️  Skipping the prefilter of variant {name}: {e}")
+                        # A prefilter left from an earlier run would not match this variant
+                        if os.path.exists(paths['prefilter']):
+                            os.remove(paths['prefilter'])
+                results.append(model_variants.benchmark_variant(name, variant, le, paths['compiled_model'],
+                                                                subset(X_test), y_test, spec))
+        model_variants.write_report(results)
+        print(f"\nVariants (recall on the test split, median ms per batch by runtime @ batch size) "
+              f"-> {model_variants.REPORT_PATH}")
+        model_variants.print_report(results)
+
+    print(f"Done in {time.perf_counter() - total_start:.1f}s! Ready for Live Demo.")
+    if tracer.enabled:
+        tracer.report()
@@ -0,0 +1,316 @@
+"""
+Compiled tree-ensemble runtime for the detection engine.
+
+train_model.py exports the trained XGBClassifier as one .npz file of flat
+NumPy arrays together with the class names and the vectorizer's scaler
+arrays, so the engine needs neither xgboost, scikit-learn nor pandas:
+`--runtime compiled` loads only this file.
+
+Every tree is padded to a perfect binary tree and stored level by level, so a
+row's position in the next level is 2 * pos + went_right. Split thresholds are
+replaced by their rank among the thresholds of the same feature: a batch is
+binned once (one searchsorted over all features) and each tree level is then
+two integer gathers for all rows and trees at once.
+
+The base margin is not parsed from the model config: it is calibrated at
+export time as (xgboost margin - sum of leaves) on sample rows, which also
+covers boost_from_average and per-class base scores.
+
+tests/test_tree_runtime.py checks labels (exactly) and confidences (within a
+fixed tolerance) against the booster. `python tree_runtime.py` checks the
+trained artifact against the pickled model on the NSL-KDD test split (the
+preprocessed cache).
+"""
+import json
+from types import SimpleNamespace
+
+import numpy as np
+
+from feature_vectorizer import FeatureVectorizer
+
+COMPILED_MODEL = 'models/compiled_model.npz'
+# Max |xgboost margin - compiled margin| tolerated at export
+MARGIN_TOLERANCE = 1e-4
+# Trees are padded to perfect binary trees, so depth is bounded
+MAX_DEPTH = 12
+# Local split index of padding nodes (always go left) and bin of missing values
+PAD_SPLIT = MISSING_BIN = 0xFFFF
+
+
+def _ordered_keys(values):
+    """float32 -> uint32 with the same ordering (-0.0 folded into +0.0)"""
+    bits = (np.asarray(values, dtype=np.float32) + np.float32(0)).view(np.uint32)
+    return np.where(bits >> 31, ~bits, bits | np.uint32(0x80000000))
+
+
+def _flatten(booster, iteration_range=(0, 0)):
+    """booster.save_raw('json') -> level-major perfect-tree arrays, trees grouped by class"""
+    learner = json.loads(booster.save_raw('json'))['learner']
+    objective = learner['objective']['name']
+    gbtree = learner['gradient_booster']['model']
+    indptr = gbtree['iteration_indptr']
+    begin, end = iteration_range
+    end = end or len(indptr) - 1
+    trees = gbtree['trees'][indptr[begin]:indptr[end]]
+    tree_info = gbtree['tree_info'][indptr[begin]:indptr[end]]
+    # Trees of one class are contiguous, so per-class margins are one reduceat
+    order = sorted(range(len(trees)), key=lambda t: tree_info[t])
+    trees = [trees[t] for t in order]
+    classes = np.asarray(tree_info)[order]
+
+    # Pass 1: depth and the sorted split thresholds of every feature
+    thresholds = {}
+    depth = 0
+    for tree in trees:
+        if any(tree['split_type']):
+            raise ValueError("categorical splits are not supported by the compiled runtime")
+        parents = tree['parents']
+        node_depth = [0] * len(parents)
+        for node in range(1, len(parents)):  # parents always precede their children
+            node_depth[node] = node_depth[parents[node]] + 1
+        depth = max(depth, max(node_depth))
+        for node, left in enumerate(tree['left_children']):
+            if left != -1:
+                thresholds.setdefault(tree['split_indices'][node], set()).add(tree['split_conditions'][node])
+    if depth > MAX_DEPTH:
+        raise ValueError(f"trees of depth {depth} are too deep for the compiled runtime")
+    split_features = np.array(sorted(thresholds), dtype=np.intp)
+    slot = {f: i for i, f in enumerate(split_features)}
+    sorted_thresholds = {f: np.unique(np.asarray(list(thresholds[f]), dtype=np.float32) + np.float32(0))
+                         for f in split_features}
+    if max(len(t) for t in sorted_thresholds.values()) >= PAD_SPLIT:
+        raise ValueError("too many distinct thresholds on one feature for the compiled runtime")
+
+    # Pass 2: every tree becomes a perfect tree of `depth` levels. A node key is
+    # (feature slot << 16) | index of its threshold among that feature's thresholds;
+    # padding below early leaves always goes left and leaf values are copied to
+    # the leftmost slot of the last level.
+    n_trees = len(trees)
+    node_keys = np.full(n_trees * (2 ** depth - 1), PAD_SPLIT, dtype=np.int32)
+    default_left = np.ones(len(node_keys), dtype=bool)
+    leaf_values = np.zeros(n_trees << depth, dtype=np.float32)
+    for t, tree in enumerate(trees):
+        left, right = tree['left_children'], tree['right_children']
+        stack = [(0, 0, 0)]  # (node, level, position in level)
+        while stack:
+            node, level, pos = stack.pop()
+            if left[node] == -1:
+                leaf_values[(t << depth) + (pos << (depth - level))] = tree['split_conditions'][node]
+                continue
+            f = tree['split_indices'][node]
+            k = np.searchsorted(sorted_thresholds[f], np.float32(tree['split_conditions'][node]) + np.float32(0))
+            i = n_trees * (2 ** level - 1) + (t << level) + pos
+            node_keys[i] = (slot[f] << 16) | int(k)
+            default_left[i] = bool(tree['default_left'][node])
+            stack.append((left[node], level + 1, 2 * pos))
+            stack.append((right[node], level + 1, 2 * pos + 1))
+
+    # All thresholds in one sorted uint64 array: (feature slot << 32) | ordered float bits
+    split_keys = np.concatenate([(np.uint64(i) << np.uint64(32)) | _ordered_keys(sorted_thresholds[f]).astype(np.uint64)
+                                 for i, f in enumerate(split_features)])
+    counts = [len(sorted_thresholds[f]) for f in split_features]
+    return {
+        'node_keys': node_keys,
+        'default_left': default_left,
+        'leaf_values': leaf_values,
+        'split_features': split_features,
+        'split_keys': split_keys,
+        'split_starts': np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int32),
+        'class_starts': np.searchsorted(classes, np.unique(classes)).astype(np.intp),
+        'max_depth': np.int32(depth),
+        'objective': np.str_(objective),
+        'n_features': np.int32(booster.num_features()),
+    }
+
+
+class CompiledEnsemble:
+    """Vectorized evaluation of a flattened tree ensemble"""
+
+    def __init__(self, arrays):
+        self.node_keys = arrays['node_keys']
+        self.default_left = arrays['default_left']
+        self.leaf_values = arrays['leaf_values']
+        self.split_features = arrays['split_features']
+        self.split_keys = arrays['split_keys']
+        self.split_starts = arrays['split_starts']
+        self.class_starts = arrays['class_starts']
+        self.max_depth = int(arrays['max_depth'])
+        self.objective = str(arrays['objective'])
+        self.n_features = int(arrays['n_features'])
+        self.base_margin = arrays.get('base_margin', np.zeros(len(self.class_starts)))
+
+        n_trees = len(self.leaf_values) >> self.max_depth
+        trees = np.arange(n_trees, dtype=np.intp)
+        self._level_base = [n_trees * (2 ** level - 1) + (trees << level) for level in range(self.max_depth)]
+        self._leaf_base = trees << self.max_depth
+        self._slot_keys = np.arange(len(self.split_features), dtype=np.uint64) << np.uint64(32)
+
+    def bins(self, x):
+        """Per split feature: how many of its thresholds are <= the value (one searchsorted)"""
+        values = x[:, self.split_features]
+        keys = self._slot_keys | _ordered_keys(values).astype(np.uint64)
+        bins = np.searchsorted(self.split_keys, keys, side='right').astype(np.int32)
+        bins -= self.split_starts
+        missing = np.isnan(values)
+        if missing.any():
+            bins[missing] = MISSING_BIN
+        return bins
+
+    def leaf_sums(self, features):
+        """Per-class sum of leaf values (the margin without the base score)"""
+        # XGBoost compares float32 feature values against float32 thresholds:
+        # x < threshold goes left, i.e. right when the threshold is in the bin count
+        x = np.ascontiguousarray(features, dtype=np.float32)
+        bins = self.bins(x)
+        has_missing = (bins == MISSING_BIN).any()
+        flat = bins.ravel()
+        rows = (np.arange(len(x), dtype=np.intp) * bins.shape[1])[:, None]
+        pos = np.zeros((len(x), len(self._leaf_base)), dtype=np.intp)
+        for base in self._level_base:
+            idx = pos + base
+            key = np.take(self.node_keys, idx)
+            b = np.take(flat, rows + (key >> 16))
+            right = b > (key & 0xFFFF)
+            if has_missing:
+                missing = b == MISSING_BIN
+                right[missing] = ~self.default_left[idx[missing]]
+            pos <<= 1
+            pos += right
+        leaves = np.take(self.leaf_values, pos + self._leaf_base)
+        return np.add.reduceat(leaves.astype(np.float64), self.class_starts, axis=1)
+
+    def predict_proba(self, features):
+        margin = self.leaf_sums(features) + self.base_margin
+        if self.objective.startswith('binary:'):
+            p = 1.0 / (1.0 + np.exp(-margin[:, 0]))
+            return np.column_stack([1.0 - p, p])
+        margin -= margin.max(axis=1, keepdims=True)
+        np.exp(margin, out=margin)
+        margin /= margin.sum(axis=1, keepdims=True)
+        return margin
+
+
+class CompiledScorer:
+    """Drop-in replacement for model_runtime.XGBoostScorer backed by CompiledEnsemble"""
+
+    def __init__(self, ensemble, class_names):
+        self.ensemble = ensemble
+        self.class_names = np.asarray(class_names, dtype=object)
+
+    def set_threads(self, threads):
+        """NumPy evaluation is single-threaded per process; nothing to configure"""
+
+    def predict_proba(self, features):
+        return self.ensemble.predict_proba(features)
+
+    def score(self, features):
+        """One ensemble call -> (class names, confidences, probabilities)"""
+        probs = self.predict_proba(features)
+        pred_index = probs.argmax(axis=1)
+        confidences = probs[np.arange(len(pred_index)), pred_index]
+        return self.class_names[pred_index], confidences, probs
+
+
+class CompiledBundle:
+    """Same interface as model_runtime.ModelBundle, built from the .npz artifact alone"""
+
+    def __init__(self, arrays, version):
+        self.version = version
+        self.feature_names = [str(name) for name in arrays['feature_names']]
+        self.selected_features = [str(name) for name in arrays['selected_features']]
+        # Only the MinMax parameters of the scaler are needed by the vectorizer
+        scaler = SimpleNamespace(scale_=arrays['scaler_scale'], min_=arrays['scaler_min'],
+                                 clip=bool(arrays['scaler_clip']),
+                                 feature_range=tuple(arrays['scaler_feature_range']))
+        self.vectorizer = FeatureVectorizer(self.feature_names, scaler, self.selected_features)
+        self.scorer = CompiledScorer(CompiledEnsemble(arrays), arrays['class_names'])
+
+    def check(self):
+        """Raise ValueError if the artifact does not describe one consistent schema"""
+        ensemble = self.scorer.ensemble
+        if ensemble.n_features != len(self.selected_features):
+            raise ValueError(f"ensemble expects {ensemble.n_features} features, "
+                             f"selected_features lists {len(self.selected_features)}")
+        if len(ensemble.split_features) and int(ensemble.split_features.max()) >= ensemble.n_features:
+            raise ValueError("ensemble splits on a feature index outside the schema")
+        if 'Normal' not in self.scorer.class_names:
+            raise ValueError(f"no 'Normal' class: {list(self.scorer.class_names)}")
+
+    def warm(self, rows=256):
+        self.scorer.score(self.vectorizer.transform_batch([{}] * rows))
+
+
+def export_compiled(model, label_encoder, scaler, selected_features, feature_names,
+                    sample, path=COMPILED_MODEL):
+    """Flatten a fitted XGBClassifier into `path`; `sample` rows calibrate the base margin"""
+    booster = model.get_booster()
+    try:
+        iteration_range = (0, model.best_iteration + 1)
+    except AttributeError:
+        iteration_range = (0, 0)
+    arrays = _flatten(booster, iteration_range)
+
+    sample = np.asarray(sample, dtype=np.float32)
+    expected = booster.inplace_predict(sample, iteration_range=iteration_range,
+                                       predict_type='margin', validate_features=False)
+    expected = np.asarray(expected, dtype=np.float64).reshape(len(sample), -1)
+    offset = expected - CompiledEnsemble(arrays).leaf_sums(sample)
+    arrays['base_margin'] = offset.mean(axis=0)
+    drift = float(np.abs(offset - arrays['base_margin']).max())
+    if drift > MARGIN_TOLERANCE:
+        raise ValueError(f"compiled ensemble disagrees with xgboost (margin drift {drift:.2e})")
+
+    np.savez(
+        path,
+        class_names=np.asarray(label_encoder.classes_, dtype=str),
+        feature_names=np.asarray(feature_names, dtype=str),
+        selected_features=np.asarray(selected_features, dtype=str),
+        scaler_scale=np.asarray(scaler.scale_, dtype=np.float64),
+        scaler_min=np.asarray(scaler.min_, dtype=np.float64),
+        scaler_clip=np.bool_(getattr(scaler, 'clip', False)),
+        scaler_feature_range=np.asarray(scaler.feature_range, dtype=np.float64),
+        **arrays,
+    )
+    return drift
+
+
+def load_compiled(path=COMPILED_MODEL, version=None):
+    """Load the .npz artifact -> CompiledBundle (raises FileNotFoundError if missing)"""
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    return CompiledBundle(arrays, version)
+
+
+if __name__ == "__main__":
+    import sys
+    import dataset_cache
+    from model_runtime import load_bundle
+
+    compiled = load_compiled()
+    compiled.check()
+    reference = load_bundle()
+
+    try:
+        arrays, manifest = dataset_cache.load()
+        features = arrays['X_test']
+        y_test = np.asarray(manifest['classes'], dtype=object)[arrays['y_test']]
+        split = "NSL-KDD test split"
+    except FileNotFoundError:
+        print("⚠️  No preprocessed cache found (run preprocessing.py): checking on sampled packets, "
+              "accuracy is not reported")
+        from feature_vectorizer import _sample_records
+        features = reference.vectorizer.transform_batch(_sample_records(reference.vectorizer, 5000))
+        y_test = None
+        split = "sampled packets (no preprocessed cache found)"
+
+    expected_labels, expected_conf, _ = reference.scorer.score(features)
+    labels, confidences, _ = compiled.scorer.score(features)
+    agree = float((labels == expected_labels).mean())
+    drift = float(np.abs(confidences - expected_conf).max())
+    ok = agree == 1.0 and drift < 1e-5
+    print(f"{'✅' if ok else '❌'} Compiled ensemble vs pickled model on {len(features)} rows ({split}): "
+          f"label agreement {agree:.4%}, max confidence difference {drift:.2e}")
+    if y_test is not None and len(features) > 0:
+        print(f"   Accuracy: pickled {np.mean(expected_labels == y_test):.4f}, "
+              f"compiled {np.mean(labels == y_test):.4f}")
+    sys.exit(0 if ok else 1)
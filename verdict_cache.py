@@ -0,0 +1,78 @@
+"""
+Verdict cache in front of the model.
+
+Attack traffic is highly repetitive (every Neptune packet from generate_dos is
+byte-identical), so verdicts are cached per encoded feature row. The key is
+the row cast to float32 -- exactly what XGBoost sees -- so an exact-mode hit
+returns the same label and confidence the model would. Optionally the rate
+columns are rounded to `decimals` first, letting near-identical rows share a
+verdict.
+
+Entries live in an LRU with a TTL; the memory cap is turned into a maximum
+entry count from the key size. clear() must be called whenever the model
+artifacts change.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+# Approximate per-entry overhead of the OrderedDict slot, key object and value tuple
+ENTRY_OVERHEAD = 200
+
+
+class VerdictCache:
+    """LRU + TTL cache of (label, confidence) keyed by quantized feature rows"""
+
+    def __init__(self, n_features, max_bytes=32 * 1024 * 1024, ttl=300.0,
+                 quantize_cols=None, decimals=None):
+        self.max_entries = max(1, max_bytes // (4 * n_features + ENTRY_OVERHEAD))
+        self.ttl = ttl
+        self.quantize_cols = quantize_cols if decimals is not None else None
+        self.decimals = decimals
+        self._entries = OrderedDict()  # key -> (label, confidence, expires)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Drop every verdict (call after the model artifacts are reloaded)"""
+        self._entries.clear()
+
+    def keys(self, features):
+        """One bytes key per row: float32 row, with optional rate quantization"""
+        rows = features.astype(np.float32)
+        if self.quantize_cols is not None:
+            rows[:, self.quantize_cols] = np.round(rows[:, self.quantize_cols], self.decimals)
+        data = rows.tobytes()
+        size = rows.shape[1] * 4
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def lookup(self, keys, labels, confidences, now):
+        """Fill cached verdicts into labels / confidences -> indices of the misses"""
+        misses = []
+        entries = self._entries
+        for i, key in enumerate(keys):
+            hit = entries.get(key)
+            if hit is not None and hit[2] > now:
+                entries.move_to_end(key)
+                labels[i] = hit[0]
+                confidences[i] = hit[1]
+            else:
+                misses.append(i)
+        self.hits += len(keys) - len(misses)
+        self.misses += len(misses)
+        return misses
+
+    def store(self, keys, labels, confidences, now):
+        entries = self._entries
+        expires = now + self.ttl
+        for key, label, confidence in zip(keys, labels, confidences):
+            entries[key] = (label, confidence, expires)
+            entries.move_to_end(key)
+        overflow = len(entries) - self.max_entries
+        for _ in range(max(0, overflow)):
+            entries.popitem(last=False)
+        self.evictions += max(0, overflow)